@@ -2,7 +2,8 @@
 """Package to manage finances of a prestation-based business."""
 
 # Array of monthly bonuses methods. These methods will be given all
-# monthly params, and must return a float.
+# monthly params, and must return a float. A bonus may also be given as
+# a commission formula using monthly params only.
 #
 # Example usage:
 #     def bonus_net_margin(**kwargs):
@@ -11,5 +12,6 @@
 #         return float(0)
 #
 #     COMMISSIONS_BONUSES.append(bonus_net_margin)
+#     COMMISSIONS_BONUSES.append('0.02*{m_bc} if {m_bc} >= 10000 else 0')
 
 COMMISSIONS_BONUSES = []
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the financial queries of mozfinance.
+
+A synthetic dataset (years x prestations x bills x salesmen) is
+generated into a SQLite database through the models, then cold and warm
+cache reads of months', years' and salesmen's figures, the expire
+cascade and the import itself are timed. Results are machine-readable
+(JSON) to be compared between revisions.
+
+Usage:
+    python -m mozfinance.benchmark --years 2 --prestations 50 \\
+        --bills 3 --salesmen 5 --repeat 5 --output bench.json
+
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import sys
+import time
+from importlib import import_module
+
+import sqlalchemy
+from dogpile.cache import make_region
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from mozbase.util.database import transaction
+
+from mozfinance.biz import BusinessObject
+
+
+PACKAGE = 'mozfinance.data.model'
+
+FIRST_YEAR = 2012
+
+
+def make_session(url='sqlite://'):
+    """Create the schema in the database at url and return a session
+    with a fresh memory cache region.
+
+    """
+    models = import_module(PACKAGE)
+    for name in models.__all__:
+        import_module('.{}'.format(name), package=PACKAGE)
+
+    engine = create_engine(url)
+    models.Base.metadata.create_all(engine)
+
+    dbsession = sessionmaker(bind=engine)()
+    reset_cache(dbsession)
+    return dbsession
+
+
+def reset_cache(dbsession):
+    """Give a session an empty cache region, delete the summaries of the
+    months (written when months are read) and expire its objects, so
+    that the next reads are cold ones.
+
+    """
+    dbsession.cache = make_region().configure('dogpile.cache.memory')
+
+    MonthSummary = import_module('.MonthSummary', package=PACKAGE).MonthSummary
+    with transaction(dbsession):
+        dbsession.query(MonthSummary).delete(synchronize_session=False)
+
+    dbsession.expire_all()
+
+
+def records(years=1, prestations=20, bills=2, salesmen_ids=None, seed=0):
+    """Yield synthetic prestation records (see
+    BulkData.import_prestations): for each month of the given number of
+    years, prestations with bills, a cost and one or two salesmen.
+
+    """
+    rand = random.Random(seed)
+    salesmen_ids = salesmen_ids or []
+
+    for year in range(FIRST_YEAR, FIRST_YEAR + years):
+        for month in range(1, 13):
+            for i in range(prestations):
+                record = {
+                    'date': datetime.date(year, month, rand.randint(1, 28)),
+                    'client': u'Client {}'.format(i),
+                    'category': rand.randint(0, 3),
+                    'sector': rand.randint(0, 3),
+                    'bills': [
+                        {'ref': u'F-{}'.format(j),
+                         'amount': float(rand.randint(100, 5000))}
+                        for j in range(bills)],
+                    'costs': [
+                        {'reason': u'Cost',
+                         'amount': float(rand.randint(10, 500))}]}
+
+                if salesmen_ids:
+                    count = min(len(salesmen_ids), rand.randint(1, 2))
+                    record['salesmen'] = rand.sample(salesmen_ids, count)
+
+                yield record
+
+
+def populate(biz, years=1, salesmen=3):
+    """Create the months and the salesmen (with a formula for every
+    category and sector). Return the ids of the salesmen.
+
+    """
+    formulae = dict(
+        (category, dict((sector, '{p_m}*0.05') for sector in range(4)))
+        for category in range(4))
+
+    with transaction(biz._dbsession):
+        for year in range(FIRST_YEAR, FIRST_YEAR + years):
+            for month in range(1, 13):
+                biz.month.create(
+                    date=datetime.date(year, month, 1),
+                    commit=False)
+
+        salesmen_ids = list()
+        for i in range(salesmen):
+            salesman = biz.salesman.create(
+                firstname=u'First{}'.format(i),
+                lastname=u'Last{}'.format(i),
+                commit=False)
+            biz.salesman.set_commissions_formulae(
+                salesman=salesman,
+                commissions_formulae=formulae,
+                commit=False)
+            biz._dbsession.flush()
+            salesmen_ids.append(salesman.id)
+
+    return salesmen_ids
+
+
+def timed(func, repeat=3, setup=None):
+    """Call func repeat times (calling setup before each call, out of
+    the timings) and return its timings, in milliseconds.
+
+    """
+    timings = list()
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+
+    return {
+        'repeat': repeat,
+        'min': min(timings),
+        'mean': sum(timings) / len(timings),
+        'max': max(timings)}
+
+
+def _months(biz):
+    Month = import_module('.Month', package=PACKAGE).Month
+    return biz._dbsession.query(Month).order_by(Month.date).all()
+
+
+def read_months(biz):
+    """Read every figure of every month."""
+    for month in _months(biz):
+        (month.revenue, month.gross_margin, month.net_margin,
+         month.commission_base)
+
+
+def read_years(biz):
+    """Read every figure of every year."""
+    years = sorted(set(month.date.year for month in _months(biz)))
+    for year_id in years:
+        year = biz.year._get(year_id=year_id)
+        year.revenue, year.gross_margin, year.net_margin
+
+
+def read_commissions(biz):
+    """Read the total commission of every salesman for every month."""
+    for month in _months(biz):
+        for month_salesman in month.month_salesmen:
+            month_salesman.commission_total
+
+
+def expire_months(biz):
+    """Expire every month (and the cascade of its prestations, salesmen
+    and year).
+
+    """
+    for month in _months(biz):
+        biz.month._expire(month=month)
+
+
+def run(years=1, prestations=20, bills=2, salesmen=3, repeat=3, seed=0,
+        url='sqlite://'):
+    """Generate a dataset at the given scale, run every benchmark and
+    return the results as a dict.
+
+    Keyword arguments:
+        years -- number of years of data
+        prestations -- number of prestations per month
+        bills -- number of bills per prestation
+        salesmen -- number of salesmen
+        repeat -- number of timed runs of each benchmark
+        seed -- seed of the synthetic data
+        url -- url of the (empty) database
+
+    """
+    dbsession = make_session(url)
+    biz = BusinessObject(dbsession=dbsession, package=PACKAGE)
+
+    salesmen_ids = populate(biz, years, salesmen)
+
+    start = time.time()
+    imported = biz.bulk.import_prestations(records=records(
+        years=years,
+        prestations=prestations,
+        bills=bills,
+        salesmen_ids=salesmen_ids,
+        seed=seed))
+    import_time = (time.time() - start) * 1000
+
+    def cold():
+        reset_cache(dbsession)
+
+    def warm(read):
+        def f():
+            cold()
+            read(biz)
+        return f
+
+    results = {
+        'import': {
+            'prestations': imported,
+            'ms': import_time,
+            'ms_per_prestation': import_time / max(imported, 1)}}
+
+    for name, read in [('month_figures', read_months),
+                       ('year_figures', read_years),
+                       ('salesman_commissions', read_commissions)]:
+        results[name] = {
+            'cold': timed(lambda: read(biz), repeat, setup=cold),
+            'warm': timed(lambda: read(biz), repeat, setup=warm(read))}
+
+    def warm_all():
+        cold()
+        read_months(biz)
+        read_years(biz)
+        read_commissions(biz)
+
+    results['expire_cascade'] = timed(
+        lambda: expire_months(biz), repeat, setup=warm_all)
+
+    dbsession.close()
+
+    return {
+        'scale': {
+            'years': years,
+            'prestations': prestations,
+            'bills': bills,
+            'salesmen': salesmen,
+            'seed': seed},
+        'environment': {
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__},
+        'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the financial queries of mozfinance.')
+    parser.add_argument('--years', type=int, default=1)
+    parser.add_argument('--prestations', type=int, default=20,
+                        help='number of prestations per month')
+    parser.add_argument('--bills', type=int, default=2,
+                        help='number of bills per prestation')
+    parser.add_argument('--salesmen', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', default='sqlite://',
+                        help='url of an empty database, default: in memory')
+    parser.add_argument('--output', help='JSON file, default: stdout')
+    args = parser.parse_args(argv)
+
+    results = run(
+        years=args.years,
+        prestations=args.prestations,
+        bills=args.bills,
+        salesmen=args.salesmen,
+        repeat=args.repeat,
+        seed=args.seed,
+        url=args.url)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,21 +3,280 @@
 mozfinance.
 
 """
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
 from mozbase.data import RawDataRepository
 
-from mozfinance.data import month, prestation, salesman, year
+from mozfinance.data import DeferredExpire, bulk, month, prestation, salesman, year
+from mozfinance.data.export import LedgerExporter
+from mozfinance.data.readpool import ReadPool
+from mozfinance.data.recompute import Recomputer
+from mozfinance.data.snapshot import LedgerSnapshot
+from mozfinance.data.warmer import CacheWarmer
+from mozfinance.util.instrumentation import Instrumentation
 
 
 class BusinessObject(RawDataRepository):
     """Business object for mozfinance. Provides all API."""
 
-    _patch_exports = ['month', 'year', 'prestation', 'salesman']
+    _patch_exports = ['month', 'year', 'prestation', 'salesman', 'bulk']
+
+    def __init__(self, dbsession=None, package=None, incremental=False):
+        """Init a BusinessObject.
 
-    def __init__(self, dbsession=None, package=None):
+        Arguments:
+            dbsession -- session to use (must provide a cache)
+            package -- package of the models
+            incremental -- if True, bills and costs mutations apply their
+                           differences to the cached figures instead of
+                           expiring them (see mozfinance.data.delta)
+
+        """
         RawDataRepository.__init__(self, dbsession)
         self._package = package
+        self.incremental = incremental
+        self._expire_batch = None
+        self._deferred_expire = None
+        self._instrumentation = None
 
         self.month = month.MonthData(self)
         self.year = year.YearData(self)
         self.prestation = prestation.PrestationData(self)
         self.salesman = salesman.SalesmanData(self)
+        self.bulk = bulk.BulkData(self)
+
+    @contextmanager
+    def deferred_expire(self):
+        """Context manager deferring the expires of every mutating method
+        called inside it: dirty prestations and months are collected and
+        their cascades run only once, when the session commits. They are
+        discarded if the session rolls back. Whatever is still dirty when
+        the context exits (mutations not committed yet) is expired then,
+        and the summaries of its months are marked as stale in the same,
+        still running, transaction.
+
+        Eg: with biz.deferred_expire():
+                with transaction(dbsession):
+                    for bill in bills:
+                        biz.prestation.bill.create(commit=False, **bill)
+
+        """
+        if self._deferred_expire is not None:
+            yield self._deferred_expire
+            return
+
+        deferred = DeferredExpire()
+
+        def run_deferred(dbsession):
+            self._deferred_expire = None
+            try:
+                deferred.run(self)
+            finally:
+                self._deferred_expire = deferred
+
+        def discard_deferred(dbsession):
+            deferred.clear()
+
+        event.listen(self._dbsession, 'before_commit', run_deferred)
+        event.listen(self._dbsession, 'after_rollback', discard_deferred)
+        self._deferred_expire = deferred
+        try:
+            yield deferred
+        finally:
+            self._deferred_expire = None
+            event.remove(self._dbsession, 'before_commit', run_deferred)
+            event.remove(self._dbsession, 'after_rollback', discard_deferred)
+
+        deferred.run(self)
+
+    def warm_cache(self, start=None, end=None, workers=1, chunk_size=None):
+        """Precompute every cached property of the months between start
+        and end, of their prestations, salesmen and years (see
+        mozfinance.data.warmer.CacheWarmer). Return a dict of the number
+        of warmed 'months' and 'years'.
+
+        Keyword arguments:
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+            workers -- number of threads warming chunks of months, each
+                       with its own session
+            chunk_size -- number of months warmed at once
+
+        """
+        warmer = CacheWarmer(self, workers=workers, chunk_size=chunk_size)
+        return warmer.warm(start=start, end=end)
+
+    def read_pool(self, workers=4):
+        """Return a ReadPool running reads of months, years and salesmen
+        in a bounded pool of threads, each with its own session sharing
+        the cache (see mozfinance.data.readpool). Reads return
+        AsyncResult at once, so that several can run in parallel.
+
+        Beware, the engine of the session must allow connections from
+        several threads (eg: not an in-memory SQLite database).
+
+        Eg: with biz.read_pool(workers=6) as pool:
+                months = pool.gather(pool.month.figures_many(dates))
+
+        """
+        return ReadPool(self, workers=workers)
+
+    def recompute(self, start=None, end=None, cache=None, url=None,
+                  processes=None, chunk_size=None, progress=None):
+        """Recompute and overwrite in cache every figure and commission of
+        the months between start and end, and of their years, with a pool
+        of processes (see mozfinance.data.recompute.Recomputer). Return a
+        dict of the number of recomputed 'months' and 'years'.
+
+        Keyword arguments:
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+            cache -- configuration of the workers' cache region, whose
+                     backend must be shared with the session's (see
+                     mozfinance.data.recompute.make_cache_region)
+            url -- URL of the database, default: the one of the engine
+                   of the session
+            processes -- number of worker processes, default: the
+                         number of CPUs
+            chunk_size -- number of months recomputed at once by a worker
+            progress -- function called with (number of recomputed
+                        months, total number of months)
+
+        """
+        if cache is None:
+            raise TypeError('cache missing')
+
+        if url is None:
+            url = str(self._dbsession.get_bind().url)
+
+        recomputer = Recomputer(
+            self, url, cache, processes=processes, chunk_size=chunk_size)
+        return recomputer.run(start=start, end=end, progress=progress)
+
+    def export_ledger(self, where=None, start=None, end=None, format='csv',
+                      chunk_size=None, batch_size=None):
+        """Export every prestation of the months between start and end
+        with its figures, salesmen and commissions, streaming them from
+        the database (see mozfinance.data.export.LedgerExporter). Write
+        them to where (a file object, or also a path for 'parquet') and
+        return the number of rows or, if where is None, return an
+        iterator of the rows (as dicts).
+
+        Keyword arguments:
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+            format -- 'csv' or 'parquet' (requires pyarrow)
+            chunk_size -- number of months computed at once
+            batch_size -- number of prestations fetched at once
+
+        """
+        exporter = LedgerExporter(
+            self, chunk_size=chunk_size, batch_size=batch_size)
+
+        if where is None:
+            return exporter.rows(start=start, end=end)
+        if format == 'csv':
+            return exporter.write_csv(where, start=start, end=end)
+        if format == 'parquet':
+            return exporter.write_parquet(where, start=start, end=end)
+
+        raise AttributeError('unknown export format: {}'.format(format))
+
+    def snapshot(self, start=None, end=None, chunk_size=12):
+        """Return a columnar snapshot of the prestations (with their
+        figures) and of their commissions, of the months between start
+        and end, for analytics (see mozfinance.data.snapshot).
+
+        Keyword arguments:
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+            chunk_size -- number of months computed at once
+
+        Eg: biz.snapshot().sum('selling_price', by='sector')
+
+        """
+        return LedgerSnapshot.build(
+            self, start=start, end=end, chunk_size=chunk_size)
+
+    def enable_instrumentation(self):
+        """Start recording, per operation, the number of SQL statements,
+        cache hits/misses and the time spent (see
+        mozfinance.util.instrumentation). Return the Instrumentation
+        object, whose snapshot method returns the recorded stats.
+
+        Beware, every statement executed through the engine of the
+        session is recorded, including those of other sessions.
+
+        """
+        if self._instrumentation is None:
+            self._instrumentation = Instrumentation(self)
+            self._instrumentation.install()
+
+        return self._instrumentation
+
+    def disable_instrumentation(self):
+        """Stop recording. Return the recorded stats."""
+        if self._instrumentation is None:
+            return None
+
+        stats = self._instrumentation.snapshot()
+        self._instrumentation.uninstall()
+        self._instrumentation = None
+        return stats
+
+    def stats(self):
+        """Return the stats recorded so far, or None if the
+        instrumentation is not enabled.
+
+        """
+        if self._instrumentation is None:
+            return None
+
+        return self._instrumentation.snapshot()
+
+    def cache_report(self, n=10, by='recompute_ms'):
+        """Return the n cache key families (eg: 'month:{id}:revenue')
+        with the highest by stat ('hits', 'misses', 'recompute_ms'...),
+        as a list of (family, stats) tuples, or None if the
+        instrumentation is not enabled.
+
+        """
+        if self._instrumentation is None:
+            return None
+
+        return self._instrumentation.top_key_families(n=n, by=by)
+
+    @contextmanager
+    def instrumented(self, operation=None):
+        """Context manager recording everything done inside it, accounted
+        to operation if given. Yield the Instrumentation object. The
+        instrumentation is disabled at exit if it was enabled by this
+        context manager.
+
+        Eg: with biz.instrumented('month report') as instrumentation:
+                month = biz.month.get(date=date)
+                month.revenue
+            instrumentation.snapshot()['month report']['queries']
+
+        """
+        enabled = self._instrumentation is None
+        instrumentation = self.enable_instrumentation()
+        try:
+            if operation is None:
+                yield instrumentation
+            else:
+                with instrumentation.operation(operation):
+                    yield instrumentation
+        finally:
+            if enabled:
+                self.disable_instrumentation()
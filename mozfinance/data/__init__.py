@@ -1,13 +1,35 @@
 # -*- coding: utf-8 -*-
 """Package for all object API."""
+from collections import OrderedDict
+from contextlib import contextmanager
+
 from dogpile.cache.api import NoValue
 
 from mozbase.data import ObjectManagingDataRepository
 
 
+def key_store_key(instance, ksk_tpl_name=None):
+    """Return the key of the key store of an instance.
+
+    Argument:
+        instance -- instance whose key store's key is wanted
+        ksk_tpl_name -- default: _key_store_key_template
+                        name of the attribute in which is saved the
+                        template of the key store's key.
+
+    """
+    format_dict = dict()
+    format_dict['instance'] = instance
+
+    if ksk_tpl_name is None:
+        ksk_tpl_name = '_key_store_key_template'
+
+    return getattr(instance, ksk_tpl_name).format(**format_dict)
+
+
 def expire_instance(cache, instance, ksk_tpl_name=None):
         """Expire every key related to an instance by deleting every key
-        stored in its key_store.
+        stored in its key_store. Return the number of deleted keys.
 
         Argument:
             instance -- instance that will be expired
@@ -16,20 +38,145 @@ def expire_instance(cache, instance, ksk_tpl_name=None):
                             template of the key store's key.
 
         """
-        format_dict = dict()
-        format_dict['instance'] = instance
+        batch = ExpireBatch(cache)
+        batch.add(instance, ksk_tpl_name)
+        return batch.execute()
+
+
+class ExpireBatch(object):
+    """Collect the key stores of every instance to expire (and single
+    keys), then expire them all at once: one get_multi for the key
+    stores and one delete_multi for the keys they hold (and the key
+    stores themselves).
+
+    The dropped attribute holds the number of deleted keys, None until
+    the batch is executed.
+
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._key_store_keys = OrderedDict()
+        self._keys = OrderedDict()
+        self.dropped = None
+
+    def add(self, instance, ksk_tpl_name=None):
+        """Add the key store of an instance to the batch. See
+        key_store_key for arguments.
+
+        """
+        self._key_store_keys[key_store_key(instance, ksk_tpl_name)] = True
+
+    def add_keys(self, keys):
+        """Add single keys to the batch."""
+        for key in keys:
+            self._keys[key] = True
+
+    def execute(self):
+        """Delete every key of the collected key stores and every single
+        key, empty the batch and return the number of deleted keys.
+
+        """
+        key_store_keys = list(self._key_store_keys)
+        keys = self._keys
+        self._key_store_keys = OrderedDict()
+        self._keys = OrderedDict()
+        self.dropped = self.dropped or 0
+        if not key_store_keys and not keys:
+            return 0
 
-        if ksk_tpl_name is None:
-            ksk_tpl_name = '_key_store_key_template'
+        if key_store_keys:
+            for key_store in self._cache.get_multi(key_store_keys):
+                if isinstance(key_store, NoValue):
+                    continue
+                for key in key_store:
+                    keys[key] = True
+
+        self._cache.delete_multi(list(keys) + key_store_keys)
+
+        self.dropped += len(keys)
+        return len(keys)
+
+
+def store_values(cache, key_store_key, values):
+    """Set values in cache and register their keys in the given key
+    store, the same way a cached_property does. Used to warm the cache
+    with values computed outside of the instances' properties.
+
+    Arguments:
+        key_store_key -- key of the key store the values belong to
+        values -- dict of the values to store, by key
+
+    """
+    if not values:
+        return
 
-        key_store_key = getattr(instance, ksk_tpl_name).format(**format_dict)
+    cache.set_multi(values)
 
-        key_store = cache.get(key_store_key)
-        if isinstance(key_store, NoValue):
-            key_store = []
+    key_store = cache.get(key_store_key)
+    if isinstance(key_store, NoValue):
+        key_store = []
 
-        for key in key_store:
-            cache.delete(key)
+    new_keys = [key for key in values if key not in key_store]
+    if new_keys:
+        key_store.extend(new_keys)
+        cache.set(key_store_key, key_store)
+
+
+class DeferredExpire(object):
+    """Dirty prestations and months (and instances) collected while
+    expires are deferred (see BusinessObject.deferred_expire), to run
+    their cascades only once.
+
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Forget every dirty object."""
+        self.prestations = OrderedDict()
+        self.months = OrderedDict()
+        self.instances = OrderedDict()
+
+    def add(self, prestation=None, month=None, instances=None):
+        """Mark a prestation, a month and instances (whose key stores
+        have to be expired) as dirty.
+
+        """
+        if prestation is not None:
+            self.prestations[prestation] = True
+        if month is not None:
+            self.months[month] = True
+        for instance in instances or []:
+            self.instances[instance] = True
+
+    def run(self, bo):
+        """Expire every dirty object, each only once, in one
+        ExpireBatch: the instances, the prestations, then the months of
+        the prestations and the dirty months (which expire their years).
+        Return the number of deleted keys.
+
+        """
+        prestations = list(self.prestations)
+        months = list(self.months)
+        instances = list(self.instances)
+        self.clear()
+
+        with bo.month._expiring() as batch:
+            for instance in instances:
+                bo.month._expire_instance(instance)
+
+            for presta in prestations:
+                bo.prestation._expire(prestation=presta)
+                month = presta.month
+                if month is not None and month not in months:
+                    months.append(month)
+
+            for month in months:
+                bo.month._expire(month=month)
+
+        return batch.dropped
 
 
 class DataRepository(ObjectManagingDataRepository):
@@ -49,4 +196,57 @@ class DataRepository(ObjectManagingDataRepository):
         self._package = bo._package
 
     def _expire_instance(self, instance, ksk_tpl_name=None):
+        """Expire an instance. If an expire batch is running (see
+        _expiring), its key store is only added to the batch.
+
+        """
+        batch = getattr(self._bo, '_expire_batch', None)
+        if batch is not None:
+            return batch.add(instance, ksk_tpl_name)
+
         return expire_instance(self._dbsession.cache, instance, ksk_tpl_name)
+
+    @contextmanager
+    def _expiring(self):
+        """Context manager collecting every instance expired inside it
+        (through _expire_instance) in one ExpireBatch, executed when the
+        outermost _expiring exits. Yield the batch, whose dropped
+        attribute holds the number of deleted keys once executed: an
+        _expire nested in a running batch returns None, its keys being
+        deleted later with the outer batch's.
+
+        """
+        batch = getattr(self._bo, '_expire_batch', None)
+        if batch is not None:
+            yield batch
+            return
+
+        batch = ExpireBatch(self._dbsession.cache)
+        self._bo._expire_batch = batch
+        try:
+            yield batch
+        finally:
+            self._bo._expire_batch = None
+            batch.execute()
+
+    def _incremental(self):
+        """Return True if mutations have to apply their differences to
+        the cached figures (see BusinessObject.incremental) rather than
+        expire them. Deferred expires take precedence.
+
+        """
+        return bool(getattr(self._bo, 'incremental', False)) and \
+            getattr(self._bo, '_deferred_expire', None) is None
+
+    def _defer_expire(self, prestation=None, month=None, instances=None):
+        """If expires are deferred (see BusinessObject.deferred_expire),
+        mark the given objects as dirty and return True. Return False
+        otherwise.
+
+        """
+        deferred = getattr(self._bo, '_deferred_expire', None)
+        if deferred is None:
+            return False
+
+        deferred.add(prestation=prestation, month=month, instances=instances)
+        return True
@@ -0,0 +1,734 @@
+# -*- coding: utf-8 -*-
+"""Set-based computation of month-level figures."""
+from collections import OrderedDict, namedtuple
+from importlib import import_module
+import datetime
+
+from sqlalchemy import and_, or_, func
+
+import mozfinance
+from mozfinance.data import store_values
+from mozfinance.util.commissions import (
+    _COMMISSIONS_VARIABLES, commissions_bonuses, compile_formula)
+from mozfinance.util.dates import next_month_start
+
+
+# Keys under which the Prestation and Month cached properties store
+# their values.
+PRESTATION_KEYS = {
+    'selling_price': 'prestation:{instance.id}:selling_price',
+    'total_cost': 'prestation:{instance.id}:total_cost',
+    'margin': 'prestation:{instance.id}:margin',
+}
+
+MONTH_KEYS = {
+    'revenue': 'month:{instance.id}:revenue',
+    'total_month_cost': 'month:{instance.id}:total_mcost',
+    'total_prestation_cost': 'month:{instance.id}:total_pcost',
+    'gross_margin': 'month:{instance.id}:gross_margin',
+    'net_margin': 'month:{instance.id}:net_margin',
+    'commission_base': 'month:{instance.id}:commission_base',
+}
+
+PRESTATION_SALESMAN_KEYS = {
+    'commission': 'prestation:{instance.prestation_id}:salesman:{instance.salesman_id}:commission',
+}
+
+MONTH_SALESMAN_KEYS = {
+    'commission_prestations': 'month:{instance.month.id}:salesman:{instance.salesman.id}:commission_prestations',
+    'commission_bonuses': 'month:{instance.month.id}:salesman:{instance.salesman.id}:commission_bonuses',
+    'commission_total': 'month:{instance.month.id}:salesman:{instance.salesman.id}:commission_total',
+}
+
+YEAR_KEYS = {
+    'revenue': 'year:{instance.id}:revenue',
+    'gross_margin': 'year:{instance.id}:gross_margin',
+    'net_margin': 'year:{instance.id}:net_margin',
+}
+
+
+# One row of the per-month table returned by YearData.compute.
+MonthRow = namedtuple('MonthRow', [
+    'date', 'month_id', 'revenue', 'total_prestation_cost',
+    'total_month_cost', 'gross_margin', 'net_margin', 'commission_base'])
+
+
+class InstanceRef(object):
+    """Stand-in for an instance, used to format key templates when only
+    the ids are known.
+
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _variables(level, figures):
+    """Return the commissions' variables of the given level ('month' or
+    'prestation') from a figures dict.
+
+    """
+    variables = dict()
+    for key, a_var in _COMMISSIONS_VARIABLES[level].items():
+        variables[key] = figures[a_var['attr']]
+
+    return variables
+
+
+def _float(value):
+    """Return a SUM() result as a float (SUM over no rows is NULL)."""
+    if value is None:
+        return float(0)
+
+    return float(value)
+
+
+class MonthAggregator(object):
+    """Compute the figures of several months at once, with a few grouped
+    SUM queries over bills_prestation, costs_prestation and costs_month
+    instead of loading every prestation, bill and cost.
+
+    """
+
+    def __init__(self, dbsession, package):
+        """Init a MonthAggregator.
+
+        Arguments:
+            dbsession -- session to query (must provide a cache)
+            package -- package of the models
+
+        """
+        self._dbsession = dbsession
+        self._Month = import_module('.Month', package=package).Month
+        self._Prestation = import_module(
+            '.Prestation', package=package).Prestation
+        self._BillPrestation = import_module(
+            '.BillPrestation', package=package).BillPrestation
+        self._CostPrestation = import_module(
+            '.CostPrestation', package=package).CostPrestation
+        self._CostMonth = import_module(
+            '.CostMonth', package=package).CostMonth
+        self._Salesman = import_module(
+            '.Salesman', package=package).Salesman
+        self._PrestationSalesman = import_module(
+            '.AssPrestationSalesman', package=package).PrestationSalesman
+        self._MonthSalesman = import_module(
+            '.FakeAssMonthSalesman', package=package).MonthSalesman
+        try:
+            self._MonthSummary = import_module(
+                '.MonthSummary', package=package).MonthSummary
+        except ImportError:
+            self._MonthSummary = None
+
+    def _prestations_filter(self, months):
+        """Return the clause selecting the prestations of the given
+        months.
+
+        """
+        Prestation = self._Prestation
+        return or_(*[and_(
+            Prestation.date >= month.date,
+            Prestation.date < next_month_start(month.date))
+            for month in months])
+
+    def salesmen(self, months):
+        """Return the salesmen associated with a prestation of each of
+        the given months, loaded with one query, as a dict of lists
+        ordered by salesman id, by month id.
+
+        """
+        salesmen = dict((month.id, []) for month in months)
+        if not months:
+            return salesmen
+
+        Prestation = self._Prestation
+        PrestationSalesman = self._PrestationSalesman
+        Salesman = self._Salesman
+
+        months_by_date = dict()
+        for month in months:
+            months_by_date[(month.date.year, month.date.month)] = month
+
+        rows = self._dbsession\
+            .query(Salesman, Prestation.date)\
+            .join(PrestationSalesman, PrestationSalesman.salesman_id == Salesman.id)\
+            .join(Prestation, Prestation.id == PrestationSalesman.prestation_id)\
+            .filter(self._prestations_filter(months))\
+            .order_by(Salesman.id)\
+            .all()
+
+        for salesman, presta_date in rows:
+            month = months_by_date[(presta_date.year, presta_date.month)]
+            month_salesmen = salesmen[month.id]
+            if not month_salesmen or month_salesmen[-1] is not salesman:
+                month_salesmen.append(salesman)
+
+        return salesmen
+
+    def compute(self, months):
+        """Return a dict of the figures of the given months, by month id.
+
+        Each figures dict holds the values of the Month properties
+        (revenue, total_month_cost, total_prestation_cost, gross_margin,
+        net_margin and commission_base) and a 'prestations' ordered dict
+        of the prestations' figures (selling_price, total_cost and
+        margin), by prestation id.
+
+        """
+        figures = dict()
+        if not months:
+            return figures
+
+        Prestation = self._Prestation
+        BillPrestation = self._BillPrestation
+        CostPrestation = self._CostPrestation
+        CostMonth = self._CostMonth
+
+        months_by_date = dict()
+        for month in months:
+            months_by_date[(month.date.year, month.date.month)] = month
+            figures[month.id] = {'prestations': OrderedDict()}
+
+        prestations_filter = self._prestations_filter(months)
+
+        total_costs = dict(self._dbsession\
+            .query(CostPrestation.prestation_id, func.sum(CostPrestation.amount))\
+            .select_from(CostPrestation)\
+            .join(Prestation, Prestation.id == CostPrestation.prestation_id)\
+            .filter(prestations_filter)\
+            .group_by(CostPrestation.prestation_id)\
+            .all())
+
+        selling_prices = self._dbsession\
+            .query(Prestation.id, Prestation.date, func.sum(BillPrestation.amount))\
+            .outerjoin(BillPrestation, BillPrestation.prestation_id == Prestation.id)\
+            .filter(prestations_filter)\
+            .group_by(Prestation.id, Prestation.date)\
+            .order_by(Prestation.id)
+
+        for presta_id, presta_date, selling_price in selling_prices:
+            month = months_by_date[(presta_date.year, presta_date.month)]
+            selling_price = _float(selling_price)
+            total_cost = _float(total_costs.get(presta_id))
+            figures[month.id]['prestations'][presta_id] = {
+                'selling_price': selling_price,
+                'total_cost': total_cost,
+                'margin': selling_price - total_cost,
+            }
+
+        month_costs = self._dbsession\
+            .query(CostMonth.month_id, CostMonth.no_commission_base, func.sum(CostMonth.amount))\
+            .select_from(CostMonth)\
+            .filter(CostMonth.month_id.in_([month.id for month in months]))\
+            .group_by(CostMonth.month_id, CostMonth.no_commission_base)
+
+        total_mcosts = dict()
+        commission_base_costs = dict()
+        for month_id, no_commission_base, amount in month_costs:
+            total_mcosts[month_id] = total_mcosts.get(month_id, float(0)) + _float(amount)
+            # Same as "no_commission_base == False" in SQL: NULL is out.
+            if no_commission_base is not None and not no_commission_base:
+                commission_base_costs[month_id] = _float(amount)
+
+        for month in months:
+            month_figures = figures[month.id]
+
+            revenue = float(0)
+            total_pcost = float(0)
+            for presta_figures in month_figures['prestations'].values():
+                revenue += presta_figures['selling_price']
+                total_pcost += presta_figures['total_cost']
+
+            gross_margin = revenue - total_pcost
+            total_mcost = total_mcosts.get(month.id, float(0))
+
+            month_figures['revenue'] = revenue
+            month_figures['total_prestation_cost'] = total_pcost
+            month_figures['total_month_cost'] = total_mcost
+            month_figures['gross_margin'] = gross_margin
+            month_figures['net_margin'] = gross_margin - total_mcost
+            month_figures['commission_base'] = gross_margin -\
+                commission_base_costs.get(month.id, float(0))
+
+        return figures
+
+    def warm(self, months):
+        """Compute the figures of the given months, store them in cache
+        under the keys of the cached properties and return them (see
+        compute).
+
+        """
+        cache = self._dbsession.cache
+        figures = self.compute(months)
+
+        for month in months:
+            month_figures = figures[month.id]
+
+            for presta_id, presta_figures in month_figures['prestations'].items():
+                presta = InstanceRef(id=presta_id)
+                store_values(
+                    cache,
+                    self._Prestation._key_store_key_template.format(instance=presta),
+                    {key_tpl.format(instance=presta): presta_figures[name]
+                     for name, key_tpl in PRESTATION_KEYS.items()})
+
+            store_values(
+                cache,
+                month._key_store_key_template.format(instance=month),
+                {key_tpl.format(instance=month): month_figures[name]
+                 for name, key_tpl in MONTH_KEYS.items()})
+
+        return figures
+
+    def summaries(self, months):
+        """Return the figures of the given months read from their fresh
+        summaries (see MonthSummary), by month id. Months without a
+        fresh summary are left out.
+
+        """
+        MonthSummary = self._MonthSummary
+        if MonthSummary is None or not months:
+            return dict()
+
+        summaries = self._dbsession.query(MonthSummary)\
+            .filter(MonthSummary.month_id.in_([month.id for month in months]))\
+            .filter(MonthSummary.fresh == True)\
+            .all()
+
+        return dict(
+            (summary.month_id,
+             dict((name, getattr(summary, name)) for name in MONTH_KEYS))
+            for summary in summaries)
+
+    def warm_summaries(self, months):
+        """Read the figures of the given months from their fresh
+        summaries, store them in cache under the keys of the cached
+        properties and return them (see summaries).
+
+        """
+        cache = self._dbsession.cache
+        figures = self.summaries(months)
+
+        for month in months:
+            if month.id not in figures:
+                continue
+
+            store_values(
+                cache,
+                month._key_store_key_template.format(instance=month),
+                {key_tpl.format(instance=month): figures[month.id][name]
+                 for name, key_tpl in MONTH_KEYS.items()})
+
+        return figures
+
+    def read(self, months):
+        """Return the figures of the given months, by month id, and warm
+        the cache with them: read from their fresh summaries or, for the
+        other months, computed (see warm) and written in their summaries.
+
+        """
+        figures = self.warm_summaries(months)
+
+        missing = [month for month in months if month.id not in figures]
+        if missing:
+            computed = self.warm(missing)
+            self.refresh_summaries(missing, figures=computed)
+            figures.update(computed)
+
+        return figures
+
+    def refresh_summaries(self, months, figures=None):
+        """Compute the figures of the given months and write them in
+        their (fresh) summaries. Do nothing if there is no MonthSummary
+        class in the package. Return the figures (see compute).
+
+        Keyword arguments:
+            figures -- figures of the months, as returned by compute, if
+                       they are already known
+
+        """
+        MonthSummary = self._MonthSummary
+        if MonthSummary is None or not months:
+            return figures
+
+        if figures is None:
+            figures = self.compute(months)
+
+        summaries = dict(
+            (summary.month_id, summary) for summary
+            in self._dbsession.query(MonthSummary)
+            .filter(MonthSummary.month_id.in_([month.id for month in months])))
+
+        now = datetime.datetime.now()
+        for month in months:
+            summary = summaries.get(month.id)
+            if summary is None:
+                summary = MonthSummary(month_id=month.id)
+                self._dbsession.add(summary)
+
+            for name in MONTH_KEYS:
+                setattr(summary, name, figures[month.id][name])
+            summary.fresh = True
+            summary.computed_at = now
+
+        return figures
+
+    def stale_summaries(self, months_dates):
+        """Mark the summaries of the months of the given dates as stale,
+        with one UPDATE.
+
+        """
+        MonthSummary = self._MonthSummary
+        if MonthSummary is None or not months_dates:
+            return
+
+        months_ids = self._dbsession.query(self._Month.id)\
+            .filter(self._Month.date.in_(months_dates))\
+            .subquery()
+
+        self._dbsession.query(MonthSummary)\
+            .filter(MonthSummary.month_id.in_(months_ids))\
+            .update({'fresh': False}, synchronize_session=False)
+
+    def apply_summary_delta(self, month, deltas):
+        """Add deltas (a dict of differences by figure's name) to the
+        summary of the given month with one UPDATE, if it is fresh.
+
+        """
+        MonthSummary = self._MonthSummary
+        if MonthSummary is None:
+            return
+
+        values = dict(
+            (name, getattr(MonthSummary, name) + delta)
+            for name, delta in deltas.items() if delta)
+        if not values:
+            return
+
+        self._dbsession.query(MonthSummary)\
+            .filter(MonthSummary.month_id == month.id)\
+            .filter(MonthSummary.fresh == True)\
+            .update(values, synchronize_session=False)
+
+    def _evaluate(self, presta_sms, figures):
+        """Return the commissions of prestation-salesman associations, by
+        (prestation_id, salesman_id).
+
+        Arguments:
+            presta_sms -- list of (month, prestation_id, salesman_id,
+                          ratio, formula, number of salesmen of the
+                          prestation) tuples
+            figures -- figures of the months, as returned by compute
+
+        """
+        # Evaluate the associations by batches sharing the same formula,
+        # so that each formula is compiled (or fetched) only once.
+        batches = OrderedDict()
+        for presta_sm in presta_sms:
+            batches.setdefault(presta_sm[4], []).append(presta_sm)
+
+        commissions = dict()
+        for formula, batch in batches.items():
+            compiled_formula = None
+
+            for month, presta_id, salesman_id, ratio, _, salesmen_count in batch:
+                month_figures = figures[month.id]
+                presta_figures = month_figures['prestations'][presta_id]
+
+                # If prestation's margin or month's commission's base is
+                # negative, there is no commission.
+                if (presta_figures['margin'] <= float(0) or
+                        month_figures['commission_base'] <= float(0)):
+                    commission = float(0)
+
+                else:
+                    if ratio is None:
+                        ratio = float(1) / float(salesmen_count)
+
+                    if compiled_formula is None:
+                        compiled_formula = compile_formula(formula)
+
+                    variables = _variables('month', month_figures)
+                    variables.update(_variables('prestation', presta_figures))
+                    commission = compiled_formula(**variables) * ratio
+
+                commissions[(presta_id, salesman_id)] = commission
+
+        return commissions
+
+    def commissions(self, months, figures=None):
+        """Return the commissions of the salesmen of the given months
+        (associated with one of their prestations or, if there are
+        monthly bonuses, every salesman: see
+        MonthSalesmanRepository._month_salesmen), loading every
+        prestation-salesman association of these months at once.
+
+        Return a dict, by month id, of dicts holding:
+            'salesmen' -- by salesman id, dicts of commission_prestations,
+                          commission_bonuses and commission_total
+            'prestation_salesmen' -- commissions of the prestation-salesman
+                                     associations, by (prestation_id,
+                                     salesman_id)
+
+        Keyword arguments:
+            figures -- figures of the months, as returned by compute, if
+                       they are already known
+
+        """
+        commissions = dict()
+        if not months:
+            return commissions
+
+        if figures is None:
+            figures = self.compute(months)
+
+        Prestation = self._Prestation
+        PrestationSalesman = self._PrestationSalesman
+
+        months_by_date = dict()
+        for month in months:
+            months_by_date[(month.date.year, month.date.month)] = month
+
+        presta_sms = self._dbsession\
+            .query(
+                PrestationSalesman.prestation_id,
+                PrestationSalesman.salesman_id,
+                PrestationSalesman.ratio,
+                PrestationSalesman.formula,
+                Prestation.date)\
+            .join(Prestation, Prestation.id == PrestationSalesman.prestation_id)\
+            .filter(self._prestations_filter(months))\
+            .order_by(PrestationSalesman.prestation_id, PrestationSalesman.salesman_id)\
+            .all()
+
+        salesmen_count = dict()
+        month_presta_sms = dict((month.id, []) for month in months)
+        for presta_sm in presta_sms:
+            presta_id, presta_date = presta_sm[0], presta_sm[4]
+            salesmen_count[presta_id] = salesmen_count.get(presta_id, 0) + 1
+            month = months_by_date[(presta_date.year, presta_date.month)]
+            month_presta_sms[month.id].append(presta_sm)
+
+        presta_sm_commissions = self._evaluate(
+            [(month, presta_id, salesman_id, ratio, formula, salesmen_count[presta_id])
+             for month in months
+             for presta_id, salesman_id, ratio, formula, _ in month_presta_sms[month.id]],
+            figures)
+
+        # Monthly bonuses are due to every salesman.
+        bonuses_salesmen_ids = set()
+        if mozfinance.COMMISSIONS_BONUSES:
+            bonuses_salesmen_ids = set(
+                salesman_id for salesman_id,
+                in self._dbsession.query(self._Salesman.id))
+
+        for month in months:
+            month_figures = figures[month.id]
+            bonuses = commissions_bonuses(**_variables('month', month_figures))
+
+            month_commissions = {
+                'salesmen': dict(),
+                'prestation_salesmen': dict()}
+
+            prestations = dict()
+            for presta_id, salesman_id, _, _, _ in month_presta_sms[month.id]:
+                commission = presta_sm_commissions[(presta_id, salesman_id)]
+                month_commissions['prestation_salesmen'][(presta_id, salesman_id)] = commission
+                prestations[salesman_id] = prestations.get(salesman_id, float(0)) + commission
+
+            for salesman_id in sorted(set(prestations) | bonuses_salesmen_ids):
+                commission_prestations = prestations.get(salesman_id, float(0))
+                month_commissions['salesmen'][salesman_id] = {
+                    'commission_prestations': commission_prestations,
+                    'commission_bonuses': bonuses,
+                    'commission_total': commission_prestations + bonuses,
+                }
+
+            commissions[month.id] = month_commissions
+
+        return commissions
+
+    def statements(self, months, salesmen_ids, figures=None):
+        """Return the commission statements of the given salesmen over
+        the given months, loading their prestation-salesman associations
+        (with the number of salesmen of each prestation) with one query.
+
+        Return a dict, by salesman id, of lists (one item per month, in
+        the order of months) of dicts holding:
+            'month' -- the month
+            'prestations' -- list, ordered by date, of dicts of the
+                             prestation_id, date, margin, ratio (the
+                             applied one) and commission of each of the
+                             salesman's prestations
+            'commission_prestations', 'commission_bonuses' and
+            'commission_total' -- as MonthSalesman's
+
+        Keyword arguments:
+            figures -- figures of the months, as returned by compute, if
+                       they are already known
+
+        """
+        statements = dict((salesman_id, []) for salesman_id in salesmen_ids)
+        if not months or not salesmen_ids:
+            return statements
+
+        if figures is None:
+            figures = self.compute(months)
+
+        Prestation = self._Prestation
+        PrestationSalesman = self._PrestationSalesman
+
+        months_by_date = dict()
+        for month in months:
+            months_by_date[(month.date.year, month.date.month)] = month
+
+        # Number of salesmen of the prestations of the months only.
+        salesmen_count = self._dbsession\
+            .query(
+                PrestationSalesman.prestation_id,
+                func.count(PrestationSalesman.salesman_id).label('salesmen_count'))\
+            .join(Prestation, Prestation.id == PrestationSalesman.prestation_id)\
+            .filter(self._prestations_filter(months))\
+            .group_by(PrestationSalesman.prestation_id)\
+            .subquery()
+
+        presta_sms = self._dbsession\
+            .query(
+                PrestationSalesman.prestation_id,
+                PrestationSalesman.salesman_id,
+                PrestationSalesman.ratio,
+                PrestationSalesman.formula,
+                Prestation.date,
+                salesmen_count.c.salesmen_count)\
+            .join(Prestation, Prestation.id == PrestationSalesman.prestation_id)\
+            .join(salesmen_count,
+                  salesmen_count.c.prestation_id == PrestationSalesman.prestation_id)\
+            .filter(PrestationSalesman.salesman_id.in_(salesmen_ids))\
+            .filter(self._prestations_filter(months))\
+            .order_by(Prestation.date, PrestationSalesman.prestation_id)\
+            .all()
+
+        rows = [(months_by_date[(presta_date.year, presta_date.month)],
+                 presta_id, salesman_id, ratio, formula, count, presta_date)
+                for presta_id, salesman_id, ratio, formula, presta_date, count
+                in presta_sms]
+        presta_sm_commissions = self._evaluate(
+            [row[:6] for row in rows], figures)
+
+        salesmen_prestations = dict()
+        for month, presta_id, salesman_id, ratio, _, count, presta_date in rows:
+            salesmen_prestations.setdefault((salesman_id, month.id), []).append({
+                'prestation_id': presta_id,
+                'date': presta_date,
+                'margin': figures[month.id]['prestations'][presta_id]['margin'],
+                'ratio': ratio if ratio is not None else float(1) / float(count),
+                'commission': presta_sm_commissions[(presta_id, salesman_id)]})
+
+        for month in months:
+            bonuses = commissions_bonuses(**_variables('month', figures[month.id]))
+
+            for salesman_id in salesmen_ids:
+                prestations = salesmen_prestations.get((salesman_id, month.id), [])
+                commission_prestations = sum(
+                    [presta['commission'] for presta in prestations], float(0))
+                statements[salesman_id].append({
+                    'month': month,
+                    'prestations': prestations,
+                    'commission_prestations': commission_prestations,
+                    'commission_bonuses': bonuses,
+                    'commission_total': commission_prestations + bonuses})
+
+        return statements
+
+    def warm_commissions(self, months, figures=None):
+        """Compute the figures and the commissions of the given months,
+        store them in cache under the keys of the cached properties and
+        return the commissions (see commissions).
+
+        Keyword arguments:
+            figures -- figures of the months, as returned by warm, if
+                       they are already known and cached
+
+        """
+        cache = self._dbsession.cache
+        if figures is None:
+            figures = self.warm(months)
+        commissions = self.commissions(months, figures=figures)
+
+        for month in months:
+            month_commissions = commissions[month.id]
+
+            for ids, commission in month_commissions['prestation_salesmen'].items():
+                presta_sm = InstanceRef(prestation_id=ids[0], salesman_id=ids[1])
+                store_values(
+                    cache,
+                    self._PrestationSalesman._key_store_key_template.format(instance=presta_sm),
+                    {key_tpl.format(instance=presta_sm): commission
+                     for key_tpl in PRESTATION_SALESMAN_KEYS.values()})
+
+            for salesman_id, salesman_commissions in month_commissions['salesmen'].items():
+                month_sm = InstanceRef(month=month, salesman=InstanceRef(id=salesman_id))
+                store_values(
+                    cache,
+                    self._MonthSalesman._key_store_key_template.format(instance=month_sm),
+                    {key_tpl.format(instance=month_sm): salesman_commissions[name]
+                     for name, key_tpl in MONTH_SALESMAN_KEYS.items()})
+
+        return commissions
+
+    def warm_years(self, years, months_figures=None):
+        """Compute the figures of every month of the given years in one
+        pass, store them in cache along with the years' figures and
+        return the latter, by year id.
+
+        Each year's figures dict holds the values of the Year properties
+        (revenue, gross_margin and net_margin) and a 'months' list of
+        (month, month's figures) pairs, ordered by date.
+
+        Keyword arguments:
+            months_figures -- figures of some months, as returned by
+                              warm, if they are already known and cached
+                              (only the other months are computed)
+
+        """
+        cache = self._dbsession.cache
+        Month = self._Month
+
+        years_figures = dict()
+        if not years:
+            return years_figures
+
+        months = self._dbsession.query(Month)\
+            .filter(or_(*[and_(
+                Month.date >= year.date,
+                Month.date < datetime.date(year=year.id + 1, month=1, day=1))
+                for year in years]))\
+            .order_by(Month.date)\
+            .all()
+
+        months_figures = dict(months_figures or {})
+        missing = [month for month in months if month.id not in months_figures]
+        if missing:
+            months_figures.update(self.read(missing))
+
+        for year in years:
+            year_figures = dict()
+            year_figures['months'] = [
+                (month, months_figures[month.id]) for month in months
+                if month.date.year == year.id]
+
+            for name in YEAR_KEYS:
+                value = float(0)
+                for month, month_figures in year_figures['months']:
+                    value += month_figures[name]
+                year_figures[name] = value
+
+            store_values(
+                cache,
+                year._key_store_key_template.format(instance=year),
+                {key_tpl.format(instance=year): year_figures[name]
+                 for name, key_tpl in YEAR_KEYS.items()})
+
+            years_figures[year.id] = year_figures
+
+        return years_figures
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+from importlib import import_module
+from itertools import islice
+
+from voluptuous import Schema, Invalid, MultipleInvalid
+
+from mozbase.util.database import db_method
+
+from mozfinance.data import DataRepository
+from mozfinance.util.commissions import InvalidFormula, compile_formula
+from mozfinance.util.dates import month_start
+
+
+class BulkData(DataRepository):
+    """DataRepository object for bulk operations."""
+
+    # Number of records validated and inserted at once.
+    chunk_size = 500
+
+    def __init__(self, bo=None):
+        DataRepository.__init__(self, bo)
+        self.Prestation = import_module('.Prestation', package=self._package)
+        self.BillPrestation = import_module('.BillPrestation', package=self._package)
+        self.Cost = import_module('.Cost', package=self._package)
+        self.CostPrestation = import_module('.CostPrestation', package=self._package)
+        self.PrestationSalesman = import_module('.AssPrestationSalesman', package=self._package)
+        self.Salesman = import_module('.Salesman', package=self._package)
+        self.SalesmanFormula = import_module('.SalesmanFormula', package=self._package)
+        self.Month = import_module('.Month', package=self._package)
+
+        self._BillSchema = Schema(self.BillPrestation.BillPrestationBaseDict)
+        self._CostSchema = Schema(self.CostPrestation.CostPrestationBaseDict)
+
+    def _validate(self, record, index):
+        """Validate a prestation record (the index-th one of the import)
+        and return it split in a tuple (prestation, bills, costs,
+        salesmen).
+
+        """
+        prestation = dict(record)
+        bills = prestation.pop('bills', None) or []
+        costs = prestation.pop('costs', None) or []
+        salesmen = prestation.pop('salesmen', None) or []
+
+        self.Prestation.PrestationSchema(prestation)
+
+        for bill in bills:
+            self._BillSchema(bill)
+
+        for cost in costs:
+            self._CostSchema(cost)
+
+        presta_sms = list()
+        salesmen_ids = set()
+        for presta_sm in salesmen:
+            if not isinstance(presta_sm, dict):
+                presta_sm = {'salesman_id': presta_sm}
+            self.PrestationSalesman.PrestationSalesmanImportSchema(presta_sm)
+
+            if presta_sm['salesman_id'] in salesmen_ids:
+                raise _invalid(
+                    index, 'duplicate salesman {}'.format(presta_sm['salesman_id']))
+            salesmen_ids.add(presta_sm['salesman_id'])
+
+            if presta_sm.get('formula') is not None:
+                try:
+                    compile_formula(presta_sm['formula'])
+                except InvalidFormula as e:
+                    raise _invalid(index, 'invalid formula of salesman {}: {}'.format(
+                        presta_sm['salesman_id'], e))
+
+            presta_sms.append(presta_sm)
+
+        return prestation, bills, costs, presta_sms
+
+    def _formulae(self, records, start):
+        """Return the default formula of every prestation-salesman
+        association of validated records without a formula, by (index
+        of the record in the chunk, salesman_id). Raise MultipleInvalid,
+        naming the record, if a salesman does not exist or has no
+        formula for the category and sector of the prestation.
+
+        Arguments:
+            records -- validated records (see _validate)
+            start -- index of the first record in the import
+
+        """
+        salesmen_ids = set()
+        for _, _, _, presta_sms in records:
+            for presta_sm in presta_sms:
+                salesmen_ids.add(presta_sm['salesman_id'])
+
+        if not salesmen_ids:
+            return dict()
+
+        Salesman = self.Salesman.Salesman
+        existing_ids = set(salesman_id for salesman_id, in self._dbsession
+                           .query(Salesman.id)
+                           .filter(Salesman.id.in_(salesmen_ids)))
+        for i, (_, _, _, presta_sms) in enumerate(records):
+            for presta_sm in presta_sms:
+                if presta_sm['salesman_id'] not in existing_ids:
+                    raise _invalid(
+                        start + i,
+                        'unknown salesman {}'.format(presta_sm['salesman_id']))
+
+        SalesmanFormula = self.SalesmanFormula.SalesmanFormula
+        salesmen_formulae = self._dbsession\
+            .query(
+                SalesmanFormula.salesman_id,
+                SalesmanFormula.category,
+                SalesmanFormula.sector,
+                SalesmanFormula.formula)\
+            .filter(SalesmanFormula.salesman_id.in_(salesmen_ids))
+        formulae = dict(
+            ((salesman_id, category, sector), formula)
+            for salesman_id, category, sector, formula in salesmen_formulae)
+
+        defaults = dict()
+        for i, (prestation, _, _, presta_sms) in enumerate(records):
+            category = prestation.get('category', self.Prestation.PRESTATION_CATEGORY_NONE)
+            sector = prestation.get('sector', self.Prestation.PRESTATION_SECTOR_NONE)
+            for presta_sm in presta_sms:
+                if presta_sm.get('formula') is not None:
+                    continue
+
+                key = (presta_sm['salesman_id'], category, sector)
+                if key not in formulae:
+                    raise _invalid(
+                        start + i,
+                        'salesman {} has no formula for category {} and '
+                        'sector {}'.format(*key))
+                defaults[(i, presta_sm['salesman_id'])] = formulae[key]
+
+        return defaults
+
+    def _insert_with_ids(self, table, rows):
+        """Insert rows in a table, one statement each, and return their
+        ids (their inserted_primary_key), in the order of the rows.
+
+        """
+        insert = table.insert()
+        return [self._dbsession.execute(insert, row).inserted_primary_key[0]
+                for row in _complete(table, rows)]
+
+    def _insert_chunk(self, chunk, start=0):
+        """Validate and insert a chunk of prestation records with core
+        inserts: one statement per prestation and per cost, whose ids
+        are needed by the other rows, and one executemany per other
+        table. Return the set of the dates of the touched months.
+
+        Keyword arguments:
+            start -- index of the first record of the chunk in the import
+
+        """
+        records = [self._validate(record, start + i)
+                   for i, record in enumerate(chunk)]
+        formulae = self._formulae(records, start)
+
+        prestations_table = self.Prestation.Prestation.__table__
+        bills_table = self.BillPrestation.BillPrestation.__table__
+        costs_table = self.Cost.Cost.__table__
+        costs_prestation_table = self.CostPrestation.CostPrestation.__table__
+        presta_sms_table = self.PrestationSalesman.PrestationSalesman.__table__
+        cost_type = self.CostPrestation.CostPrestation.__mapper__.polymorphic_identity
+
+        prestations_rows = list()
+        months_dates = set()
+        for prestation, _, _, presta_sms in records:
+            prestation['salesmen_count'] = len(presta_sms)
+            prestations_rows.append(prestation)
+            months_dates.add(month_start(prestation['date']))
+
+        # The ids of the prestations and costs are needed by the rows
+        # referencing them.
+        prestations_ids = self._insert_with_ids(prestations_table, prestations_rows)
+
+        bills_rows = list()
+        costs_rows = list()
+        costs_prestations_ids = list()
+        presta_sms_rows = list()
+
+        for i, (presta_id, (_, bills, costs, presta_sms)) in enumerate(
+                zip(prestations_ids, records)):
+            for bill in bills:
+                bill_row = dict(bill)
+                bill_row['prestation_id'] = presta_id
+                bills_rows.append(bill_row)
+
+            for cost in costs:
+                cost_row = dict(cost)
+                cost_row['type'] = cost_type
+                costs_rows.append(cost_row)
+                costs_prestations_ids.append(presta_id)
+
+            for presta_sm in presta_sms:
+                formula = presta_sm.get('formula')
+                if formula is None:
+                    formula = formulae[(i, presta_sm['salesman_id'])]
+
+                presta_sms_rows.append({
+                    'prestation_id': presta_id,
+                    'salesman_id': presta_sm['salesman_id'],
+                    'ratio': presta_sm.get('ratio'),
+                    'formula': formula})
+
+        costs_ids = self._insert_with_ids(costs_table, costs_rows)
+        costs_prestation_rows = [
+            {'id': cost_id, 'prestation_id': presta_id}
+            for cost_id, presta_id in zip(costs_ids, costs_prestations_ids)]
+
+        for table, rows in [(bills_table, bills_rows),
+                            (costs_prestation_table, costs_prestation_rows),
+                            (presta_sms_table, presta_sms_rows)]:
+            if rows:
+                self._dbsession.execute(table.insert(), _complete(table, rows))
+
+        return months_dates
+
+    @db_method
+    def import_prestations(self, records=None, chunk_size=None):
+        """Import prestations, with their bills, costs and salesmen, from
+        an iterable of records. Records are validated and inserted by
+        chunks with core inserts, then every touched month is expired
+        once. Return the number of imported prestations. Raise
+        MultipleInvalid, naming the record, if a record is not valid,
+        lists a salesman twice, an unknown salesman, an invalid formula
+        or a salesman without a formula for its category and sector.
+
+        Eg: import_prestations(records=[{
+                'date': datetime.date(2013, 1, 2),
+                'client': u'Client',
+                'category': 0,
+                'sector': 0,
+                'bills': [{'ref': u'F-001', 'amount': 1200.0}],
+                'costs': [{'reason': u'Transport', 'amount': 100.0}],
+                'salesmen': [1, {'salesman_id': 2, 'ratio': 0.25}]}])
+
+        Keyword arguments:
+            records -- iterable of dicts of prestations' fields (see
+                       mozfinance.data.model.Prestation.PrestationSchema)
+                       with optional lists of 'bills' (see BillPrestation),
+                       'costs' (see CostPrestation) and 'salesmen' (ids,
+                       or dicts of salesman_id, ratio and formula; the
+                       formula defaults to the salesman's one)
+            chunk_size -- number of records inserted at once, default:
+                          BulkData.chunk_size
+
+        """
+        if records is None:
+            raise TypeError('records not provided')
+
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        records = iter(records)
+        months_dates = set()
+        imported = 0
+
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+
+            months_dates.update(self._insert_chunk(chunk, start=imported))
+            imported += len(chunk)
+
+        if months_dates:
+            Month = self.Month.Month
+            months = self._dbsession.query(Month)\
+                .filter(Month.date.in_(months_dates))\
+                .all()
+
+            with self._expiring():
+                for month in months:
+                    self._bo.month._expire(month=month)
+
+        return imported
+
+
+def _invalid(index, msg):
+    """Return a MultipleInvalid naming the index-th record of an
+    import.
+
+    """
+    return MultipleInvalid([Invalid(
+        '{} in record {}'.format(msg, index), path=[index])])
+
+
+def _complete(table, rows):
+    """Return rows all holding the same keys, as required by
+    executemany: a missing value is the scalar default of its column, or
+    None.
+
+    """
+    keys = set()
+    for row in rows:
+        keys.update(row)
+
+    defaults = dict()
+    for key in keys:
+        default = table.c[key].default
+        if default is not None and default.is_scalar:
+            defaults[key] = default.arg
+        else:
+            defaults[key] = None
+
+    completed = list()
+    for row in rows:
+        completed_row = dict(defaults)
+        completed_row.update(row)
+        completed.append(completed_row)
+
+    return completed
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 from importlib import import_module
 
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import NoResultFound
+
 from mozbase.util.database import db_method
 
 from mozfinance.data import DataRepository
+from mozfinance.data.delta import apply_delta, _float
 
 
 class CostData(DataRepository):
@@ -107,29 +111,45 @@ class CostPrestationData(CostData):
         self._CostClass = CostPrestation.CostPrestation
         self._CostSchema = CostPrestation.CostPrestationSchema
 
+    @db_method
     def create(self, prestation_id=None, prestation=None, **kwargs):
         presta = self._bo.prestation._get(prestation_id, prestation)
         kwargs['prestation'] = presta
 
-        cost = CostData.create(self, **kwargs)
-        self._bo.prestation._expire(prestation=presta)
+        cost = CostData.create(self, commit=False, **kwargs)
+        if self._incremental():
+            apply_delta(self, prestation=presta, prestation_cost=cost.amount)
+        else:
+            self._bo.prestation._invalidate('prestation.costs', presta)
 
         return cost
 
+    @db_method
     def update(self, cost_id=None, cost=None, **kwargs):
         cost = self._get(cost_id, cost)
         kwargs['cost'] = cost
 
-        will_return = CostData.update(self, **kwargs)
-        self._bo.prestation._expire(prestation=cost.prestation)
+        amount = cost.amount
+        will_return = CostData.update(self, commit=False, **kwargs)
+        if self._incremental():
+            delta = _float(cost.amount) - _float(amount)
+            if delta:
+                apply_delta(self, prestation=cost.prestation, prestation_cost=delta)
+        else:
+            self._bo.prestation._invalidate('prestation.costs', cost.prestation)
 
         return will_return
 
+    @db_method
     def remove(self, cost_id=None, cost=None):
         cost = self._get(cost_id, cost)
         prestation = cost.prestation
-        CostData.remove(self, cost=cost)
-        self._bo.prestation._expire(prestation=prestation)
+        amount = cost.amount
+        CostData.remove(self, cost=cost, commit=False)
+        if self._incremental():
+            apply_delta(self, prestation=prestation, prestation_cost=-_float(amount))
+        else:
+            self._bo.prestation._invalidate('prestation.costs', prestation)
 
 
 class CostMonthData(CostData):
@@ -141,33 +161,75 @@ class CostMonthData(CostData):
         self._CostClass = CostMonth.CostMonth
         self._CostSchema = CostMonth.CostMonthSchema
 
+    @db_method
     def create(self, month_id=None, month=None, month_date=None,
                expire=True, **kwargs):
         month = self._bo.month._get(month_id, month, month_date)
         kwargs['month'] = month
 
-        cost = CostData.create(self, **kwargs)
-        if not expire:
-            self._bo.month._expire(month=month)
+        cost = CostData.create(self, commit=False, **kwargs)
+        if expire:
+            self._expire_month(cost, month, cost.amount)
 
         return cost
 
+    @db_method
     def update(self, cost_id=None, cost=None, expire=True, **kwargs):
         cost = self._get(cost_id, cost)
         kwargs['cost'] = cost
 
-        will_return = CostData.update(self, **kwargs)
-        if not expire:
-            self._bo.month._expire(month=cost.month)
+        amount = cost.amount
+        will_return = CostData.update(self, commit=False, **kwargs)
+        if expire:
+            self._expire_month(
+                cost, cost.month, _float(cost.amount) - _float(amount))
 
         return will_return
 
+    @db_method
     def remove(self, cost_id=None, cost=None, expire=True, **kwargs):
         cost = self._get(cost_id, cost)
         month = cost.month
-        CostData.remove(self, cost=cost)
-        if not expire:
-            self._bo.month._expire(month=month)
+        amount = cost.amount
+        CostData.remove(self, cost=cost, commit=False)
+        if expire:
+            self._expire_month(cost, month, -_float(amount))
+
+    def _expire_month(self, cost, month, delta):
+        """Expire the figures of the month of a cost affected by its
+        change or, in incremental mode, apply the difference of amount of
+        the cost to the month's figures.
+
+        """
+        base = cost.no_commission_base is not None and not cost.no_commission_base
+
+        if not self._incremental():
+            self._bo.month._invalidate(
+                'month.base_costs' if base else 'month.costs', month)
+            return
+
+        if not delta:
+            return
+
+        apply_delta(self, month=month, month_cost=delta,
+                    base_cost=delta if base else float(0))
+
+    def _prefetch(self, actions):
+        """Return a dict, by id, of the costs referenced by cost_id in the
+        given actions, loaded (with their months) in one query.
+
+        """
+        costs_ids = set(action['cost_id'] for action in actions
+                        if action.get('cost') is None and action.get('cost_id'))
+        if not costs_ids:
+            return dict()
+
+        costs = self._dbsession.query(self._CostClass)\
+            .options(joinedload('month'))\
+            .filter(self._CostClass.id.in_(costs_ids))\
+            .all()
+
+        return dict((cost.id, cost) for cost in costs)
 
     def actions_batch(self, month_id=None, month=None, create=None,
                       update=None, remove=None):
@@ -175,10 +237,12 @@ class CostMonthData(CostData):
 
         create/update/remove must be lists of dictonaries containing the
         arguments that will be passed to create/update/remove methods.
+        Created costs default to the given month.
 
-        Beware, only the given month will be expired. If some actions
-        are performed over other months (for instance because a cost of
-        another month has been given), these months won't be expired.
+        Every cost referenced by its id is loaded in one query, every
+        action is performed, every affected month (the given one, and the
+        months of the created, updated and removed costs) is expired
+        once, then everything is committed at once.
 
         Eg: actions_batch(
                 month_id=2,
@@ -195,18 +259,46 @@ class CostMonthData(CostData):
 
         """
         month = self._bo.month._get(month_id, month)
-
-        if create:
-            for item in create:
-                self.create(expire=False, commit=False, **item)
-
-        if update:
-            for item in update:
-                self.update(expire=False, commit=False, **item)
-
-        if remove:
-            for item in remove:
-                self.remove(expire=False, commit=False, **item)
+        create = create or []
+        update = update or []
+        remove = remove or []
+
+        costs = self._prefetch(update + remove)
+
+        def get_cost(action):
+            if action.get('cost') is not None:
+                return self._get(cost=action['cost'])
+            if action.get('cost_id') in costs:
+                return costs[action['cost_id']]
+            raise NoResultFound('no cost for {}'.format(action))
+
+        months = [month]
+
+        def add_month(a_month):
+            if a_month is not None and a_month not in months:
+                months.append(a_month)
+
+        for item in create:
+            kwargs = dict(item)
+            if not any(kwargs.get(k) for k in ['month', 'month_id', 'month_date']):
+                kwargs['month'] = month
+            cost = self.create(expire=False, commit=False, **kwargs)
+            add_month(cost.month)
+
+        for item in update:
+            kwargs = dict(item)
+            kwargs['cost'] = get_cost(item)
+            add_month(kwargs['cost'].month)
+            self.update(expire=False, commit=False, **kwargs)
+
+        for item in remove:
+            kwargs = dict(item)
+            kwargs['cost'] = get_cost(item)
+            add_month(kwargs['cost'].month)
+            self.remove(expire=False, commit=False, **kwargs)
+
+        with self._expiring():
+            for a_month in months:
+                self._bo.month._expire(month=a_month)
 
         self._dbsession.commit()
-        self._bo.month._expire(month=month)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Incremental updates of the cached figures (see
+BusinessObject.incremental).
+
+Instead of expiring a prestation, its month and its year when a bill or
+a cost changes, the difference of amount is applied to their cached
+values (and to the month's summary). Values missing from the cache are
+left missing. Commissions cannot be updated by a difference: the
+affected ones are expired. The updated keys are deleted if the
+transaction of the change rolls back.
+
+"""
+import threading
+
+from dogpile.cache.api import NoValue
+from sqlalchemy import event
+
+from mozfinance.data.aggregation import (
+    PRESTATION_KEYS, MONTH_KEYS, YEAR_KEYS, InstanceRef, _float)
+from mozfinance.data.dependencies import invalidate
+
+
+def figures_deltas(selling_price=0, prestation_cost=0, month_cost=0,
+                   base_cost=0):
+    """Return the differences of every prestation's, month's and year's
+    figure implied by differences of selling price, prestation cost and
+    month cost (base_cost being the part of month_cost counted in the
+    commission base), as a tuple of three dicts (prestation, month,
+    year).
+
+    """
+    gross_margin = selling_price - prestation_cost
+
+    prestation = {
+        'selling_price': selling_price,
+        'total_cost': prestation_cost,
+        'margin': gross_margin}
+
+    month = {
+        'revenue': selling_price,
+        'total_prestation_cost': prestation_cost,
+        'total_month_cost': month_cost,
+        'gross_margin': gross_margin,
+        'net_margin': gross_margin - month_cost,
+        'commission_base': gross_margin - base_cost}
+
+    year = {
+        'revenue': selling_price,
+        'gross_margin': gross_margin,
+        'net_margin': gross_margin - month_cost}
+
+    return prestation, month, year
+
+
+# Key of the mutex of the cache backend (see _delta_mutex).
+_DELTA_MUTEX_KEY = 'mozfinance:delta'
+
+# Mutex used if the cache backend provides none.
+_delta_lock = threading.Lock()
+
+
+def _delta_mutex(cache):
+    """Return the mutex serializing the updates of cached values: the
+    backend's one if it provides one (eg: a lock file, shared by
+    processes), a lock of this process otherwise.
+
+    """
+    mutex = cache.backend.get_mutex(_DELTA_MUTEX_KEY)
+    if mutex is None:
+        return _delta_lock
+
+    return mutex
+
+
+def _apply_to_cache(cache, deltas):
+    """Add deltas (a dict of differences by key) to the cached values,
+    leaving the missing ones missing. Return the list of the updated
+    keys.
+
+    """
+    keys = [key for key, delta in deltas.items() if delta]
+    if not keys:
+        return []
+
+    mutex = _delta_mutex(cache)
+    mutex.acquire()
+    try:
+        values = dict()
+        for key, value in zip(keys, cache.get_multi(keys)):
+            if not isinstance(value, NoValue):
+                values[key] = value + deltas[key]
+
+        if values:
+            cache.set_multi(values)
+    finally:
+        mutex.release()
+
+    return list(values)
+
+
+def _expire_on_rollback(dbsession, keys):
+    """Delete keys from the cache of a session if its transaction rolls
+    back (their deltas belong to the rolled back changes). They are
+    forgotten when it commits.
+
+    """
+    pending = dbsession.info.get('mozfinance_delta_keys')
+    if pending is None:
+        pending = dbsession.info['mozfinance_delta_keys'] = set()
+
+        def expire(dbsession):
+            if pending:
+                dbsession.cache.delete_multi(list(pending))
+                pending.clear()
+
+        def forget(dbsession):
+            pending.clear()
+
+        event.listen(dbsession, 'after_rollback', expire)
+        event.listen(dbsession, 'after_commit', forget)
+
+    pending.update(keys)
+
+
+def apply_delta(repository, prestation=None, month=None, selling_price=None,
+                prestation_cost=None, month_cost=None, base_cost=None):
+    """Apply differences of selling price or prestation cost (of a
+    prestation), or of month cost (of a month) to the cached figures of
+    the prestation, of its month and of its year, and to the month's
+    summary if it is fresh. The updated cached values are deleted if the
+    transaction rolls back. Expire the commissions affected by the
+    change (see mozfinance.data.dependencies).
+
+    Arguments:
+        repository -- DataRepository of the mutation
+        prestation -- prestation whose bills or costs changed (*)
+        month -- month whose costs changed (*)
+        selling_price -- difference of selling price
+        prestation_cost -- difference of the prestation's costs
+        month_cost -- difference of the month's costs
+        base_cost -- part of month_cost counted in the commission base
+
+    * one is required
+
+    """
+    bo = repository._bo
+    cache = repository._dbsession.cache
+
+    if prestation is not None:
+        month = prestation.month
+
+    presta_deltas, month_deltas, year_deltas = figures_deltas(
+        _float(selling_price), _float(prestation_cost),
+        _float(month_cost), _float(base_cost))
+
+    deltas = dict()
+    if prestation is not None:
+        for name, key_tpl in PRESTATION_KEYS.items():
+            deltas[key_tpl.format(instance=prestation)] = presta_deltas[name]
+
+    if month is not None:
+        for name, key_tpl in MONTH_KEYS.items():
+            deltas[key_tpl.format(instance=month)] = month_deltas[name]
+
+        year = InstanceRef(id=month.date.year)
+        for name, key_tpl in YEAR_KEYS.items():
+            deltas[key_tpl.format(instance=year)] = year_deltas[name]
+
+    _expire_on_rollback(repository._dbsession, _apply_to_cache(cache, deltas))
+
+    if month is not None:
+        bo.month._apply_summary_delta(month, month_deltas)
+
+    with repository._expiring():
+        for source, delta in [('prestation.bills', selling_price),
+                              ('prestation.costs', prestation_cost),
+                              ('month.base_costs', base_cost),
+                              ('month.costs', None if base_cost else month_cost)]:
+            if delta:
+                invalidate(repository, source, prestation=prestation,
+                           month=month, figures=False)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Dependency graph of the cached figures, used to invalidate only the
+figures affected by a change instead of every figure of a month.
+
+Nodes are named 'level.name': figures (eg: 'prestation.margin') and
+sources, the data changed by mutations (eg: 'prestation.bills'). The
+commission of a prestation-salesman association only depends on the
+variables its formula uses, so that a change of the month's costs does
+not expire the commissions whose formulae ignore them.
+
+"""
+import mozfinance
+from mozfinance.data.aggregation import (
+    PRESTATION_KEYS, MONTH_KEYS, YEAR_KEYS, PRESTATION_SALESMAN_KEYS,
+    MONTH_SALESMAN_KEYS, InstanceRef)
+from mozfinance.util.commissions import (
+    _COMMISSIONS_VARIABLES, compile_formula, InvalidFormula)
+from mozfinance.util.dates import next_month_start
+
+
+# Nodes of the commissions' variables, by variable (eg: 'p_m' is
+# 'prestation.margin').
+VARIABLE_NODES = dict(
+    (variable, '{}.{}'.format(level, definition['attr']))
+    for level, variables in _COMMISSIONS_VARIABLES.items()
+    for variable, definition in variables.items())
+
+MONTH_VARIABLE_NODES = set(
+    VARIABLE_NODES[variable] for variable in _COMMISSIONS_VARIABLES['month'])
+
+# A commission is nil when the prestation's margin or the month's
+# commission base is not positive, whatever its formula.
+COMMISSION_NODES = set([
+    'prestation.margin', 'month.commission_base', 'prestation.salesmen',
+    'prestation_salesman.ratio', 'prestation_salesman.formula'])
+
+# Sources changing commissions without changing any figure.
+COMMISSION_SOURCES = set([
+    'prestation.salesmen', 'prestation_salesman.ratio',
+    'prestation_salesman.formula'])
+
+# Nodes each node depends on.
+DEPENDENCIES = {
+    'prestation.selling_price': ['prestation.bills'],
+    'prestation.total_cost': ['prestation.costs'],
+    'prestation.margin': ['prestation.selling_price', 'prestation.total_cost'],
+    'month.revenue': ['prestation.selling_price'],
+    'month.total_prestation_cost': ['prestation.total_cost'],
+    'month.total_month_cost': ['month.costs', 'month.base_costs'],
+    'month.gross_margin': ['month.revenue', 'month.total_prestation_cost'],
+    'month.net_margin': ['month.gross_margin', 'month.total_month_cost'],
+    'month.commission_base': ['month.gross_margin', 'month.base_costs'],
+    'year.revenue': ['month.revenue'],
+    'year.gross_margin': ['month.gross_margin'],
+    'year.net_margin': ['month.net_margin'],
+    'prestation_salesman.commission':
+        sorted(COMMISSION_NODES | set(VARIABLE_NODES.values())),
+    'month_salesman.commission_prestations': ['prestation_salesman.commission'],
+    'month_salesman.commission_bonuses': sorted(MONTH_VARIABLE_NODES),
+    'month_salesman.commission_total': [
+        'month_salesman.commission_prestations',
+        'month_salesman.commission_bonuses'],
+}
+
+# Keys of the figures, by node.
+FIGURES_KEYS = dict(
+    [('prestation.' + name, tpl) for name, tpl in PRESTATION_KEYS.items()] +
+    [('month.' + name, tpl) for name, tpl in MONTH_KEYS.items()] +
+    [('year.' + name, tpl) for name, tpl in YEAR_KEYS.items()])
+
+
+def dependents(sources):
+    """Return the set of the nodes depending, directly or not, on the
+    given nodes (included).
+
+    """
+    affected = set(sources)
+    changed = True
+    while changed:
+        changed = False
+        for node, dependencies in DEPENDENCIES.items():
+            if node not in affected and affected.intersection(dependencies):
+                affected.add(node)
+                changed = True
+
+    return affected
+
+
+def formula_nodes(formula):
+    """Return the set of the nodes the commission of a formula depends
+    on. An invalid formula depends on every variable.
+
+    """
+    try:
+        variables = compile_formula(formula).variables
+    except InvalidFormula:
+        variables = VARIABLE_NODES.keys()
+
+    return COMMISSION_NODES | set(VARIABLE_NODES[v] for v in variables)
+
+
+def bonuses_nodes():
+    """Return the set of the nodes the monthly bonuses (see
+    mozfinance.COMMISSIONS_BONUSES) depend on. A function may use every
+    monthly variable.
+
+    """
+    nodes = set()
+    for bonus in mozfinance.COMMISSIONS_BONUSES:
+        if not isinstance(bonus, basestring):
+            return set(MONTH_VARIABLE_NODES)
+        nodes.update(VARIABLE_NODES[v]
+                     for v in compile_formula(bonus, scope='month').variables)
+
+    return nodes
+
+
+def _month_commissions(repository, month):
+    """Return (prestation_id, salesman_id, formula) of every
+    prestation-salesman association of a month.
+
+    """
+    Prestation = repository._bo.prestation.Prestation.Prestation
+    PrestationSalesman = repository._bo.prestation.PrestationSalesman.PrestationSalesman
+
+    return repository._dbsession.query(
+            PrestationSalesman.prestation_id,
+            PrestationSalesman.salesman_id,
+            PrestationSalesman.formula)\
+        .join(Prestation, Prestation.id == PrestationSalesman.prestation_id)\
+        .filter(Prestation.date >= month.date)\
+        .filter(Prestation.date < next_month_start(month.date))\
+        .all()
+
+
+def invalidated_keys(repository, source, prestation=None, month=None,
+                     salesmen_ids=None, figures=True):
+    """Return the list of the keys invalidated by a change of source.
+
+    Arguments:
+        repository -- DataRepository of the change
+        source -- changed node: 'prestation.bills', 'prestation.costs',
+                  'month.costs' (out of the commission base),
+                  'month.base_costs', 'prestation.salesmen',
+                  'prestation_salesman.ratio' or
+                  'prestation_salesman.formula'
+        prestation -- changed prestation (for prestation's sources)
+        month -- changed month (for month's sources)
+        salesmen_ids -- salesmen of the changed associations (for
+                        ratio and formula), or removed salesmen (for
+                        prestation.salesmen)
+        figures -- if False, only the commissions' keys are returned
+
+    """
+    affected = dependents([source])
+    if prestation is not None:
+        month = prestation.month
+
+    keys = list()
+
+    if figures:
+        for node in sorted(affected):
+            level = node.split('.')[0]
+            if node not in FIGURES_KEYS:
+                continue
+            if level == 'prestation' and prestation is not None:
+                keys.append(FIGURES_KEYS[node].format(instance=prestation))
+            elif level == 'month' and month is not None:
+                keys.append(FIGURES_KEYS[node].format(instance=month))
+            elif level == 'year' and month is not None:
+                keys.append(FIGURES_KEYS[node].format(
+                    instance=InstanceRef(id=month.date.year)))
+
+    if 'prestation_salesman.commission' not in affected:
+        return keys
+
+    month_affected = set(node for node in affected
+                         if node.split('.')[0] in ('month', 'year'))
+
+    if month is not None and month_affected:
+        candidates = _month_commissions(repository, month)
+    elif prestation is not None:
+        candidates = [(presta_sm.prestation_id, presta_sm.salesman_id,
+                       presta_sm.formula)
+                      for presta_sm in prestation.prestation_salesmen]
+    else:
+        candidates = list()
+
+    commissions = set()
+    for presta_id, salesman_id, formula in candidates:
+        if prestation is not None and presta_id == prestation.id:
+            if source in COMMISSION_SOURCES:
+                if (source == 'prestation.salesmen' or
+                        salesman_id in (salesmen_ids or [])):
+                    commissions.add((presta_id, salesman_id))
+            elif formula_nodes(formula) & affected:
+                commissions.add((presta_id, salesman_id))
+        elif formula_nodes(formula) & month_affected:
+            commissions.add((presta_id, salesman_id))
+
+    if source == 'prestation.salesmen' and prestation is not None:
+        for salesman_id in salesmen_ids or []:
+            commissions.add((prestation.id, salesman_id))
+
+    for presta_id, salesman_id in sorted(commissions):
+        presta_sm = InstanceRef(prestation_id=presta_id, salesman_id=salesman_id)
+        for key_tpl in PRESTATION_SALESMAN_KEYS.values():
+            keys.append(key_tpl.format(instance=presta_sm))
+
+    if month is None:
+        return keys
+
+    prestations_salesmen = set(salesman_id for _, salesman_id in commissions)
+    bonuses_salesmen = set()
+    if bonuses_nodes() & affected:
+        bonuses_salesmen = set(
+            month_sm.salesman.id for month_sm
+            in repository._bo.month.salesman._month_salesmen(month))
+
+    for salesman_id in sorted(prestations_salesmen | bonuses_salesmen):
+        month_sm = InstanceRef(month=month, salesman=InstanceRef(id=salesman_id))
+        for name, key_tpl in MONTH_SALESMAN_KEYS.items():
+            if (name == 'commission_prestations' and
+                    salesman_id not in prestations_salesmen):
+                continue
+            if (name == 'commission_bonuses' and
+                    salesman_id not in bonuses_salesmen):
+                continue
+            keys.append(key_tpl.format(instance=month_sm))
+
+    return keys
+
+
+def invalidate(repository, source, prestation=None, month=None,
+               salesmen_ids=None, figures=True):
+    """Delete the keys invalidated by a change of source (see
+    invalidated_keys), in the running expire batch if any. Return the
+    number of deleted keys.
+
+    """
+    keys = invalidated_keys(repository, source, prestation, month,
+                            salesmen_ids, figures)
+
+    with repository._expiring() as batch:
+        batch.add_keys(keys)
+
+    return len(keys)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Streaming export of the ledger: one row per prestation with its
+figures, salesmen and commissions.
+
+Months are exported by chunks: the figures and commissions of a chunk
+are computed with the bulk queries of MonthAggregator (without touching
+the cache), then its prestations are streamed from the database with
+yield_per. Only one chunk is held in memory at a time.
+
+"""
+from importlib import import_module
+import csv
+
+from mozfinance.data.aggregation import MonthAggregator
+from mozfinance.util.dates import month_start, next_month_start
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+COLUMNS = [
+    'prestation_id', 'date', 'client', 'category', 'sector',
+    'selling_price', 'total_cost', 'margin',
+    'salesmen', 'commissions', 'total_commission']
+
+
+class LedgerExporter(object):
+    """Export every prestation of the months of a date range (see
+    BusinessObject.export_ledger).
+
+    """
+
+    # Number of months whose figures are computed at once.
+    chunk_size = 3
+
+    # Number of prestations fetched at once from the database.
+    batch_size = 500
+
+    def __init__(self, bo, chunk_size=None, batch_size=None):
+        """Init a LedgerExporter.
+
+        Arguments:
+            bo -- BusinessObject to export
+            chunk_size -- default: LedgerExporter.chunk_size
+            batch_size -- default: LedgerExporter.batch_size
+
+        """
+        self._bo = bo
+        self._dbsession = bo._dbsession
+        self._package = bo._package
+        self._Month = import_module('.Month', package=self._package).Month
+        self._Prestation = import_module(
+            '.Prestation', package=self._package).Prestation
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+    def _months(self, start=None, end=None):
+        """Return the months of a date range, ordered by date."""
+        Month = self._Month
+        query = self._dbsession.query(Month)
+        if start is not None:
+            query = query.filter(Month.date >= month_start(start))
+        if end is not None:
+            query = query.filter(Month.date < next_month_start(end))
+        return query.order_by(Month.date).all()
+
+    def _chunk_rows(self, aggregator, months):
+        """Yield the rows of the prestations of a chunk of months."""
+        Prestation = self._Prestation
+
+        figures = aggregator.compute(months)
+        commissions = aggregator.commissions(months, figures=figures)
+
+        prestations_figures = dict()
+        for month in months:
+            prestations_figures.update(figures[month.id]['prestations'])
+
+        # (salesman_id, commission) of each prestation, by prestation id.
+        salesmen = dict()
+        for month in months:
+            month_commissions = commissions[month.id]['prestation_salesmen']
+            for (presta_id, salesman_id), commission in month_commissions.items():
+                salesmen.setdefault(presta_id, []).append((salesman_id, commission))
+
+        prestations = self._dbsession\
+            .query(
+                Prestation.id,
+                Prestation.date,
+                Prestation.client,
+                Prestation.category,
+                Prestation.sector)\
+            .filter(aggregator._prestations_filter(months))\
+            .order_by(Prestation.date, Prestation.id)\
+            .yield_per(self.batch_size)
+
+        for presta_id, presta_date, client, category, sector in prestations:
+            presta_figures = prestations_figures[presta_id]
+            presta_salesmen = sorted(salesmen.get(presta_id, []))
+
+            yield {
+                'prestation_id': presta_id,
+                'date': presta_date,
+                'client': client,
+                'category': category,
+                'sector': sector,
+                'selling_price': presta_figures['selling_price'],
+                'total_cost': presta_figures['total_cost'],
+                'margin': presta_figures['margin'],
+                'salesmen': [salesman_id for salesman_id, _ in presta_salesmen],
+                'commissions': [commission for _, commission in presta_salesmen],
+                'total_commission': sum(
+                    [commission for _, commission in presta_salesmen], float(0)),
+            }
+
+    def rows(self, start=None, end=None):
+        """Yield a dict (see COLUMNS) for every prestation of the months
+        between start and end, ordered by date. 'salesmen' and
+        'commissions' are lists, ordered by salesman id.
+
+        Keyword arguments:
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+
+        """
+        months = self._months(start, end)
+        aggregator = MonthAggregator(self._dbsession, self._package)
+
+        for i in range(0, len(months), self.chunk_size):
+            for row in self._chunk_rows(aggregator, months[i:i + self.chunk_size]):
+                yield row
+
+    def write_csv(self, fileobj, start=None, end=None):
+        """Write the rows (see rows) as CSV, with a header, to a file
+        object. Lists are joined with spaces. Return the number of
+        written rows.
+
+        """
+        writer = csv.writer(fileobj)
+        writer.writerow(COLUMNS)
+
+        count = 0
+        for row in self.rows(start, end):
+            writer.writerow([_csv_value(row[column]) for column in COLUMNS])
+            count += 1
+
+        return count
+
+    def write_parquet(self, where, start=None, end=None):
+        """Write the rows (see rows) as a Parquet file (a path or a file
+        object), one row group per batch_size rows. Return the number of
+        written rows. Require pyarrow.
+
+        """
+        if pyarrow is None:
+            raise ImportError('pyarrow is required to write Parquet files')
+
+        schema = pyarrow.schema([
+            pyarrow.field('prestation_id', pyarrow.int64()),
+            pyarrow.field('date', pyarrow.date32()),
+            pyarrow.field('client', pyarrow.string()),
+            pyarrow.field('category', pyarrow.int64()),
+            pyarrow.field('sector', pyarrow.int64()),
+            pyarrow.field('selling_price', pyarrow.float64()),
+            pyarrow.field('total_cost', pyarrow.float64()),
+            pyarrow.field('margin', pyarrow.float64()),
+            pyarrow.field('salesmen', pyarrow.list_(pyarrow.int64())),
+            pyarrow.field('commissions', pyarrow.list_(pyarrow.float64())),
+            pyarrow.field('total_commission', pyarrow.float64())])
+
+        writer = pyarrow.parquet.ParquetWriter(where, schema)
+
+        def write(batch):
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array([row[field.name] for row in batch], type=field.type)
+                 for field in schema],
+                schema=schema))
+
+        count = 0
+        try:
+            batch = list()
+            for row in self.rows(start, end):
+                batch.append(row)
+                if len(batch) == self.batch_size:
+                    write(batch)
+                    count += len(batch)
+                    batch = list()
+            if batch:
+                write(batch)
+                count += len(batch)
+        finally:
+            writer.close()
+
+        return count
+
+
+def _csv_value(value):
+    """Return a value as written in a CSV cell."""
+    if isinstance(value, list):
+        # Floats are written with repr, as the csv module does for
+        # scalars: str would round them to 12 significant digits.
+        return ' '.join(repr(item) if isinstance(item, float) else str(item)
+                        for item in value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
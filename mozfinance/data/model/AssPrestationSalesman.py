@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 from sqlalchemy import Column, ForeignKey, Integer, Float, String
 from sqlalchemy.orm import backref, relationship
+from voluptuous import Schema, Required, Any
 
 from mozbase.util.cache import cached_property
 
 from . import Base, Prestation, Salesman
+from mozfinance.util.commissions import compile_formula
 
 
 class PrestationSalesman(Base):
@@ -61,6 +63,16 @@ class PrestationSalesman(Base):
         else:
             # If ratio is not defined, we attribute a default "equal"
             # ratio.
-            ratio = float(1) / float(self.prestation.prestation_salesmen_query.count())
+            salesmen_count = self.prestation.salesmen_count
+            if not salesmen_count:
+                salesmen_count = self.prestation.prestation_salesmen_query.count()
+            ratio = float(1) / float(salesmen_count)
 
-        return eval(self.formula.format(**com_params)) * ratio
+        return compile_formula(self.formula)(**com_params) * ratio
+
+
+PrestationSalesmanImportSchema = Schema({
+    Required('salesman_id'): int,
+    'ratio': Any(float, None),
+    'formula': basestring
+})
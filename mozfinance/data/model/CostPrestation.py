@@ -18,8 +18,12 @@ class CostPrestation(Cost.Cost):
     create_dict = set(['reason', 'amount', 'prestation'])
 
 
-CostPrestationSchema = Schema({
+CostPrestationBaseDict = {
     Required('reason'): All(unicode, Length(min=3, max=30)),
-    Required('prestation'): Prestation.Prestation,
     'amount': float
-})
+}
+
+
+CostPrestationDict = CostPrestationBaseDict.copy()
+CostPrestationDict[Required('prestation')] = Prestation.Prestation
+CostPrestationSchema = Schema(CostPrestationDict)
@@ -1,12 +1,10 @@
 # -*- coding: utf-8 -*-
-from sqlalchemy import extract
 from sqlalchemy.orm import object_session
 
 from mozbase.util.cache import cached_property
 
-import mozfinance
-from AssPrestationSalesman import PrestationSalesman
-import Prestation
+from mozfinance.data.aggregation import MonthAggregator
+from mozfinance.util.commissions import commissions_bonuses
 
 
 class MonthSalesman(object):
@@ -25,18 +23,20 @@ class MonthSalesman(object):
         """Compute and return the sum of the prestations' commissions
         for this salesman during this month.
 
+        The commissions of every salesman of the month are computed (and
+        cached) at once.
+
         """
-        presta_sms = self.salesman.salesman_prestations_query\
-            .join(PrestationSalesman.prestation)\
-            .filter(extract('year', Prestation.Prestation.date) == self.month.date.year)\
-            .filter(extract('month', Prestation.Prestation.date) == self.month.date.month)\
-            .all()
+        aggregator = MonthAggregator(
+            object_session(self.month),
+            __name__.rpartition('.')[0])
+        month_commissions = aggregator.warm_commissions([self.month])[self.month.id]
 
-        commission_prestations = float(0)
-        for presta_sm in presta_sms:
-            commission_prestations += presta_sm.commission
+        salesman_commissions = month_commissions['salesmen'].get(self.salesman.id)
+        if salesman_commissions is None:
+            return float(0)
 
-        return commission_prestations
+        return salesman_commissions['commission_prestations']
 
     @cached_property(
         'month:{instance.month.id}:salesman:{instance.salesman.id}:commission_bonuses',
@@ -46,12 +46,7 @@ class MonthSalesman(object):
         for this salesman during this month.
 
         """
-        commission_bonuses = float(0)
-
-        for bonus in mozfinance.COMMISSIONS_BONUSES:
-            commission_bonuses += bonus(**self.month.commissions_variables)
-
-        return commission_bonuses
+        return commissions_bonuses(**self.month.commissions_variables)
 
     @cached_property(
         'month:{instance.month.id}:salesman:{instance.salesman.id}:commission_total',
@@ -1,11 +1,10 @@
 # -*- coding: utf-8 -*-
 import datetime
 
-from sqlalchemy.sql import extract
-
 from mozbase.util.cache import cached_property
 
 import Month
+from mozfinance.data.aggregation import MonthAggregator
 
 
 class Year(object):
@@ -22,33 +21,33 @@ class Year(object):
     def months(self):
         """Return all the months of this year. May go into future."""
         months = self._dbsession.query(Month.Month)\
-            .filter(extract('year', Month.Month.date) == self.id)\
+            .filter(Month.Month.date >= self.date)\
+            .filter(Month.Month.date < datetime.date(year=self.id + 1, month=1, day=1))\
             .all()
         return months
 
+    @property
+    def _figures(self):
+        """Compute every figure of this year and of its months in one
+        pass, warm the cache with them and return the year's ones.
+
+        """
+        aggregator = MonthAggregator(
+            self._dbsession,
+            __name__.rpartition('.')[0])
+        return aggregator.warm_years([self])[self.id]
+
     @cached_property('year:{instance.id}:revenue', cache='_cache')
     def revenue(self):
         """Compute and return the revenue of this year."""
-        revenue = float(0)
-        for month in self.months:
-            revenue += month.revenue
-
-        return revenue
+        return self._figures['revenue']
 
     @cached_property('year:{instance.id}:gross_margin', cache='_cache')
     def gross_margin(self):
         """Compute and return the gross margin of this year."""
-        gross_margin = float(0)
-        for month in self.months:
-            gross_margin += month.gross_margin
-
-        return gross_margin
+        return self._figures['gross_margin']
 
     @cached_property('year:{instance.id}:net_margin', cache='_cache')
     def net_margin(self):
         """Compute and return the net margin of this year."""
-        net_margin = float(0)
-        for month in self.months:
-            net_margin += month.net_margin
-
-        return net_margin
+        return self._figures['net_margin']
@@ -1,15 +1,17 @@
 # -*- coding: utf-8 -*-
 import datetime
 
-from sqlalchemy import Column, Integer, Date, and_, extract
-from sqlalchemy.orm import relationship, foreign, remote, backref, object_session
+from sqlalchemy import Column, Integer, Date
+from sqlalchemy.orm import relationship, object_session
 from voluptuous import Schema, All, Invalid
 
 from mozbase.util.cache import cached_property
 
 from . import Base
 import Prestation
+from mozfinance.data.aggregation import MonthAggregator
 from mozfinance.util.commissions import _COMMISSIONS_VARIABLES
+from mozfinance.util.dates import next_month_start
 
 
 class Month(Base):
@@ -20,35 +22,40 @@ class Month(Base):
 
     costs = relationship('CostMonth', lazy='dynamic')
 
-    _primaryjoin = and_(
-        remote(
-            extract('year', Prestation.Prestation.date)
-        ) == foreign(
-            extract('year', date)
-        ), remote(
-            extract('month', Prestation.Prestation.date)
-        ) == foreign(
-            extract('month', date)))
-    prestations = relationship(
-        'Prestation',
-        primaryjoin=_primaryjoin,
-        viewonly=True,
-        uselist=True,
-        lazy='dynamic',
-        backref=backref('month', uselist=False))
-
     _key_store_key_template = 'month:{instance.id}'
     _com_ksk_template = 'month:{instance.id}:commission_ks'
 
+    @property
+    def prestations(self):
+        """Return the query of the prestations of this month.
+
+        Prestations are selected with a range over their date (from the
+        first day of this month to the first day of the next one, which
+        is excluded), so that the index on prestations.date is used.
+
+        """
+        return object_session(self).query(Prestation.Prestation)\
+            .filter(Prestation.Prestation.date >= self.date)\
+            .filter(Prestation.Prestation.date < next_month_start(self.date))
+
+    @property
+    def _figures(self):
+        """Read every figure of this month from its summary if it is
+        fresh, otherwise compute them (and the prestations' ones) with a
+        few grouped queries and refresh the summary. Warm the cache with
+        them and return them.
+
+        """
+        aggregator = MonthAggregator(
+            object_session(self),
+            __name__.rpartition('.')[0])
+
+        return aggregator.read([self])[self.id]
+
     @cached_property('month:{instance.id}:revenue')
     def revenue(self):
         """Compute and return the month's revenue."""
-        revenue = float(0)
-        for presta in self.prestations.all():
-            if presta.selling_price is not None:
-                revenue += presta.selling_price
-
-        return revenue
+        return self._figures['revenue']
 
     @cached_property('month:{instance.id}:total_mcost')
     def total_month_cost(self):
@@ -56,11 +63,7 @@ class Month(Base):
         associated with this month.
 
         """
-        total_mcost = float(0)
-        for cost in self.costs.all():
-            total_mcost += cost.amount
-
-        return total_mcost
+        return self._figures['total_month_cost']
 
     @cached_property('month:{instance.id}:total_pcost')
     def total_prestation_cost(self):
@@ -68,11 +71,7 @@ class Month(Base):
         in this month.
 
         """
-        total_pcost = float(0)
-        for presta in self.prestations.all():
-            total_pcost += presta.total_cost
-
-        return total_pcost
+        return self._figures['total_prestation_cost']
 
     @cached_property('month:{instance.id}:gross_margin')
     def gross_margin(self):
@@ -87,16 +86,7 @@ class Month(Base):
     @cached_property('month:{instance.id}:commission_base')
     def commission_base(self):
         """Compute and return the month's commission base."""
-        import CostMonth
-
-        commission_base = self.gross_margin
-        costs_in_bc = self.costs\
-            .filter(CostMonth.CostMonth.no_commission_base == False)
-
-        for cost in costs_in_bc.all():
-            commission_base -= cost.amount
-
-        return commission_base
+        return self._figures['commission_base']
 
     @property
     def commissions_variables(self):
@@ -114,20 +104,19 @@ class Month(Base):
 
     @property
     def month_salesmen(self):
-        """Return a list of all the month-salesman association of this
-        month.
+        """Return a list of the month-salesman associations of the
+        salesmen associated with a prestation of this month, ordered by
+        salesman id.
 
         """
         from FakeAssMonthSalesman import MonthSalesman
-        from Salesman import Salesman
-
-        salesmen = object_session(self).query(Salesman).all()
 
-        month_salesmen = []
-        for salesman in salesmen:
-            month_salesmen.append(MonthSalesman(self, salesman))
+        aggregator = MonthAggregator(
+            object_session(self),
+            __name__.rpartition('.')[0])
 
-        return month_salesmen
+        return [MonthSalesman(self, salesman)
+                for salesman in aggregator.salesmen([self])[self.id]]
 
 
 def MonthDate(msg=None):
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from sqlalchemy import Column, ForeignKey, Integer, Float, Boolean, DateTime
+
+from . import Base
+
+
+class MonthSummary(Base):
+    """Materialized figures of a month (see Month's cached properties).
+
+    This class is optional: if a package does not provide it, figures
+    are only computed and cached. A summary is marked as stale each time
+    its month or one of the month's prestations is expired, and rebuilt
+    when the month's figures are next computed. Only fresh summaries are
+    read.
+
+    """
+    __tablename__ = 'month_summaries'
+    month_id = Column(Integer, ForeignKey('months.id'), primary_key=True)
+
+    revenue = Column(Float)
+    total_month_cost = Column(Float)
+    total_prestation_cost = Column(Float)
+    gross_margin = Column(Float)
+    net_margin = Column(Float)
+    commission_base = Column(Float)
+
+    fresh = Column(Boolean, default=True, index=True)
+    computed_at = Column(DateTime)
@@ -43,6 +43,10 @@ class Prestation(Base):
 
     salesmen = association_proxy('prestation_salesmen', 'salesman')
 
+    # Number of salesmen (PrestationSalesman associations), maintained
+    # by PrestationSalesmanData.add and remove.
+    salesmen_count = Column(Integer, default=0)
+
     category = Column(Integer, index=True, default=PRESTATION_CATEGORY_NONE)
     sector = Column(Integer, index=True, default=PRESTATION_SECTOR_NONE)
 
@@ -63,6 +67,36 @@ class Prestation(Base):
             day=1)
         return month_date
 
+    # (month_date, month) of the last looked up month, see month.
+    _month_memo = None
+
+    @property
+    def month(self):
+        """Return the month of the prestation (or None if it does not
+        exist), looked up by date. The month is memoized on the instance
+        until the prestation's month (or session) changes.
+
+        """
+        import Month
+
+        dbsession = object_session(self)
+        if dbsession is None or self.date is None:
+            return None
+
+        month_date = self.month_date
+        if self._month_memo is not None:
+            memo_date, month = self._month_memo
+            if memo_date == month_date and object_session(month) is dbsession:
+                return month
+
+        month = dbsession.query(Month.Month)\
+            .filter(Month.Month.date == month_date)\
+            .first()
+        if month is not None:
+            self._month_memo = (month_date, month)
+
+        return month
+
     @cached_property('prestation:{instance.id}:selling_price')
     def selling_price(self):
         """Compute and return the prestation's selling_price."""
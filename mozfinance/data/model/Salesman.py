@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
-from sqlalchemy import Column, Integer, Unicode, PickleType
+from sqlalchemy import Column, Integer, Unicode
 from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.orm import relationship, object_session
 from voluptuous import Schema, Required, All, Length
 
 from . import Base
+import SalesmanFormula
+from mozfinance.util.commissions import compile_formula
 
 
 class Salesman(Base):
@@ -13,15 +16,107 @@ class Salesman(Base):
     firstname = Column(Unicode(length=30))
     lastname = Column(Unicode(length=30))
 
-    # Dict with prestation.category first and prestation.sector then.
-    # Eg: com_form[presta.category][presta.sector]
-    commissions_formulae = Column(PickleType)
+    formulae = relationship(
+        SalesmanFormula.SalesmanFormula,
+        cascade='all, delete-orphan',
+        backref='salesman')
 
     prestations = association_proxy('salesman_prestations', 'prestation')
 
     update_dict = set(['firstname', 'lastname'])  # For update purpose
     create_dict = set(['firstname', 'lastname'])
 
+    @property
+    def commissions_formulae(self):
+        """Return the commission formulae of this salesman as a dict with
+        prestation.category first and prestation.sector then (eg:
+        com_form[presta.category][presta.sector]), or None if it has
+        none.
+
+        """
+        if not self.formulae:
+            return None
+
+        commissions_formulae = dict()
+        for salesman_formula in self.formulae:
+            commissions_formulae.setdefault(
+                salesman_formula.category, dict())[salesman_formula.sector] = \
+                salesman_formula.formula
+
+        return commissions_formulae
+
+    @commissions_formulae.setter
+    def commissions_formulae(self, commissions_formulae):
+        """Replace the commission formulae of this salesman (None removes
+        them all), updating its SalesmanFormula rows in place. Every
+        formula is validated first (see validate_commissions_formulae).
+
+        """
+        if commissions_formulae is None:
+            formulae = dict()
+        else:
+            formulae = validate_commissions_formulae(commissions_formulae)
+
+        existing = dict(((salesman_formula.category, salesman_formula.sector),
+                         salesman_formula)
+                        for salesman_formula in self.formulae)
+
+        for (category, sector), formula in sorted(formulae.items()):
+            if (category, sector) in existing:
+                existing.pop((category, sector)).formula = formula
+            else:
+                self.formulae.append(SalesmanFormula.SalesmanFormula(
+                    category=category,
+                    sector=sector,
+                    formula=formula))
+
+        for salesman_formula in existing.values():
+            self.formulae.remove(salesman_formula)
+
+    def formula(self, category, sector):
+        """Return the commission formula of this salesman for the
+        prestations of a category and a sector. Raise KeyError if it has
+        none. No query is issued if the formula is already in the
+        session.
+
+        """
+        salesman_formula = object_session(self)\
+            .query(SalesmanFormula.SalesmanFormula)\
+            .get((self.id, category, sector))
+
+        if salesman_formula is None:
+            raise KeyError((category, sector))
+
+        return salesman_formula.formula
+
+
+def validate_commissions_formulae(commissions_formulae):
+    """Validate and compile a dict of commission formulae, with
+    prestation.category first and prestation.sector then. Return them as
+    a dict by (category, sector). Raise AttributeError if the dict is
+    malformed and InvalidFormula if a formula is not valid.
+
+    """
+    if not isinstance(commissions_formulae, dict):
+        raise AttributeError('commissions_formulae isn\'t a dict')
+
+    formulae = dict()
+    for category, sectors in commissions_formulae.items():
+        if not isinstance(category, int) or not isinstance(sectors, dict):
+            raise AttributeError(
+                'commissions_formulae isn\'t a dict of dicts by category')
+
+        for sector, formula in sectors.items():
+            if not isinstance(sector, int) or not isinstance(formula, basestring):
+                raise AttributeError(
+                    'commissions_formulae isn\'t a dict of formulae by sector')
+
+            # Raise InvalidFormula if the formula is not valid.
+            compile_formula(formula)
+            formulae[(category, sector)] = formula
+
+    return formulae
+
 
 SalesmanSchema = Schema({
     Required('firstname'): All(unicode, Length(min=3, max=30)),
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from sqlalchemy import Column, ForeignKey, Integer, String
+
+from . import Base
+
+
+class SalesmanFormula(Base):
+    """Commission formula of a salesman for the prestations of a
+    category and a sector. Formulae are validated when they are set (see
+    Salesman.commissions_formulae).
+
+    """
+    __tablename__ = 'salesmen_formulae'
+    salesman_id = Column(
+        Integer,
+        ForeignKey('salesmen.id'),
+        primary_key=True)
+    category = Column(Integer, primary_key=True)
+    sector = Column(Integer, primary_key=True)
+
+    formula = Column(String, nullable=False)
@@ -9,7 +9,7 @@ attribute/method of each SQLA-Class is mandatory.
 from sqlalchemy.ext.declarative import declarative_base
 
 
-__all__ = ['User', 'Prestation', 'Month', 'Salesman', 'Cost', 'CostPrestation', 'CostMonth', 'AssPrestationSalesman', 'BillPrestation']
+__all__ = ['User', 'Prestation', 'Month', 'Salesman', 'Cost', 'CostPrestation', 'CostMonth', 'AssPrestationSalesman', 'BillPrestation', 'MonthSummary', 'SalesmanFormula']
 
 
 Base = declarative_base()
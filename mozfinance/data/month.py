@@ -6,7 +6,11 @@ from sqlalchemy.orm import joinedload
 
 from mozbase.util.database import db_method
 
+import mozfinance
 from mozfinance.data import DataRepository, cost
+from mozfinance.data.aggregation import MonthAggregator
+from mozfinance.data.dependencies import invalidate
+from mozfinance.util.dates import month_start, next_month_start
 
 
 class MonthData(DataRepository):
@@ -67,26 +71,124 @@ class MonthData(DataRepository):
 
         return self._get(month_id, month, date)
 
+    def compute(self, month_id=None, month=None, date=None):
+        """Compute every figure of a month with a few grouped queries,
+        warm the cache with them and return them. See
+        mozfinance.data.aggregation.MonthAggregator.compute.
+
+        Arguments:
+            month_id -- id of the required month (*)
+            month -- a month instance (*)
+            date -- any datetime.date inside the required month (*)
+
+        * at least one is required
+
+        """
+        month = self.get(month_id, month, date)
+        aggregator = MonthAggregator(self._dbsession, self._package)
+        return aggregator.warm([month])[month.id]
+
+    @db_method
+    def refresh_summaries(self, start=None, end=None):
+        """Compute and write the summaries (see
+        mozfinance.data.model.MonthSummary) of every month between start
+        and end, with one pass. Return the number of refreshed months.
+
+        Keyword arguments:
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+
+        """
+        Month = self._Month.Month
+        query = self._dbsession.query(Month)
+        if start is not None:
+            query = query.filter(Month.date >= month_start(start))
+        if end is not None:
+            query = query.filter(Month.date < next_month_start(end))
+        months = query.all()
+
+        MonthAggregator(self._dbsession, self._package)\
+            .refresh_summaries(months)
+
+        return len(months)
+
+    def _stale_summaries(self, months_dates):
+        """Mark the summaries of the months of the given dates as
+        stale.
+
+        """
+        MonthAggregator(self._dbsession, self._package)\
+            .stale_summaries(months_dates)
+
+    def _expire_commissions(self, month):
+        """Expire every commission of the given month: of its
+        PrestationSalesman and MonthSalesman associations. Return the
+        number of deleted keys, or None when called inside a running
+        expire batch (eg: by _expire, see DataRepository._expiring).
+
+        """
+        with self._expiring() as batch:
+            month_prestations = month.prestations.options(
+                joinedload('prestation_salesmen'))
+            for presta in month_prestations:
+                for presta_sm in presta.prestation_salesmen:
+                    self._expire_instance(presta_sm)
+
+                self._expire_instance(presta, '_com_ksk_template')
+
+            self._expire_instance(month, '_com_ksk_template')
+            self.salesman._expire(month=month)
+
+        return batch.dropped
+
+    def _apply_summary_delta(self, month, deltas):
+        """Add deltas (a dict of differences by figure's name) to the
+        summary of the given month, if it is fresh.
+
+        """
+        MonthAggregator(self._dbsession, self._package)\
+            .apply_summary_delta(month, deltas)
+
+    def _invalidate(self, source, month):
+        """Expire only the figures of the given month (and of its year and
+        commissions) affected by a change of source (see
+        mozfinance.data.dependencies) and mark the summary of the month
+        as stale. Return the number of deleted keys. If expires are
+        deferred (see BusinessObject.deferred_expire), only mark the
+        month as dirty.
+
+        """
+        if self._defer_expire(month=month):
+            return 0
+
+        self._stale_summaries([month.date])
+
+        return invalidate(self, source, month=month)
+
     def _expire(self, month_id=None, month=None, date=None):
         """Expire the given month, its year and every PrestationSalesman
-        association of this month.
+        association of this month. Every key is deleted at once, return
+        the number of deleted keys. The summary of the month is marked as
+        stale (it is refreshed when next read). If expires are deferred
+        (see BusinessObject.deferred_expire), only mark the month as
+        dirty.
 
         """
         month = self._get(month_id, month, date)
-        self._expire_instance(month)
 
-        month_prestations = month.prestations.options(
-            joinedload('prestation_salesmen'))
-        for presta in month_prestations:
-            for presta_sm in presta.prestation_salesmen:
-                self._expire_instance(presta_sm)
+        if self._defer_expire(month=month):
+            return 0
 
-            self._expire_instance(presta, '_com_ksk_template')
+        self._stale_summaries([month.date])
 
-        self._expire_instance(month, '_com_ksk_template')
-        self.salesman._expire(month=month)
+        with self._expiring() as batch:
+            self._expire_instance(month)
+            self._expire_commissions(month)
+            self._bo.year._expire(year_id=month.date.year)
 
-        self._bo.year._expire(year_id=month.date.year)
+        return batch.dropped
 
     @db_method
     def create(self, date=None):
@@ -115,9 +217,50 @@ class MonthData(DataRepository):
 
 class MonthSalesmanRepository(DataRepository):
 
+    def commissions(self, month_id=None, month=None, date=None):
+        """Compute the commissions of every salesman for the given month at
+        once, warm the cache with them and return them as a dict, by
+        salesman id, of dicts holding commission_prestations,
+        commission_bonuses and commission_total.
+
+        Arguments:
+            month_id -- id of the required month (*)
+            month -- a month instance (*)
+            date -- any datetime.date inside the required month (*)
+
+        * at least one is required
+
+        """
+        month = self._bo.month.get(month_id, month, date)
+        aggregator = MonthAggregator(self._dbsession, self._package)
+        return aggregator.warm_commissions([month])[month.id]['salesmen']
+
+    def _month_salesmen(self, month):
+        """Return the MonthSalesman associations of the given month whose
+        commissions may be cached: those of the month's salesmen (see
+        Month.month_salesmen) or, if there are monthly bonuses (see
+        mozfinance.COMMISSIONS_BONUSES), those of every salesman.
+
+        """
+        if not mozfinance.COMMISSIONS_BONUSES:
+            return month.month_salesmen
+
+        MonthSalesman = import_module(
+            '.FakeAssMonthSalesman', package=self._package).MonthSalesman
+        Salesman = import_module('.Salesman', package=self._package).Salesman
+
+        return [MonthSalesman(month, salesman) for salesman
+                in self._dbsession.query(Salesman).order_by(Salesman.id)]
+
     def _expire(self, month_id=None, month=None, date=None):
-        """Expire every MonthSalesman association of the given month."""
+        """Expire the MonthSalesman associations of the given month (see
+        _month_salesmen). Return the number of deleted keys.
+
+        """
         month = self._bo.month._get(month_id, month, date)
 
-        for month_sm in month.month_salesmen:
-            self._expire_instance(month_sm)
+        with self._expiring() as batch:
+            for month_sm in self._month_salesmen(month):
+                self._expire_instance(month_sm)
+
+        return batch.dropped
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 from importlib import import_module
 
+from sqlalchemy.orm import subqueryload
+
 from mozbase.util.database import db_method
 
 from mozfinance.data import DataRepository, cost
+from mozfinance.data.delta import apply_delta, _float
+from mozfinance.data.dependencies import COMMISSION_SOURCES, invalidate
+from mozfinance.util.commissions import compile_formula
+from mozfinance.util.dates import month_start, next_month_start
 
 
 class PrestationData(DataRepository):
@@ -11,6 +17,17 @@ class PrestationData(DataRepository):
 
     _patch_exports = ['cost', 'salesman', 'bill']
 
+    # Relationships eagerly loaded by each loading profile (see load),
+    # each with one query whatever the number of prestations.
+    LOADING_PROFILES = {
+        # salesmen
+        'list': ['prestation_salesmen'],
+        # selling_price, total_cost and margin
+        'financials': ['bills', 'costs'],
+        # figures, salesmen and prestation-salesman associations
+        'commissions': ['bills', 'costs', 'prestation_salesmen'],
+    }
+
     def __init__(self, bo=None):
         DataRepository.__init__(self, bo, managed_object_name='prestation')
         self.Prestation = import_module('.Prestation', package=self._package)
@@ -21,6 +38,96 @@ class PrestationData(DataRepository):
         self.salesman = PrestationSalesmanData(self._bo)
         self.bill = BillPrestationData(self._bo)
 
+    def query(self, profile='list'):
+        """Return a query of the prestations loading the relationships of
+        a loading profile (see LOADING_PROFILES).
+
+        """
+        if profile not in self.LOADING_PROFILES:
+            raise AttributeError('unknown loading profile: {}'.format(profile))
+
+        Prestation = self.Prestation.Prestation
+        options = list()
+        for name in self.LOADING_PROFILES[profile]:
+            if name == 'prestation_salesmen':
+                options.append(subqueryload(name).joinedload('salesman'))
+            else:
+                options.append(subqueryload(name))
+
+        return self._dbsession.query(Prestation).options(*options)
+
+    def load(self, profile='list', start=None, end=None, prestations_ids=None):
+        """Return the list of the prestations, ordered by date, with the
+        relationships of a loading profile loaded (see LOADING_PROFILES):
+        reading the properties of the profile on any number of
+        prestations costs one query per relationship, plus one.
+
+        Keyword arguments:
+            profile -- 'list' (default), 'financials' or 'commissions'
+            start -- any datetime.date of the first month, default: the
+                     first prestation
+            end -- any datetime.date of the last month, default: the
+                   last prestation
+            prestations_ids -- only load these prestations
+
+        """
+        Prestation = self.Prestation.Prestation
+        query = self.query(profile)
+        if start is not None:
+            query = query.filter(Prestation.date >= month_start(start))
+        if end is not None:
+            query = query.filter(Prestation.date < next_month_start(end))
+        if prestations_ids is not None:
+            if not prestations_ids:
+                return []
+            query = query.filter(Prestation.id.in_(prestations_ids))
+
+        return query.order_by(Prestation.date, Prestation.id).all()
+
+    def _expire(self, prestation_id=None, prestation=None):
+        """Expire the given prestation and mark the summary of its month
+        as stale. If expires are deferred (see
+        BusinessObject.deferred_expire), only mark it as dirty.
+
+        """
+        presta = self._get(prestation_id, prestation)
+
+        if self._defer_expire(prestation=presta):
+            return 0
+
+        if presta.date is not None:
+            self._bo.month._stale_summaries([presta.month_date])
+
+        return DataRepository._expire(self, prestation=presta)
+
+    def _invalidate(self, source, prestation, salesmen_ids=None):
+        """Expire only the figures of the given prestation (and of its
+        month, year and commissions) affected by a change of source (see
+        mozfinance.data.dependencies), and mark the summary of its month
+        as stale if its figures changed. Return the number of deleted
+        keys. If expires are deferred (see
+        BusinessObject.deferred_expire), only mark the prestation and its
+        associations (and those of the removed salesmen, which are no
+        longer salesmen of the month) as dirty.
+
+        """
+        instances = list(prestation.prestation_salesmen)
+        if source == 'prestation.salesmen' and prestation.month is not None:
+            MonthSalesman = import_module(
+                '.FakeAssMonthSalesman', package=self._package).MonthSalesman
+            instances.extend(
+                MonthSalesman(prestation.month, self._bo.salesman._get(salesman_id))
+                for salesman_id in salesmen_ids or [])
+
+        if self._defer_expire(prestation=prestation, instances=instances):
+            return 0
+
+        if source not in COMMISSION_SOURCES and prestation.date is not None:
+            self._bo.month._stale_summaries([prestation.month_date])
+
+        return invalidate(self, source, prestation=prestation,
+                          salesmen_ids=salesmen_ids)
+
 
 class BillPrestationData(DataRepository):
 
@@ -51,18 +158,29 @@ class BillPrestationData(DataRepository):
         bill = self.BillPrestation.BillPrestation(**kwargs)
         self._dbsession.add(bill)
 
-        self._bo.prestation._expire(prestation=presta)
+        if self._incremental():
+            apply_delta(self, prestation=presta, selling_price=bill.amount)
+        else:
+            self._bo.prestation._invalidate('prestation.bills', presta)
 
         return bill
 
     @db_method
     def update(self, bill_id=None, bill=None, **kwargs):
         bill = self._get(bill_id, bill)
+        amount = bill.amount
         update = self._update(
             instance=bill,
             schema=self.BillPrestation.BillPrestationUpdateSchema,
             **kwargs)
-        self._bo.prestation._expire(prestation=bill.prestation)
+
+        if self._incremental():
+            delta = _float(bill.amount) - _float(amount)
+            if delta:
+                apply_delta(self, prestation=bill.prestation, selling_price=delta)
+        else:
+            self._bo.prestation._invalidate('prestation.bills', bill.prestation)
+
         return update
 
     @db_method
@@ -78,7 +196,11 @@ class BillPrestationData(DataRepository):
         """
         bill = self._get(bill_id, bill)
 
-        self._bo.prestation._expire(prestation=bill.prestation)
+        if self._incremental():
+            apply_delta(self, prestation=bill.prestation,
+                        selling_price=-_float(bill.amount))
+        else:
+            self._bo.prestation._invalidate('prestation.bills', bill.prestation)
         self._dbsession.delete(bill)
 
 
@@ -114,6 +236,30 @@ class PrestationSalesmanData(DataRepository):
 
         return presta_sm
 
+    def _association(self, prestation, salesman):
+        """Return the PrestationSalesman association of a prestation and
+        a salesman, or None. No query is issued if the association is
+        already in the session.
+
+        """
+        if prestation.id is None:
+            return None
+
+        return self._dbsession.query(self.PrestationSalesman.PrestationSalesman)\
+            .get((prestation.id, salesman.id))
+
+    def _salesmen_count(self, prestation):
+        """Return the number of salesmen of a prestation. If its
+        salesmen_count is unset (NULL or 0, eg: associations created
+        through the ORM or before the column existed), the associations
+        are counted and the count is stored.
+
+        """
+        if not prestation.salesmen_count:
+            prestation.salesmen_count = prestation.prestation_salesmen_query.count()
+
+        return prestation.salesmen_count
+
     def get(self, prestation_id=None, prestation=None,
             salesman_id=None, salesman=None, **kwargs):
         """Return a PrestationSalesman association. Accept extra
@@ -128,18 +274,31 @@ class PrestationSalesmanData(DataRepository):
         prestation's month.
 
         Also expire the commission's key store of the prestation and the
-        one of the prestation's month.
+        one of the prestation's month. Every key is deleted at once,
+        return the number of deleted keys. If expires are deferred (see
+        BusinessObject.deferred_expire), only mark the prestation and its
+        associations as dirty.
 
         """
         presta = self._bo.prestation._get(prestation_id, prestation)
 
-        for presta_sm in presta.prestation_salesmen:
-            self._expire_instance(presta_sm)
+        if self._defer_expire(
+                prestation=presta,
+                instances=list(presta.prestation_salesmen)):
+            return 0
+
+        month = presta.month
 
-        self._expire_instance(presta, '_com_ksk_template')
-        self._expire_instance(presta.month, '_com_ksk_template')
+        with self._expiring() as batch:
+            for presta_sm in presta.prestation_salesmen:
+                self._expire_instance(presta_sm)
 
-        self._bo.month.salesman._expire(month=presta.month)
+            self._expire_instance(presta, '_com_ksk_template')
+            self._expire_instance(month, '_com_ksk_template')
+
+            self._bo.month.salesman._expire(month=month)
+
+        return batch.dropped
 
     @db_method
     def add(self, prestation_id=None, prestation=None, salesman_id=None,
@@ -160,17 +319,20 @@ class PrestationSalesmanData(DataRepository):
         presta = self._bo.prestation._get(prestation_id, prestation)
         salesman = self._bo.salesman._get(salesman_id, salesman)
 
-        if salesman in presta.salesmen:
+        if self._association(presta, salesman) is not None:
             return False
 
+        salesmen_count = self._salesmen_count(presta)
+
         presta_sm = self.PrestationSalesman.PrestationSalesman()
         presta_sm.prestation = presta
         presta_sm.salesman = salesman
-        presta_sm.formula = salesman.commissions_formulae[presta.category][presta.sector]
+        presta_sm.formula = salesman.formula(presta.category, presta.sector)
 
         self._dbsession.add(presta_sm)
+        presta.salesmen_count = salesmen_count + 1
 
-        self._expire(prestation=presta)
+        self._bo.prestation._invalidate('prestation.salesmen', presta)
 
         return True
 
@@ -193,17 +355,17 @@ class PrestationSalesmanData(DataRepository):
         presta = self._bo.prestation._get(prestation_id, prestation)
         salesman = self._bo.salesman._get(salesman_id, salesman)
 
-        if not salesman in presta.salesmen:
+        presta_sm = self._association(presta, salesman)
+        if presta_sm is None:
             return presta
 
-        # We have to get the correct PrestationSalesman object.
-        presta_sm = self._get(
-            prestation=presta,
-            salesman=salesman)
+        salesmen_count = self._salesmen_count(presta)
 
         self._dbsession.delete(presta_sm)
+        presta.salesmen_count = max(salesmen_count - 1, 0)
 
-        self._expire(prestation=presta)
+        self._bo.prestation._invalidate(
+            'prestation.salesmen', presta, salesmen_ids=[salesman.id])
 
         return presta
 
@@ -238,7 +400,9 @@ class PrestationSalesmanData(DataRepository):
 
         presta_sm.ratio = ratio
 
-        self._expire(prestation=presta)
+        self._bo.prestation._invalidate(
+            'prestation_salesman.ratio', presta,
+            salesmen_ids=[presta_sm.salesman_id])
 
         return True
 
@@ -249,6 +413,9 @@ class PrestationSalesmanData(DataRepository):
         Return False if there is no update or True otherwise.
 
         If no formula is given, we use the default salesman's formula.
+        Otherwise, it is validated and compiled (see
+        mozfinance.util.commissions.compile_formula): InvalidFormula is
+        raised if it is not valid.
 
         Keyword arguments:
             prestation_id -- id of the prestation (*)
@@ -267,16 +434,21 @@ class PrestationSalesmanData(DataRepository):
         if not isinstance(formula, str) and not formula is None:
             raise AttributeError('formula isn\'t a string and isn\'t None')
 
+        if formula is not None:
+            compile_formula(formula)
+
         presta_sm = self._get(prestation=presta, salesman=salesman)
 
         if presta_sm.formula == formula:
             return False
 
         if formula is None:
-            presta_sm.formula = salesman.commissions_formulae[presta.category][presta.sector]
+            presta_sm.formula = salesman.formula(presta.category, presta.sector)
         else:
             presta_sm.formula = formula
 
-        self._expire(prestation=presta)
+        self._bo.prestation._invalidate(
+            'prestation_salesman.formula', presta,
+            salesmen_ids=[salesman.id])
 
         return presta
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Non-blocking reads of a BusinessObject.
+
+Reads are run by a bounded pool of threads, each with its own session
+(bound to the engine of the BusinessObject's session, sharing its cache)
+and its own BusinessObject. Each read returns at once an AsyncResult
+whose get method waits for its value; several reads can be waited for
+at once with ReadPool.gather.
+
+Values are plain dicts (and lists) of figures and ids, never instances:
+instances belong to the session of the thread which loaded them.
+
+"""
+from multiprocessing.pool import ThreadPool
+import threading
+
+from sqlalchemy.orm import sessionmaker
+
+from mozfinance.data.aggregation import MONTH_KEYS, YEAR_KEYS
+
+
+class _MonthReads(object):
+    """Reads of months (see MonthData)."""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    @staticmethod
+    def _figures(bo, month_id=None, date=None):
+        month = bo.month.get(month_id=month_id, date=date)
+        figures = dict((name, getattr(month, name)) for name in MONTH_KEYS)
+        figures['month_id'] = month.id
+        figures['date'] = month.date
+        figures['commissions'] = bo.month.salesman.commissions(month=month)
+        return figures
+
+    def figures(self, month_id=None, date=None):
+        """Read the figures of a month: a dict of its cached properties,
+        'month_id', 'date' and 'commissions' (see
+        MonthSalesmanRepository.commissions).
+
+        Arguments:
+            month_id -- id of the required month (*)
+            date -- any datetime.date inside the required month (*)
+
+        * at least one is required
+
+        """
+        return self._pool.submit(self._figures, month_id=month_id, date=date)
+
+    def figures_many(self, dates):
+        """Read the figures (see figures) of the months of several dates,
+        in parallel. Return a list of AsyncResult, in the order of the
+        dates.
+
+        """
+        return [self.figures(date=date) for date in dates]
+
+
+class _YearReads(object):
+    """Reads of years (see YearData)."""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    @staticmethod
+    def _figures(bo, date):
+        year = bo.year.get(date=date)
+        figures = dict((name, getattr(year, name)) for name in YEAR_KEYS)
+        figures['year'] = year.id
+        return figures
+
+    def figures(self, date=None):
+        """Read the figures of a year: a dict of its cached properties and
+        'year'.
+
+        Arguments:
+            date -- any datetime.date of the year (required)
+
+        """
+        return self._pool.submit(self._figures, date=date)
+
+
+class _SalesmanReads(object):
+    """Reads of salesmen (see SalesmanData)."""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    @staticmethod
+    def _commission_statement(bo, salesman_id, start, end):
+        statement = bo.salesman.commission_statement(
+            salesman_id=salesman_id, start=start, end=end)
+        statement['salesman'] = statement['salesman'].id
+        for month_statement in statement['months']:
+            month_statement['month'] = month_statement['month'].id
+        return statement
+
+    def commission_statement(self, salesman_id=None, start=None, end=None):
+        """Read the commission statement of a salesman (see
+        SalesmanData.commission_statement), with the ids of the salesman
+        and of the months instead of instances.
+
+        """
+        return self._pool.submit(
+            self._commission_statement,
+            salesman_id=salesman_id, start=start, end=end)
+
+
+class ReadPool(object):
+    """Pool of threads running the reads of a BusinessObject. See
+    BusinessObject.read_pool.
+
+    """
+
+    def __init__(self, bo, workers=4):
+        """Init a ReadPool.
+
+        Arguments:
+            bo -- BusinessObject to read
+            workers -- number of threads (and of sessions)
+
+        """
+        self._bo = bo
+        self._pool = ThreadPool(workers)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = list()
+
+        self.month = _MonthReads(self)
+        self.year = _YearReads(self)
+        self.salesman = _SalesmanReads(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _thread_bo(self):
+        """Return the BusinessObject of the current thread, with its own
+        session sharing the cache of the BusinessObject's session.
+
+        """
+        bo = getattr(self._local, 'bo', None)
+        if bo is None:
+            dbsession = sessionmaker(bind=self._bo._dbsession.get_bind())()
+            dbsession.cache = self._bo._dbsession.cache
+            with self._lock:
+                self._sessions.append(dbsession)
+
+            bo = self._bo.__class__(
+                dbsession=dbsession,
+                package=self._bo._package,
+                incremental=self._bo.incremental)
+            self._local.bo = bo
+
+        return bo
+
+    def _run(self, func, args, kwargs):
+        bo = self._thread_bo()
+        try:
+            return func(bo, *args, **kwargs)
+        finally:
+            # Reads only: release the connection and forget the
+            # instances, so that the next read sees fresh data.
+            bo._dbsession.rollback()
+
+    def submit(self, func, *args, **kwargs):
+        """Run func(bo, *args, **kwargs) in a thread of the pool, bo being
+        the BusinessObject of this thread. Return an AsyncResult.
+
+        """
+        return self._pool.apply_async(self._run, (func, args, kwargs))
+
+    @staticmethod
+    def gather(results, timeout=None):
+        """Wait for several AsyncResult and return their values, in the
+        same order. Raise the exception of the first failed read.
+
+        """
+        return [result.get(timeout) for result in results]
+
+    def close(self):
+        """Wait for the running reads, stop the threads and close their
+        sessions.
+
+        """
+        self._pool.close()
+        self._pool.join()
+        with self._lock:
+            for dbsession in self._sessions:
+                dbsession.close()
+            self._sessions = list()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+from importlib import import_module
+import multiprocessing
+
+from dogpile.cache import make_region
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from mozfinance.data.aggregation import MonthAggregator
+from mozfinance.util.dates import month_start, next_month_start
+
+
+# Session of the worker process (see _init_worker).
+_worker = dict()
+
+
+def make_cache_region(cache):
+    """Return a dogpile.cache region configured by a dict holding the
+    arguments of CacheRegion.configure (eg: {'backend':
+    'dogpile.cache.redis', 'arguments': {...}}).
+
+    """
+    cache = dict(cache)
+    return make_region().configure(cache.pop('backend'), **cache)
+
+
+def _init_worker(url, cache, package):
+    """Create the engine, the session and the cache region of a worker
+    process.
+
+    """
+    engine = create_engine(url)
+    dbsession = sessionmaker(bind=engine)()
+    dbsession.cache = make_cache_region(cache)
+
+    _worker['dbsession'] = dbsession
+    _worker['package'] = package
+
+
+def _recompute_months(dbsession, package, months):
+    """Recompute and store in cache the figures and the commissions of
+    the given months. Return their month-level figures (without the
+    prestations' ones), by month id.
+
+    """
+    aggregator = MonthAggregator(dbsession, package)
+    figures = aggregator.warm(months)
+    aggregator.warm_commissions(months, figures=figures)
+
+    return dict((month_id, dict((name, value) for name, value
+                                in month_figures.items()
+                                if name != 'prestations'))
+                for month_id, month_figures in figures.items())
+
+
+def _recompute_chunk(months_ids):
+    """Recompute a chunk of months in the session of the worker process
+    (see _recompute_months).
+
+    """
+    dbsession = _worker['dbsession']
+    package = _worker['package']
+    Month = import_module('.Month', package=package).Month
+
+    try:
+        months = dbsession.query(Month)\
+            .filter(Month.id.in_(months_ids))\
+            .order_by(Month.date)\
+            .all()
+        return _recompute_months(dbsession, package, months)
+    finally:
+        dbsession.close()
+
+
+class Recomputer(object):
+    """Recompute (and overwrite in cache) every figure and commission of
+    a range of months, eg: after a formula change.
+
+    Months are split in chunks recomputed in parallel by a pool of
+    processes, each with its own engine, session and cache region. The
+    region must be configured with a backend shared by the processes
+    (eg: redis, memcached, dbm), and the database must be reachable from
+    each process (not an in-memory SQLite database).
+
+    """
+
+    # Number of months recomputed at once by a worker.
+    chunk_size = 6
+
+    def __init__(self, bo, url, cache, processes=None, chunk_size=None):
+        """Init a Recomputer.
+
+        Arguments:
+            bo -- BusinessObject whose months are recomputed
+            url -- URL of the database, for the workers' engines
+            cache -- configuration of the workers' cache region (see
+                     make_cache_region)
+            processes -- number of worker processes, default: the
+                         number of CPUs
+            chunk_size -- default: Recomputer.chunk_size
+
+        """
+        self._bo = bo
+        self._dbsession = bo._dbsession
+        self._package = bo._package
+        self._Month = import_module('.Month', package=self._package).Month
+        self._Year = import_module('.FakeYear', package=self._package).Year
+        self.url = url
+        self.cache = cache
+        self.processes = processes or multiprocessing.cpu_count()
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+    def _months(self, start=None, end=None):
+        """Return the months of a date range, ordered by date."""
+        Month = self._Month
+        query = self._dbsession.query(Month)
+        if start is not None:
+            query = query.filter(Month.date >= month_start(start))
+        if end is not None:
+            query = query.filter(Month.date < next_month_start(end))
+        return query.order_by(Month.date).all()
+
+    def run(self, start=None, end=None, progress=None):
+        """Recompute every month between start and end, then their
+        years. Return a dict of the number of recomputed 'months' and
+        'years'.
+
+        Keyword arguments:
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+            progress -- function called with (number of recomputed
+                        months, total number of months) each time a
+                        chunk is done
+
+        """
+        months = self._months(start, end)
+        if not months:
+            return {'months': 0, 'years': 0}
+
+        chunks = [[month.id for month in months[i:i + self.chunk_size]]
+                  for i in range(0, len(months), self.chunk_size)]
+
+        months_figures = dict()
+        pool = multiprocessing.Pool(
+            min(self.processes, len(chunks)),
+            initializer=_init_worker,
+            initargs=(self.url, self.cache, self._package))
+        try:
+            for figures in pool.imap_unordered(_recompute_chunk, chunks):
+                months_figures.update(figures)
+                if progress is not None:
+                    progress(len(months_figures), len(months))
+        except:
+            # Stop the workers still recomputing other chunks.
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        # The years are recomputed in this process, whose cache region
+        # must share the workers' backend.
+        years = [self._Year(year_id, self._dbsession) for year_id
+                 in sorted(set(month.date.year for month in months))]
+        MonthAggregator(self._dbsession, self._package)\
+            .warm_years(years, months_figures=months_figures)
+
+        return {'months': len(months), 'years': len(years)}
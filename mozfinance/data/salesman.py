@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 from importlib import import_module
 
+from sqlalchemy import (
+    Column, Integer, MetaData, PickleType, Table, inspect, select)
+
 from mozbase.util.database import db_method
 
 from mozfinance.data import DataRepository
+from mozfinance.data.aggregation import MonthAggregator
+from mozfinance.util.commissions import InvalidFormula
+from mozfinance.util.dates import month_start, next_month_start
 
 
 class SalesmanData(DataRepository):
@@ -71,10 +77,16 @@ class SalesmanData(DataRepository):
         """Set the commission formulae of a salesman. Return False if there is
         no update or the updated salesman.
 
+        Every formula is validated and compiled (see
+        mozfinance.util.commissions.compile_formula) before anything is
+        stored: InvalidFormula is raised if one is not valid.
+
         Keyword arguments:
             salesman_id -- id of the salesman to update (*)
             salesman -- salesman to update (*)
-            commissions_formulae -- dict to set
+            commissions_formulae -- dict to set, with prestation.category
+                                    first and prestation.sector then (eg:
+                                    {0: {0: '{p_m}*0.1'}})
 
         * at least one is required
 
@@ -84,6 +96,8 @@ class SalesmanData(DataRepository):
 
         salesman = self._get(salesman_id, salesman)
 
+        self.Salesman.validate_commissions_formulae(commissions_formulae)
+
         if commissions_formulae == salesman.commissions_formulae:
             return False
 
@@ -91,6 +105,113 @@ class SalesmanData(DataRepository):
 
         return salesman
 
+    @db_method
+    def migrate_commissions_formulae(self):
+        """Copy the commission formulae of the salesmen from the pickled
+        salesmen.commissions_formulae column of older versions to the
+        salesmen_formulae table, which must already exist. Salesmen
+        which already have formulae are skipped, so that it can be run
+        again. Return the number of migrated salesmen. The old column is
+        left as is, it can be dropped once the migration is checked.
+
+        Raise InvalidFormula, naming the salesman, if one of the stored
+        formulae is not valid.
+
+        """
+        columns = [column['name'] for column
+                   in inspect(self._dbsession.connection()).get_columns('salesmen')]
+        if 'commissions_formulae' not in columns:
+            return 0
+
+        legacy_salesmen = Table(
+            'salesmen', MetaData(),
+            Column('id', Integer),
+            Column('commissions_formulae', PickleType))
+        rows = self._dbsession.execute(
+            select([legacy_salesmen.c.id, legacy_salesmen.c.commissions_formulae])
+            .where(legacy_salesmen.c.commissions_formulae != None)
+            .order_by(legacy_salesmen.c.id)).fetchall()
+
+        migrated = 0
+        for salesman_id, commissions_formulae in rows:
+            salesman = self._get(salesman_id)
+            if salesman.formulae:
+                continue
+
+            try:
+                salesman.commissions_formulae = commissions_formulae
+            except InvalidFormula as e:
+                raise InvalidFormula('salesman {}: {}'.format(salesman_id, e))
+            migrated += 1
+
+        return migrated
+
+    def commission_statement(self, salesman_id=None, salesman=None,
+                             start=None, end=None):
+        """Compute and return the commission statement of a salesman
+        between start and end: a dict holding 'salesman', 'months' (see
+        MonthAggregator.statements) and the 'commission_prestations',
+        'commission_bonuses' and 'commission_total' of the whole range.
+
+        The salesman's associations are loaded with one query and the
+        months' figures with a few grouped ones, whatever the length of
+        the range.
+
+        Keyword arguments:
+            salesman_id -- id of the salesman (*)
+            salesman -- salesman (*)
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+
+        * at least one is required
+
+        """
+        salesman = self._get(salesman_id, salesman)
+        return self.commission_statements([salesman], start, end)[salesman.id]
+
+    def commission_statements(self, salesmen=None, start=None, end=None):
+        """Compute and return, by salesman id, the commission statements
+        (see commission_statement) of several salesmen at once, sharing
+        the months' figures.
+
+        Keyword arguments:
+            salesmen -- list of salesmen, default: every salesman
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+
+        """
+        if salesmen is None:
+            Salesman = self.Salesman.Salesman
+            salesmen = self._dbsession.query(Salesman).order_by(Salesman.id).all()
+
+        Month = import_module('.Month', package=self._package).Month
+        query = self._dbsession.query(Month)
+        if start is not None:
+            query = query.filter(Month.date >= month_start(start))
+        if end is not None:
+            query = query.filter(Month.date < next_month_start(end))
+        months = query.order_by(Month.date).all()
+
+        aggregator = MonthAggregator(self._dbsession, self._package)
+        statements = aggregator.statements(
+            months, [salesman.id for salesman in salesmen])
+
+        result = dict()
+        for salesman in salesmen:
+            salesman_months = statements[salesman.id]
+            statement = {'salesman': salesman, 'months': salesman_months}
+            for name in ['commission_prestations', 'commission_bonuses',
+                         'commission_total']:
+                statement[name] = sum(
+                    [month[name] for month in salesman_months], float(0))
+            result[salesman.id] = statement
+
+        return result
+
     @db_method
     def remove(self, salesman_id=None, salesman=None):
         """Remove a salesman.
@@ -105,6 +226,11 @@ class SalesmanData(DataRepository):
         salesman = self._get(salesman_id, salesman)
 
         for prestation in salesman.prestations:
-            self._bo.prestation._expire(prestation=prestation)
+            salesmen_count = self._bo.prestation.salesman._salesmen_count(prestation)
+            prestation.salesmen_count = max(salesmen_count - 1, 0)
+
+            # The default ratio of the remaining salesmen changes.
+            self._bo.prestation._invalidate(
+                'prestation.salesmen', prestation, salesmen_ids=[salesman.id])
 
         self._dbsession.delete(salesman)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Columnar in-memory snapshot of the ledger, for ad-hoc analytics
+(eg: revenue by sector, commissions by salesman and quarter) without the
+ORM.
+
+The prestations are held as parallel typed arrays (one per column), and
+so are the prestation-salesman associations (with the index of their
+prestation). Group-by keys are small integers computed from the
+columns: the month is stored as year * 12 + month - 1.
+
+"""
+from array import array
+from importlib import import_module
+from itertools import compress
+import datetime
+
+from mozfinance.data.aggregation import MonthAggregator
+from mozfinance.util.dates import month_start, next_month_start
+
+
+# Columns which can be summed: of the prestations, and of the
+# prestation-salesman associations.
+PRESTATION_COLUMNS = ['selling_price', 'total_cost', 'margin', 'count']
+ASSOCIATION_COLUMNS = ['commission']
+
+# Keys which prestations and associations can be grouped by.
+KEYS = ['category', 'sector', 'month', 'quarter', 'year', 'salesman']
+
+
+def _month_code(a_date):
+    return a_date.year * 12 + a_date.month - 1
+
+
+# Label of a key from its code, and code of a key from its label.
+_LABELS = {
+    'month': lambda code: datetime.date(year=code // 12, month=code % 12 + 1, day=1),
+    'quarter': lambda code: (code // 4, code % 4 + 1),
+}
+_CODES = {
+    'month': _month_code,
+    'quarter': lambda label: label[0] * 4 + label[1] - 1,
+}
+
+
+class LedgerSnapshot(object):
+    """Snapshot of the prestations (with their figures) and of the
+    prestation-salesman associations (with their commissions) of a range
+    of months. See BusinessObject.snapshot.
+
+    """
+
+    def __init__(self):
+        # Prestations' columns.
+        self.prestation_id = array('l')
+        self.month = array('l')
+        self.category = array('l')
+        self.sector = array('l')
+        self.selling_price = array('d')
+        self.total_cost = array('d')
+        self.margin = array('d')
+
+        # Associations' columns.
+        self.association_prestation = array('l')  # index of the prestation
+        self.association_salesman = array('l')
+        self.commission = array('d')
+
+    def __len__(self):
+        return len(self.prestation_id)
+
+    @classmethod
+    def build(cls, bo, start=None, end=None, chunk_size=12):
+        """Return the snapshot of the months between start and end,
+        whose figures and commissions are computed chunk_size months at
+        once with the bulk queries of MonthAggregator (without touching
+        the cache).
+
+        Keyword arguments:
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+
+        """
+        dbsession = bo._dbsession
+        Month = import_module('.Month', package=bo._package).Month
+        Prestation = import_module('.Prestation', package=bo._package).Prestation
+
+        query = dbsession.query(Month)
+        if start is not None:
+            query = query.filter(Month.date >= month_start(start))
+        if end is not None:
+            query = query.filter(Month.date < next_month_start(end))
+        months = query.order_by(Month.date).all()
+
+        aggregator = MonthAggregator(dbsession, bo._package)
+        snapshot = cls()
+
+        for i in range(0, len(months), chunk_size):
+            chunk = months[i:i + chunk_size]
+            figures = aggregator.compute(chunk)
+            commissions = aggregator.commissions(chunk, figures=figures)
+
+            prestations = dbsession\
+                .query(
+                    Prestation.id,
+                    Prestation.date,
+                    Prestation.category,
+                    Prestation.sector)\
+                .filter(aggregator._prestations_filter(chunk))\
+                .order_by(Prestation.date, Prestation.id)
+
+            prestations_figures = dict()
+            for month in chunk:
+                prestations_figures.update(figures[month.id]['prestations'])
+
+            indexes = dict()
+            for presta_id, presta_date, category, sector in prestations:
+                presta_figures = prestations_figures[presta_id]
+                indexes[presta_id] = len(snapshot.prestation_id)
+                snapshot.prestation_id.append(presta_id)
+                snapshot.month.append(_month_code(presta_date))
+                snapshot.category.append(category or 0)
+                snapshot.sector.append(sector or 0)
+                snapshot.selling_price.append(presta_figures['selling_price'])
+                snapshot.total_cost.append(presta_figures['total_cost'])
+                snapshot.margin.append(presta_figures['margin'])
+
+            for month in chunk:
+                month_commissions = commissions[month.id]['prestation_salesmen']
+                for (presta_id, salesman_id), commission in sorted(month_commissions.items()):
+                    snapshot.association_prestation.append(indexes[presta_id])
+                    snapshot.association_salesman.append(salesman_id)
+                    snapshot.commission.append(commission)
+
+        return snapshot
+
+    def _key_codes(self, key, index=None):
+        """Return the codes of a key for every prestation or, if index
+        (the prestations' indexes of the associations) is given, for
+        every association.
+
+        """
+        if key == 'salesman':
+            return self.association_salesman
+
+        if key in ('category', 'sector', 'month'):
+            codes = getattr(self, key)
+        elif key == 'quarter':
+            codes = [code // 3 for code in self.month]
+        elif key == 'year':
+            codes = [code // 12 for code in self.month]
+        else:
+            raise AttributeError('unknown key: {}'.format(key))
+
+        if index is None:
+            return codes
+        return [codes[i] for i in index]
+
+    def _column_values(self, column, index=None):
+        """Return the values of a column for every prestation or, if
+        index is given, for every association (see _key_codes).
+
+        """
+        if column in ASSOCIATION_COLUMNS:
+            return getattr(self, column)
+
+        if column == 'count':
+            values = [1] * len(self)
+        elif column in PRESTATION_COLUMNS:
+            values = getattr(self, column)
+        else:
+            raise AttributeError('unknown column: {}'.format(column))
+
+        if index is None:
+            return values
+        return [values[i] for i in index]
+
+    def sum(self, column, by, where=None):
+        """Return the sums of a column grouped by keys, as a dict by key
+        (or by tuple of keys if several are given).
+
+        Prestations' columns grouped by salesman are summed over the
+        associations: a prestation counts once for each of its salesmen.
+
+        Arguments:
+            column -- 'selling_price', 'total_cost', 'margin', 'count' or
+                      'commission'
+            by -- a key or a tuple of keys: 'category', 'sector', 'month'
+                  (a datetime.date of the first day of the month),
+                  'quarter' (a (year, quarter) tuple), 'year' or
+                  'salesman' (an id)
+            where -- a dict of the required value (or list of values) of
+                     keys, by key
+
+        Eg: snapshot.sum('margin', by=('sector', 'quarter'),
+                         where={'year': 2012})
+
+        """
+        keys = (by,) if isinstance(by, basestring) else tuple(by)
+        where = where or dict()
+
+        index = None
+        if column in ASSOCIATION_COLUMNS or 'salesman' in keys or 'salesman' in where:
+            index = self.association_prestation
+
+        values = self._column_values(column, index)
+        codes = [self._key_codes(key, index) for key in keys]
+
+        mask = None
+        for key, labels in where.items():
+            if not isinstance(labels, (list, set)):
+                labels = [labels]
+            allowed = set(_CODES.get(key, lambda label: label)(label)
+                          for label in labels)
+            key_codes = self._key_codes(key, index)
+            key_mask = [code in allowed for code in key_codes]
+            mask = key_mask if mask is None else [
+                a and b for a, b in zip(mask, key_mask)]
+
+        groups = codes[0] if len(codes) == 1 else zip(*codes)
+        if mask is not None:
+            values = compress(values, mask)
+            groups = compress(groups, mask)
+
+        sums = dict()
+        get = sums.get
+        for value, group in zip(values, groups):
+            sums[group] = get(group, 0) + value
+
+        labels = [_LABELS.get(key, lambda code: code) for key in keys]
+        labeled = dict()
+        for group, total in sums.items():
+            if len(keys) == 1:
+                labeled[labels[0](group)] = total
+            else:
+                labeled[tuple(label(code) for label, code
+                              in zip(labels, group))] = total
+
+        return labeled
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from importlib import import_module
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy.orm import sessionmaker
+
+from mozfinance.data.aggregation import MonthAggregator
+from mozfinance.util.dates import month_start, next_month_start
+
+
+class CacheWarmer(object):
+    """Precompute and cache every cached property of the months of a
+    date range, in dependency order: prestations and months, then
+    month-salesmen (and prestation-salesmen), then years.
+
+    Months are warmed by chunks with the bulk queries of
+    MonthAggregator. Chunks may be warmed in parallel, by threads each
+    using its own session (bound to the engine and sharing the cache of
+    the BusinessObject's session).
+
+    """
+
+    # Number of months warmed at once.
+    chunk_size = 12
+
+    def __init__(self, bo, workers=1, chunk_size=None):
+        """Init a CacheWarmer.
+
+        Arguments:
+            bo -- BusinessObject whose cache is warmed
+            workers -- number of threads warming chunks of months
+            chunk_size -- default: CacheWarmer.chunk_size
+
+        """
+        self._bo = bo
+        self._dbsession = bo._dbsession
+        self._package = bo._package
+        self._Month = import_module('.Month', package=self._package).Month
+        self._Year = import_module('.FakeYear', package=self._package).Year
+        self.workers = workers
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+    def _months(self, dbsession, start=None, end=None, months_ids=None):
+        """Return the months of a date range or of a list of ids,
+        ordered by date.
+
+        """
+        Month = self._Month
+        query = dbsession.query(Month)
+        if months_ids is not None:
+            query = query.filter(Month.id.in_(months_ids))
+        if start is not None:
+            query = query.filter(Month.date >= month_start(start))
+        if end is not None:
+            query = query.filter(Month.date < next_month_start(end))
+        return query.order_by(Month.date).all()
+
+    def _session(self):
+        """Return a new session bound to the engine of the
+        BusinessObject's session, sharing its cache.
+
+        """
+        dbsession = sessionmaker(bind=self._dbsession.get_bind())()
+        dbsession.cache = self._dbsession.cache
+        return dbsession
+
+    def _warm_months(self, dbsession, months):
+        """Warm the figures and the commissions of the given months.
+        Return their figures, by month id.
+
+        """
+        aggregator = MonthAggregator(dbsession, self._package)
+        figures = aggregator.warm(months)
+        aggregator.warm_commissions(months, figures=figures)
+        return figures
+
+    def _warm_chunk(self, months_ids):
+        """Warm a chunk of months in a session of its own (see
+        _warm_months).
+
+        """
+        dbsession = self._session()
+        try:
+            return self._warm_months(
+                dbsession,
+                self._months(dbsession, months_ids=months_ids))
+        finally:
+            dbsession.close()
+
+    def warm(self, start=None, end=None):
+        """Warm the cache of every month between start and end (and of
+        the years of these months). Return a dict of the number of
+        warmed 'months' and 'years'.
+
+        Keyword arguments:
+            start -- any datetime.date of the first month, default: the
+                     first month
+            end -- any datetime.date of the last month, default: the
+                   last month
+
+        """
+        months = self._months(self._dbsession, start, end)
+        if not months:
+            return {'months': 0, 'years': 0}
+
+        chunks = [months[i:i + self.chunk_size]
+                  for i in range(0, len(months), self.chunk_size)]
+
+        months_figures = dict()
+        if self.workers > 1 and len(chunks) > 1:
+            pool = ThreadPool(min(self.workers, len(chunks)))
+            try:
+                results = pool.map(
+                    self._warm_chunk,
+                    [[month.id for month in chunk] for chunk in chunks])
+            except:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+            for figures in results:
+                months_figures.update(figures)
+        else:
+            for chunk in chunks:
+                months_figures.update(self._warm_months(self._dbsession, chunk))
+
+        years = [self._Year(year_id, self._dbsession) for year_id
+                 in sorted(set(month.date.year for month in months))]
+        MonthAggregator(self._dbsession, self._package)\
+            .warm_years(years, months_figures=months_figures)
+
+        return {'months': len(months), 'years': len(years)}
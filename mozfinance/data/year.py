@@ -3,6 +3,7 @@ import datetime
 from importlib import import_module
 
 from mozfinance.data import DataRepository
+from mozfinance.data.aggregation import MonthAggregator, MonthRow
 
 
 class YearData(DataRepository):
@@ -49,7 +50,40 @@ class YearData(DataRepository):
 
         return self._get(year_id=date.year)
 
+    def compute(self, year_ids=None):
+        """Compute every figure of every month of the given years in one
+        pass, warm the cache of these months and years with them, and
+        return a table of the months' figures: a list of MonthRow
+        ordered by date.
+
+        Keyword arguments:
+            year_ids -- list of the years' numbers (required)
+
+        """
+        if year_ids is None:
+            raise TypeError('year_ids not provided')
+
+        years = [self._get(year_id=year_id) for year_id in year_ids]
+
+        aggregator = MonthAggregator(self._dbsession, self._package)
+        years_figures = aggregator.warm_years(years)
+
+        table = list()
+        for year in sorted(years, key=lambda year: year.id):
+            for month, figures in years_figures[year.id]['months']:
+                table.append(MonthRow(
+                    date=month.date,
+                    month_id=month.id,
+                    **{name: figures[name] for name in MonthRow._fields
+                       if name in figures}))
+
+        return table
+
     def _expire(self, year_id=None, year=None, date=None):
-        """Expire the given year."""
+        """Expire the given year. Return the number of deleted keys."""
         year = self._get(year_id, year, date)
-        self._expire_instance(year)
+
+        with self._expiring() as batch:
+            self._expire_instance(year)
+
+        return batch.dropped
@@ -3,6 +3,13 @@
 computation.
 
 """
+from collections import OrderedDict
+import ast
+import numbers
+import string
+import threading
+
+import mozfinance
 
 
 _COMMISSIONS_VARIABLES = {
@@ -21,33 +28,239 @@ _COMMISSIONS_VARIABLES = {
 }
 
 
-def formula_checker(formula):
-    """Return True if a formula is valid, and False otherwise."""
-    keys = list()
+# Maximum number of compiled formulae kept in memory.
+COMPILED_FORMULAE_CACHE_SIZE = 512
 
-    for key in _COMMISSIONS_VARIABLES['prestation']:
-        keys.append(key)
+# Functions which may be called from a formula.
+_FORMULA_FUNCTIONS = {
+    'abs': abs,
+    'max': max,
+    'min': min,
+    'round': round,
+}
 
-    for key in _COMMISSIONS_VARIABLES['month']:
-        keys.append(key)
+_FORMULA_LITERALS = tuple(getattr(ast, name) for name in ('Num', 'Constant')
+                          if hasattr(ast, name))
 
-    kwargs = {}
-    for key in keys:
-        kwargs[key] = float(1)
+# Largest absolute value of the exponent of a power (which must be a
+# number literal) in a formula.
+_FORMULA_MAX_EXPONENT = 100
 
-    try:
-        formula = str(formula).format(**kwargs)
-    except KeyError:
-        return False
+# Largest absolute value of a number literal in the base of a power
+# (which must not hold another power), so that a formula cannot build
+# huge numbers, neither when compiled (constant folding) nor when
+# evaluated.
+_FORMULA_MAX_BASE = 1000
 
-    try:
-        raw_result = eval(formula)
-    except (SyntaxError, NameError):
-        return False
+_FORMULA_NODES = (
+    ast.Expression, ast.Load,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.Pow,
+    ast.UnaryOp, ast.UAdd, ast.USub, ast.Not,
+    ast.BoolOp, ast.And, ast.Or,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+    ast.IfExp, ast.Call, ast.Name,
+) + _FORMULA_LITERALS
+
+
+class InvalidFormula(ValueError):
+    """Raised when a commission formula cannot be compiled."""
+
+
+def _formula_variables(scope):
+    """Return the set of the variables available in the given scope
+    ('prestation' or 'month').
+
+    """
+    variables = set(_COMMISSIONS_VARIABLES['month'])
+    if scope == 'prestation':
+        variables.update(_COMMISSIONS_VARIABLES['prestation'])
+
+    return variables
+
+
+class CompiledFormula(object):
+    """A commission formula, parsed and checked once, which can then be
+    called with the commissions' variables as keyword arguments.
+
+    A formula is an arithmetic expression whose variables are given
+    between braces, eg: '{p_m}*{m_bc}/{m_mb}*0.06'. Only arithmetic
+    (powers with a number exponent and a base without power, see
+    _FORMULA_MAX_EXPONENT and _FORMULA_MAX_BASE),
+    comparisons, conditional expressions and the functions of
+    _FORMULA_FUNCTIONS are allowed.
+
+    """
+
+    def __init__(self, formula, scope='prestation'):
+        """Compile a formula, raise InvalidFormula if it is not valid.
+
+        Arguments:
+            formula -- text of the formula
+            scope -- 'prestation' (default) or 'month', the set of
+                     variables the formula may use
+
+        """
+        self.formula = formula
+
+        available = _formula_variables(scope)
+        variables = set()
+        expression = list()
+
+        try:
+            for literal, field, spec, conversion in \
+                    string.Formatter().parse(formula):
+                expression.append(literal)
+                if field is None:
+                    continue
+                if field not in available:
+                    raise InvalidFormula(
+                        'unknown variable in formula: {}'.format(field))
+                if spec or conversion:
+                    raise InvalidFormula(
+                        'formatting of variable in formula: {}'.format(field))
+                variables.add(field)
+                expression.append(field)
+        except ValueError as e:
+            raise InvalidFormula(str(e))
+
+        try:
+            tree = ast.parse(u''.join(expression).strip(), mode='eval')
+        except SyntaxError as e:
+            raise InvalidFormula(str(e))
+
+        called = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, _FORMULA_NODES):
+                raise InvalidFormula(
+                    'forbidden construct in formula: {}'.format(
+                        node.__class__.__name__))
+
+            if isinstance(node, ast.Call):
+                if (not isinstance(node.func, ast.Name) or
+                        node.func.id not in _FORMULA_FUNCTIONS or
+                        node.keywords or
+                        getattr(node, 'starargs', None) or
+                        getattr(node, 'kwargs', None)):
+                    raise InvalidFormula('forbidden call in formula')
+                called.add(node.func)
 
+            elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+                exponent = node.right
+                if (isinstance(exponent, ast.UnaryOp) and
+                        isinstance(exponent.op, (ast.UAdd, ast.USub))):
+                    exponent = exponent.operand
+                if not isinstance(exponent, _FORMULA_LITERALS):
+                    raise InvalidFormula(
+                        'exponent in formula is not a number')
+                value = exponent.value if hasattr(exponent, 'value') else exponent.n
+                if (isinstance(value, bool) or
+                        not isinstance(value, numbers.Real) or
+                        abs(value) > _FORMULA_MAX_EXPONENT):
+                    raise InvalidFormula(
+                        'exponent in formula is not a number between '
+                        '-{0} and {0}'.format(_FORMULA_MAX_EXPONENT))
+
+                for base_node in ast.walk(node.left):
+                    if (isinstance(base_node, ast.BinOp) and
+                            isinstance(base_node.op, ast.Pow)):
+                        raise InvalidFormula('nested powers in formula')
+                    if isinstance(base_node, _FORMULA_LITERALS):
+                        value = base_node.value if hasattr(base_node, 'value') \
+                            else base_node.n
+                        if (isinstance(value, numbers.Real) and
+                                abs(value) > _FORMULA_MAX_BASE):
+                            raise InvalidFormula(
+                                'number in the base of a power in formula is '
+                                'not between -{0} and {0}'.format(_FORMULA_MAX_BASE))
+
+            elif isinstance(node, ast.Name):
+                if node.id not in variables and node not in called:
+                    raise InvalidFormula(
+                        'unknown name in formula: {}'.format(node.id))
+
+            elif isinstance(node, _FORMULA_LITERALS):
+                value = node.value if hasattr(node, 'value') else node.n
+                if (isinstance(value, bool) or
+                        not isinstance(value, numbers.Number)):
+                    raise InvalidFormula('forbidden literal in formula')
+
+        # Wrap the checked expression in a function of its variables,
+        # so that evaluating it is a mere function call.
+        function = ast.parse(
+            'lambda {}**_: None'.format(
+                ''.join('{}, '.format(var) for var in sorted(variables))),
+            mode='eval')
+        function.body.body = tree.body
+        ast.fix_missing_locations(function)
+
+        namespace = dict(_FORMULA_FUNCTIONS)
+        namespace['__builtins__'] = {}
+        self._function = eval(compile(function, '<formula>', 'eval'),
+                              namespace)
+        self.variables = frozenset(variables)
+
+    def __call__(self, **variables):
+        """Evaluate the formula with the given variables and return the
+        result as a float.
+
+        """
+        return float(self._function(**variables))
+
+
+_compiled_formulae = OrderedDict()
+_compiled_formulae_lock = threading.Lock()
+
+
+def compile_formula(formula, scope='prestation'):
+    """Return the CompiledFormula of a formula. Compiled formulae are
+    kept in a LRU cache keyed by formula's text, bounded by
+    COMPILED_FORMULAE_CACHE_SIZE. Raise InvalidFormula if the formula is
+    not valid.
+
+    Arguments:
+        formula -- text of the formula
+        scope -- 'prestation' (default) or 'month'
+
+    """
+    key = (scope, formula)
+
+    with _compiled_formulae_lock:
+        compiled = _compiled_formulae.pop(key, None)
+        if compiled is not None:
+            _compiled_formulae[key] = compiled
+            return compiled
+
+    compiled = CompiledFormula(formula, scope)
+
+    with _compiled_formulae_lock:
+        _compiled_formulae[key] = compiled
+        while len(_compiled_formulae) > COMPILED_FORMULAE_CACHE_SIZE:
+            _compiled_formulae.popitem(last=False)
+
+    return compiled
+
+
+def formula_checker(formula):
+    """Return True if a formula is valid, and False otherwise."""
     try:
-        float(raw_result)
-    except TypeError:
+        compile_formula(str(formula))
+    except InvalidFormula:
         return False
 
     return True
+
+
+def commissions_bonuses(**variables):
+    """Return the sum of the monthly bonuses (see
+    mozfinance.COMMISSIONS_BONUSES) given the monthly variables.
+
+    """
+    bonuses = float(0)
+
+    for bonus in mozfinance.COMMISSIONS_BONUSES:
+        if isinstance(bonus, basestring):
+            bonus = compile_formula(bonus, scope='month')
+        bonuses += bonus(**variables)
+
+    return bonuses
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Helpers to work with month-based date ranges."""
+import datetime
+
+
+def month_start(date):
+    """Return the first day of the month of the given date."""
+    return datetime.date(year=date.year, month=date.month, day=1)
+
+
+def next_month_start(date):
+    """Return the first day of the month following the given date."""
+    if date.month == 12:
+        return datetime.date(year=date.year + 1, month=1, day=1)
+
+    return datetime.date(year=date.year, month=date.month + 1, day=1)
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""Opt-in instrumentation of a BusinessObject: number of SQL statements,
+cache hits/misses and time spent per operation.
+
+An operation is a call of a public method of one of the data
+repositories of the BusinessObject (eg: 'month.get',
+'prestation.salesman.add') or a block named with
+Instrumentation.operation. Nested calls are accounted to the outermost
+operation; what happens outside of any operation is accounted to
+UNATTRIBUTED.
+
+Cache accesses are also accounted by key family: the template of the
+keys, whose numbers are replaced by '{id}' (eg:
+'month:{id}:salesman:{id}:commission_total'), with the time spent
+recomputing the missed values.
+
+"""
+from contextlib import contextmanager
+from functools import wraps
+import re
+import threading
+import time
+
+from dogpile.cache.api import NoValue
+from sqlalchemy import event
+
+
+UNATTRIBUTED = '-'
+
+# Maximum number of misses of a thread waiting for their set (see
+# Instrumentation.record_cache), beyond which they are forgotten.
+MAX_PENDING_MISSES = 10000
+
+# Upper bounds (in ms) of the buckets of the timings' histograms, the
+# last bucket (None) holds every longer timing.
+HISTOGRAM_BOUNDS = [1, 5, 10, 50, 100, 500, 1000, None]
+
+
+_NUMBER_RE = re.compile(r'\d+')
+
+
+def key_family(key):
+    """Return the family (template) of a cache key."""
+    return _NUMBER_RE.sub('{id}', key)
+
+
+def is_key_store(key):
+    """Return True if a cache key is the key of a key store (eg:
+    'month:12', 'prestation:3:commission_ks') rather than of a value.
+
+    """
+    family = key_family(key)
+    return family.endswith('{id}') or family.endswith('_ks')
+
+
+class KeyFamilyStats(object):
+    """Counters of the cache accesses of one key family."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.deletes = 0
+        self.recomputes = 0
+        self.recompute_ms = float(0)
+
+    def as_dict(self):
+        """Return the stats as a (JSON-friendly) dict."""
+        accesses = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'sets': self.sets,
+            'deletes': self.deletes,
+            'hit_ratio': float(self.hits) / accesses if accesses else None,
+            'recomputes': self.recomputes,
+            'recompute_ms': self.recompute_ms,
+            'mean_recompute_ms': self.recompute_ms / self.recomputes
+                                 if self.recomputes else None}
+
+
+class OperationStats(object):
+    """Counters and timings of one operation."""
+
+    def __init__(self):
+        self.calls = 0
+        self.queries = 0
+        self.query_ms = float(0)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_sets = 0
+        self.cache_deletes = 0
+        self.total_ms = float(0)
+        self.min_ms = None
+        self.max_ms = None
+        self.histogram = [0] * len(HISTOGRAM_BOUNDS)
+
+    def add_timing(self, ms):
+        """Account a call of the operation which lasted ms."""
+        self.calls += 1
+        self.total_ms += ms
+        if self.min_ms is None or ms < self.min_ms:
+            self.min_ms = ms
+        if self.max_ms is None or ms > self.max_ms:
+            self.max_ms = ms
+
+        for i, bound in enumerate(HISTOGRAM_BOUNDS):
+            if bound is None or ms <= bound:
+                self.histogram[i] += 1
+                break
+
+    def as_dict(self):
+        """Return the stats as a (JSON-friendly) dict."""
+        return {
+            'calls': self.calls,
+            'queries': self.queries,
+            'query_ms': self.query_ms,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_sets': self.cache_sets,
+            'cache_deletes': self.cache_deletes,
+            'total_ms': self.total_ms,
+            'min_ms': self.min_ms,
+            'max_ms': self.max_ms,
+            'mean_ms': self.total_ms / self.calls if self.calls else None,
+            'histogram': [[bound, count] for bound, count
+                          in zip(HISTOGRAM_BOUNDS, self.histogram)]}
+
+
+class InstrumentedRegion(object):
+    """Proxy of a dogpile.cache region accounting its hits, misses, sets
+    and deletes to an Instrumentation.
+
+    """
+
+    def __init__(self, region, instrumentation):
+        self._region = region
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        return getattr(self._region, name)
+
+    def get(self, key, *args, **kwargs):
+        value = self._region.get(key, *args, **kwargs)
+        self._instrumentation.record_cache(
+            'miss' if isinstance(value, NoValue) else 'hit', key)
+        return value
+
+    def get_multi(self, keys, *args, **kwargs):
+        values = self._region.get_multi(keys, *args, **kwargs)
+        for key, value in zip(keys, values):
+            self._instrumentation.record_cache(
+                'miss' if isinstance(value, NoValue) else 'hit', key)
+        return values
+
+    def get_or_create(self, key, creator, *args, **kwargs):
+        created = []
+
+        def instrumented_creator():
+            start = time.time()
+            value = creator()
+            created.append((time.time() - start) * 1000)
+            return value
+
+        value = self._region.get_or_create(
+            key, instrumented_creator, *args, **kwargs)
+        if created:
+            self._instrumentation.record_cache('miss', key)
+            self._instrumentation.record_recompute(key, created[0])
+        else:
+            self._instrumentation.record_cache('hit', key)
+        return value
+
+    def set(self, key, value):
+        self._instrumentation.record_cache('set', key)
+        return self._region.set(key, value)
+
+    def set_multi(self, mapping):
+        for key in mapping:
+            self._instrumentation.record_cache('set', key)
+        return self._region.set_multi(mapping)
+
+    def delete(self, key):
+        self._instrumentation.record_cache('delete', key)
+        return self._region.delete(key)
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self._instrumentation.record_cache('delete', key)
+        return self._region.delete_multi(keys)
+
+
+class Instrumentation(object):
+    """Instrumentation of a BusinessObject. See
+    BusinessObject.enable_instrumentation.
+
+    """
+
+    def __init__(self, bo):
+        self._bo = bo
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = dict()
+        self._families = dict()
+        self._engine = None
+        self._region = None
+        self._wrapped = list()
+
+    def _stats_for(self, operation):
+        if operation not in self._stats:
+            self._stats[operation] = OperationStats()
+        return self._stats[operation]
+
+    @property
+    def current_operation(self):
+        """Name of the (outermost) operation running in this thread."""
+        return getattr(self._local, 'operation', None) or UNATTRIBUTED
+
+    def _family_for(self, key):
+        family = key_family(key)
+        if family not in self._families:
+            self._families[family] = KeyFamilyStats()
+        return self._families[family]
+
+    @property
+    def _missed(self):
+        """Dict, by key, of the times of the misses of this thread not
+        followed by a set yet.
+
+        """
+        if not hasattr(self._local, 'missed'):
+            self._local.missed = dict()
+        return self._local.missed
+
+    def record_cache(self, kind, key):
+        """Account a cache access (kind is 'hit', 'miss', 'set' or
+        'delete') of a key to the current operation and to its key
+        family. The time between the miss of a key and its following set
+        (in the same operation) is accounted as a recompute of its
+        family, except for key stores which are not recomputed.
+
+        """
+        attr = {'hit': 'hits', 'miss': 'misses',
+                'set': 'sets', 'delete': 'deletes'}[kind]
+
+        recompute_ms = None
+        if kind in ('miss', 'set') and not is_key_store(key):
+            missed = self._missed
+            if kind == 'miss':
+                if len(missed) >= MAX_PENDING_MISSES:
+                    missed.clear()
+                missed[key] = time.time()
+            elif key in missed:
+                recompute_ms = (time.time() - missed.pop(key)) * 1000
+
+        with self._lock:
+            stats = self._stats_for(self.current_operation)
+            setattr(stats, 'cache_' + attr, getattr(stats, 'cache_' + attr) + 1)
+
+            family = self._family_for(key)
+            setattr(family, attr, getattr(family, attr) + 1)
+
+        if recompute_ms is not None:
+            self.record_recompute(key, recompute_ms)
+
+    def record_recompute(self, key, ms):
+        """Account the recompute of a key which lasted ms to its key
+        family.
+
+        """
+        with self._lock:
+            family = self._family_for(key)
+            family.recomputes += 1
+            family.recompute_ms += ms
+
+    def record_query(self, ms):
+        """Account a SQL statement which lasted ms to the current
+        operation.
+
+        """
+        with self._lock:
+            stats = self._stats_for(self.current_operation)
+            stats.queries += 1
+            stats.query_ms += ms
+
+    @contextmanager
+    def operation(self, name):
+        """Context manager accounting everything done inside it to the
+        operation name (unless an operation is already running, in which
+        case everything is accounted to this one).
+
+        """
+        if getattr(self._local, 'operation', None) is not None:
+            yield self
+            return
+
+        self._local.operation = name
+        self._missed.clear()
+        start = time.time()
+        try:
+            yield self
+        finally:
+            ms = (time.time() - start) * 1000
+            self._local.operation = None
+            # Misses never followed by a set (eg: of the deltas) are
+            # forgotten with their operation.
+            self._missed.clear()
+            with self._lock:
+                self._stats_for(name).add_timing(ms)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        conn.info.setdefault('mozfinance_query_start', []).append(
+            (statement, time.time()))
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        _, start = conn.info['mozfinance_query_start'].pop()
+        self.record_query((time.time() - start) * 1000)
+
+    def _handle_error(self, context):
+        # after_cursor_execute is not called for a failed statement: its
+        # start is popped here, if it was executed at all.
+        if context.connection is None:
+            return
+        starts = context.connection.info.get('mozfinance_query_start')
+        if starts and starts[-1][0] == context.statement:
+            _, start = starts.pop()
+            self.record_query((time.time() - start) * 1000)
+
+    def _repositories(self, obj, prefix=''):
+        """Yield (name, repository) for every data repository reachable
+        from obj through public attributes.
+
+        """
+        from mozfinance.data import DataRepository
+
+        for name, value in sorted(vars(obj).items()):
+            if name.startswith('_') or not isinstance(value, DataRepository):
+                continue
+            yield prefix + name, value
+            for item in self._repositories(value, prefix + name + '.'):
+                yield item
+
+    def _wrap(self, name, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            with self.operation(name):
+                return method(*args, **kwargs)
+        return wrapper
+
+    def install(self):
+        """Hook the engine's events, wrap the cache region and the public
+        methods of the repositories.
+
+        """
+        self._engine = self._bo._dbsession.get_bind()
+        event.listen(self._engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        event.listen(self._engine, 'after_cursor_execute',
+                     self._after_cursor_execute)
+        event.listen(self._engine, 'handle_error', self._handle_error)
+
+        self._region = self._bo._dbsession.cache
+        self._bo._dbsession.cache = InstrumentedRegion(self._region, self)
+
+        for repo_name, repo in self._repositories(self._bo):
+            for name in dir(repo):
+                if name.startswith('_') or name in vars(repo):
+                    continue
+                method = getattr(repo, name)
+                if not callable(method):
+                    continue
+                setattr(repo, name, self._wrap(repo_name + '.' + name, method))
+                self._wrapped.append((repo, name))
+
+    def uninstall(self):
+        """Undo install."""
+        event.remove(self._engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        event.remove(self._engine, 'after_cursor_execute',
+                     self._after_cursor_execute)
+        event.remove(self._engine, 'handle_error', self._handle_error)
+        self._engine = None
+
+        self._bo._dbsession.cache = self._region
+        self._region = None
+
+        for repo, name in self._wrapped:
+            delattr(repo, name)
+        self._wrapped = list()
+
+    def reset(self):
+        """Forget every recorded stat."""
+        with self._lock:
+            self._stats = dict()
+            self._families = dict()
+
+    def snapshot(self):
+        """Return a dict, by operation, of the recorded stats (see
+        OperationStats.as_dict).
+
+        """
+        with self._lock:
+            return dict((operation, stats.as_dict())
+                        for operation, stats in self._stats.items())
+
+    def key_families(self):
+        """Return a dict, by key family, of the recorded cache stats (see
+        KeyFamilyStats.as_dict).
+
+        """
+        with self._lock:
+            return dict((family, stats.as_dict())
+                        for family, stats in self._families.items())
+
+    def top_key_families(self, n=10, by='recompute_ms'):
+        """Return a list of the n key families with the highest by stat
+        (eg: 'misses', 'recompute_ms', 'hits'), as (family, stats)
+        tuples.
+
+        """
+        families = sorted(self.key_families().items(),
+                          key=lambda item: item[1][by], reverse=True)
+        return families[:n]
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 import unittest
 import datetime
+import os
+import shutil
+import tempfile
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from dogpile.cache import make_region
+from dogpile.cache.api import NoValue
 
 from mozbase.util.database import transaction
 
@@ -45,3 +49,89 @@ class TestData(unittest.TestCase):
         mozfinance.data.model.Base.metadata.drop_all(self.engine)
         del self.dbsession
         del self.prestation
+
+
+class TestFileData(unittest.TestCase):
+    """Like TestData, with a database file (and no prestation), so that
+    every thread or process sees the same database.
+
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.url = 'sqlite:///' + os.path.join(self.tmp_dir, 'test.db')
+        self.engine = create_engine(self.url)
+        mozfinance.data.model.Base.metadata.create_all(self.engine)
+
+        self.dbsession = sessionmaker(bind=self.engine)()
+        self.dbsession.cache = self._cache_region()
+
+        self.biz = BusinessObject(
+            package='mozfinance.data.model',
+            dbsession=self.dbsession)
+
+        for i in range(12):
+            self.biz.month.create(date=datetime.date(year=2012, month=i+1, day=1))
+
+    def tearDown(self):
+        self.dbsession.close()
+        self.engine.dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def _cache_region(self):
+        """Return the cache region of the session."""
+        return make_region().configure('dogpile.cache.memory')
+
+
+class LedgerMixin(object):
+    """Salesmen (Johny, then Jane) on a prestation of each month of 2012,
+    of 100 * month of bills and 10 of costs, for TestData and
+    TestFileData.
+
+    """
+
+    def _populate(self, names=(u'Johny',), sectors=False):
+        """Create a salesman by name and import the prestations: Johny
+        is on every prestation, Jane on the ones of odd months. If
+        sectors, the prestations of odd months are of sector 1.
+
+        """
+        self.salesmen = []
+        for name in names:
+            salesman = self.biz.salesman.create(
+                firstname=name,
+                lastname=u'Doe')
+            self.biz.salesman.set_commissions_formulae(
+                salesman=salesman,
+                commissions_formulae={0: {0: '{p_m}*0.1', 1: '{p_m}*0.1'}})
+            self.salesmen.append(salesman)
+        self.salesman = self.salesmen[0]
+
+        self.biz.bulk.import_prestations(records=[{
+            'date': datetime.date(year=2012, month=month, day=3),
+            'client': u'Clïent',
+            'sector': month % 2 if sectors else 0,
+            'bills': [{'ref': u'F-001', 'amount': float(100 * month)}],
+            'costs': [{'reason': u'Transport', 'amount': float(10)}],
+            'salesmen': [salesman.id for salesman in self.salesmen[:month % 2 + 1]]}
+            for month in range(1, 13)])
+
+    def _cached(self, key):
+        value = self.dbsession.cache.get(key)
+        self.assertFalse(isinstance(value, NoValue), key)
+        return value
+
+    def _assert_warm(self, months_dates):
+        for month_date in months_dates:
+            month = self.biz.month.get(date=month_date)
+            presta = month.prestations.first()
+            self.assertEqual(
+                self._cached('month:{}:revenue'.format(month.id)),
+                float(100 * month_date.month))
+            self.assertEqual(
+                self._cached('prestation:{}:margin'.format(presta.id)),
+                float(100 * month_date.month - 10))
+            self.assertEqual(
+                self._cached('month:{}:salesman:{}:commission_total'.format(
+                    month.id, self.salesman.id)),
+                (100 * month_date.month - 10) * 0.1)
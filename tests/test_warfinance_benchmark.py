@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from mozfinance import benchmark
+from mozfinance.biz import BusinessObject
+from mozfinance.data.model.MonthSummary import MonthSummary
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_records(self):
+        records = list(benchmark.records(
+            years=1, prestations=2, bills=3, salesmen_ids=[1, 2]))
+        self.assertEqual(len(records), 24)
+        self.assertEqual(len(records[0]['bills']), 3)
+        self.assertTrue(1 <= len(records[0]['salesmen']) <= 2)
+
+    def test_run(self):
+        results = benchmark.run(years=1, prestations=1, bills=1,
+                                salesmen=1, repeat=1)
+        self.assertEqual(results['results']['import']['prestations'], 12)
+        for name in ['month_figures', 'year_figures', 'salesman_commissions']:
+            self.assertIn('cold', results['results'][name])
+            self.assertIn('warm', results['results'][name])
+        self.assertIn('mean', results['results']['expire_cascade'])
+        json.dumps(results)
+
+    def test_reset_cache(self):
+        dbsession = benchmark.make_session()
+        biz = BusinessObject(dbsession=dbsession, package=benchmark.PACKAGE)
+        benchmark.populate(biz, 1, 1)
+        benchmark.read_months(biz)
+        self.assertEqual(dbsession.query(MonthSummary).count(), 12)
+
+        benchmark.reset_cache(dbsession)
+        self.assertEqual(dbsession.query(MonthSummary).count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -68,6 +68,47 @@ class TestBusinessWithDatas(TestData):
         self.assertEqual(len(month.prestations.all()), 2)
         self.assertEqual(presta.total_cost, float(4))
 
+    def test_compute_month_figures(self):
+        month_date = datetime.date(year=2013, month=3, day=1)
+        month = self.biz.month.create(date=month_date)
+        self.biz.month.cost.create(month=month, amount=float(5), reason=u'NoRes')
+        self.biz.month.cost.create(
+            month=month,
+            amount=float(7),
+            reason=u'NoRes',
+            no_commission_base=True)
+
+        presta1 = Prestation(date=datetime.date(year=2013, month=3, day=2))
+        presta2 = Prestation(date=datetime.date(year=2013, month=3, day=31))
+        other_presta = Prestation(date=datetime.date(year=2013, month=4, day=1))
+        self.dbsession.add(presta1)
+        self.dbsession.add(presta2)
+        self.dbsession.add(other_presta)
+        self.dbsession.flush()
+
+        self.biz.prestation.bill.create(prestation=presta1, amount=float(12), ref=u'Bla')
+        self.biz.prestation.bill.create(prestation=presta1, amount=float(8), ref=u'Bla')
+        self.biz.prestation.bill.create(prestation=presta2, amount=float(16), ref=u'Bla')
+        self.biz.prestation.bill.create(prestation=other_presta, amount=float(99), ref=u'Bla')
+        self.biz.prestation.cost.create(prestation=presta1, amount=float(4), reason=u'Cost')
+
+        figures = self.biz.month.compute(month=month)
+
+        self.assertEqual(figures['revenue'], float(36))
+        self.assertEqual(figures['total_prestation_cost'], float(4))
+        self.assertEqual(figures['total_month_cost'], float(12))
+        self.assertEqual(figures['gross_margin'], float(32))
+        self.assertEqual(figures['net_margin'], float(20))
+        self.assertEqual(figures['commission_base'], float(27))
+        self.assertEqual(list(figures['prestations']), [presta1.id, presta2.id])
+        self.assertEqual(figures['prestations'][presta1.id]['margin'], float(16))
+
+        cache = self.dbsession.cache
+        self.assertEqual(cache.get('month:{}:revenue'.format(month.id)), float(36))
+        self.assertEqual(cache.get('month:{}:commission_base'.format(month.id)), float(27))
+        self.assertEqual(cache.get('prestation:{}:margin'.format(presta1.id)), float(16))
+        self.assertEqual(month.net_margin, float(20))
+
     def test_compute_year_net_margin(self):
         month_date = datetime.date(year=2013, month=1, day=1)
         another_month_date = datetime.date(year=2013, month=2, day=1)
@@ -105,3 +146,36 @@ class TestBusinessWithDatas(TestData):
         year = self.biz.year.get(date=another_month_date)
 
         self.assertEqual(year.net_margin, float(4000))
+
+    def test_compute_years_table(self):
+        month_date = datetime.date(year=2013, month=1, day=1)
+        another_month_date = datetime.date(year=2013, month=2, day=1)
+
+        self.biz.month.create(date=month_date)
+        self.biz.month.cost.create(month_date=month_date, amount=float(1000), reason=u'NoRes')
+        self.biz.month.create(date=another_month_date)
+
+        presta = Prestation(date=month_date)
+        self.dbsession.add(presta)
+        another_presta = Prestation(date=another_month_date)
+        self.dbsession.add(another_presta)
+        self.dbsession.commit()
+
+        self.biz.prestation.bill.create(prestation=presta, amount=float(3000), ref=u'Bla')
+        self.biz.prestation.bill.create(prestation=another_presta, amount=float(4000), ref=u'Bla')
+
+        table = self.biz.year.compute(year_ids=[2013, 2012])
+
+        self.assertEqual(len(table), 14)
+        self.assertEqual(table[0].date, datetime.date(year=2012, month=1, day=1))
+        self.assertEqual(table[12].date, month_date)
+        self.assertEqual(table[12].revenue, float(3000))
+        self.assertEqual(table[12].net_margin, float(2000))
+        self.assertEqual(table[13].gross_margin, float(4000))
+
+        cache = self.dbsession.cache
+        self.assertEqual(cache.get('year:2013:net_margin'), float(6000))
+        self.assertEqual(
+            cache.get('month:{}:revenue'.format(table[13].month_id)),
+            float(4000))
+        self.assertEqual(self.biz.year.get(date=month_date).revenue, float(7000))
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 import datetime
+import unittest
 
 from mozfinance.data.model.Prestation import Prestation
+from mozfinance.util.commissions import (
+    compile_formula, formula_checker, InvalidFormula)
 import mozfinance
 
 from . import TestData
@@ -227,3 +230,90 @@ class TestBusinessCompute(TestData):
         self.assertEqual(month.month_salesmen[0].commission_prestations, commission_ideal_p+commission_ideal_ap)
         self.assertEqual(month.month_salesmen[0].commission_bonuses, float(476))
         self.assertEqual(month.month_salesmen[0].commission_total, float(476)+commission_ideal_p+commission_ideal_ap)
+
+        commissions = self.biz.month.salesman.commissions(date=month_date)
+
+        self.assertEqual(
+            commissions[salesman.id]['commission_prestations'],
+            commission_ideal_p+commission_ideal_ap)
+        self.assertEqual(
+            commissions[a_salesman.id]['commission_prestations'],
+            commission_ideal_p)
+        self.assertEqual(
+            commissions[a_salesman.id]['commission_total'],
+            float(476)+commission_ideal_p)
+        self.assertEqual(self.dbsession.cache.get(
+            'prestation:{}:salesman:{}:commission'.format(presta.id, a_salesman.id)),
+            commission_ideal_p)
+
+    def test_get_formula_bonus(self):
+        mozfinance.COMMISSIONS_BONUSES = ['0.02*{m_bc} if {m_bc} >= 1000 else 0']
+
+        month_date = datetime.date(year=2012, month=3, day=1)
+        presta = Prestation(date=month_date, category=0, sector=0)
+        self.dbsession.add(presta)
+        self.dbsession.commit()
+
+        self.biz.prestation.bill.create(prestation=presta, ref=u'Bla', amount=float(5000))
+
+        salesman = self.biz.salesman.create(
+            firstname=u'Bas',
+            lastname=u'Gan')
+        self.biz.salesman.set_commissions_formulae(
+            salesman=salesman,
+            commissions_formulae={0: {0: '{p_m}*0.1'}})
+        self.biz.prestation.salesman.add(
+            prestation=presta,
+            salesman=salesman)
+
+        month = self.biz.month.get(date=month_date)
+
+        self.assertEqual(month.month_salesmen[0].commission_prestations, float(500))
+        self.assertEqual(month.month_salesmen[0].commission_bonuses, float(100))
+
+
+class TestCommissionsFormulae(unittest.TestCase):
+
+    def test_compile_formula(self):
+        formula = compile_formula('{p_m}*{m_bc}/{m_mb}*0.06')
+        self.assertEqual(formula.variables, frozenset(['p_m', 'm_bc', 'm_mb']))
+        self.assertEqual(
+            formula(p_m=float(24700), m_bc=float(47600), m_mb=float(49600), p_pv=float(1)),
+            float(24700)*float(47600)/float(49600)*float(0.06))
+        self.assertTrue(compile_formula('{p_m}*{m_bc}/{m_mb}*0.06') is formula)
+
+    def test_compile_conditional_formula(self):
+        formula = compile_formula('max({p_m}, 0)*0.1 if {m_bc} > 100 else 0')
+        self.assertEqual(formula(p_m=float(-5), m_bc=float(200)), float(0))
+        self.assertEqual(formula(p_m=float(50), m_bc=float(200)), float(5))
+        self.assertEqual(formula(p_m=float(50), m_bc=float(50)), float(0))
+
+    def test_compile_month_formula(self):
+        self.assertEqual(compile_formula('{m_bc}*0.5', scope='month')(m_bc=float(4)), float(2))
+        with self.assertRaises(InvalidFormula):
+            compile_formula('{p_m}', scope='month')
+
+    def test_formula_checker(self):
+        self.assertTrue(formula_checker('{p_m}*{m_bc}/{m_mb}*0.06'))
+        self.assertTrue(formula_checker('0'))
+        self.assertFalse(formula_checker('bla'))
+        self.assertFalse(formula_checker('{unknown}*2'))
+        self.assertFalse(formula_checker('{p_m}*'))
+        self.assertFalse(formula_checker('__import__("os").getcwd()'))
+        self.assertFalse(formula_checker('{p_m}.real'))
+        self.assertFalse(formula_checker('"{p_m}"'))
+
+    def test_compile_power_formula(self):
+        self.assertEqual(compile_formula('{p_m}**2*0.01')(p_m=float(10)), float(1))
+        self.assertEqual(compile_formula('{p_m}**-1')(p_m=float(4)), 0.25)
+        self.assertEqual(compile_formula('{p_m}**0.5')(p_m=float(16)), float(4))
+        self.assertFalse(formula_checker('{p_m}**{m_bc}'))
+        self.assertFalse(formula_checker('{p_m}**1000'))
+        self.assertFalse(formula_checker('9**(9**9)'))
+
+    def test_compile_nested_power_formula(self):
+        self.assertFalse(formula_checker('(((9**100)**100)**100)**100'))
+        self.assertFalse(formula_checker('({p_m}**2+1)**2'))
+        self.assertFalse(formula_checker('10000**100'))
+        self.assertFalse(formula_checker('(10000*{p_m})**100'))
+        self.assertTrue(formula_checker('(1.06+{p_m})**12'))
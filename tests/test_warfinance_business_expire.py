@@ -1,6 +1,14 @@
  # -*- coding: utf-8 -*-
 import datetime
 
+from dogpile.cache import make_region
+from dogpile.cache.api import NoValue
+
+from mozbase.util.database import transaction
+
+from mozfinance.data import ExpireBatch
+from mozfinance.data.dependencies import dependents, formula_nodes
+from mozfinance.data.model.MonthSummary import MonthSummary
 from mozfinance.data.model.Prestation import Prestation
 
 from . import TestData
@@ -28,3 +36,350 @@ class TestBusinessExpire(TestData):
         self.biz.prestation.bill.update(bill=bill, amount=float(17))
         p2 = self.biz.prestation.get(prestation=p1)
         self.assertEqual(p2.margin, float(17))
+
+    def test_month_expire_batch(self):
+        month = self.biz.month.get(date=datetime.date(year=2012, month=5, day=1))
+        self.biz.prestation.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(13))
+        self.biz.month.compute(month=month)
+        self.biz.year.compute(year_ids=[2012])
+
+        cache = self.dbsession.cache
+        calls = []
+        get_multi, delete_multi = cache.get_multi, cache.delete_multi
+
+        def counting_get_multi(keys):
+            calls.append('get_multi')
+            return get_multi(keys)
+
+        def counting_delete_multi(keys):
+            calls.append('delete_multi')
+            return delete_multi(keys)
+
+        cache.get_multi = counting_get_multi
+        cache.delete_multi = counting_delete_multi
+        try:
+            dropped = self.biz.month._expire(month=month)
+        finally:
+            del cache.get_multi
+            del cache.delete_multi
+
+        self.assertEqual(calls, ['get_multi', 'delete_multi'])
+        # 6 month's figures and 3 year's figures.
+        self.assertEqual(dropped, 9)
+        self.assertTrue(isinstance(
+            cache.get('month:{}:revenue'.format(month.id)), NoValue))
+        self.assertTrue(isinstance(cache.get('year:2012:revenue'), NoValue))
+
+    def test_expire_batch(self):
+        cache = self.dbsession.cache
+        cache.set('prestation:{}:margin'.format(self.prestation.id), float(1))
+        cache.set(
+            'prestation:{}'.format(self.prestation.id),
+            ['prestation:{}:margin'.format(self.prestation.id)])
+
+        batch = ExpireBatch(cache)
+        batch.add(self.prestation)
+        batch.add(self.prestation)
+        batch.add(self.prestation, '_com_ksk_template')
+
+        self.assertEqual(batch.execute(), 1)
+        self.assertEqual(batch.execute(), 0)
+        self.assertEqual(batch.dropped, 1)
+
+    def test_nested_expire(self):
+        month = self.biz.month.get(date=self.prestation.date)
+        month.revenue
+
+        with self.biz.month._expiring() as batch:
+            self.assertEqual(batch.dropped, None)
+            self.assertEqual(self.biz.month._expire(month=month), None)
+        # 6 month's figures.
+        self.assertEqual(batch.dropped, 6)
+
+    def _count_month_expires(self):
+        expired = []
+        month_expire = self.biz.month._expire
+
+        def counting_expire(**kwargs):
+            expired.append(kwargs['month'])
+            return month_expire(**kwargs)
+
+        self.biz.month._expire = counting_expire
+        return expired
+
+    def test_deferred_expire(self):
+        month = self.biz.month.get(date=datetime.date(year=2012, month=5, day=1))
+        self.assertEqual(month.revenue, float(0))
+
+        expired = self._count_month_expires()
+        with self.biz.deferred_expire():
+            with transaction(self.dbsession):
+                for i in range(5):
+                    self.biz.prestation.bill.create(
+                        prestation=self.prestation,
+                        ref=u'Bla',
+                        amount=float(10),
+                        commit=False)
+                self.assertEqual(expired, [])
+
+        self.assertEqual(expired, [month])
+        self.assertEqual(month.revenue, float(50))
+
+    def test_deferred_expire_rollback(self):
+        expired = self._count_month_expires()
+
+        with self.assertRaises(ValueError):
+            with self.biz.deferred_expire():
+                with transaction(self.dbsession):
+                    self.biz.prestation.bill.create(
+                        prestation=self.prestation,
+                        ref=u'Bla',
+                        amount=float(10),
+                        commit=False)
+                    raise ValueError
+
+        self.assertEqual(expired, [])
+
+
+class TestIncrementalExpire(TestData):
+
+    def setUp(self):
+        TestData.setUp(self)
+        self.biz.incremental = True
+        self.month = self.biz.month.get(date=datetime.date(year=2012, month=5, day=1))
+        self.year = self.biz.year.get(date=self.month.date)
+        self.salesman = self.biz.salesman.create(
+            firstname=u'Johny',
+            lastname=u'Doe')
+        self.biz.salesman.set_commissions_formulae(
+            salesman=self.salesman,
+            commissions_formulae={0: {0: '{p_m}*0.1'}})
+        self.biz.prestation.salesman.add(
+            prestation=self.prestation,
+            salesman=self.salesman)
+        self.biz.month.refresh_summaries()
+
+    def tearDown(self):
+        TestData.tearDown(self)
+        del self.month
+        del self.year
+
+    def _cached(self, key):
+        return self.dbsession.cache.get(key)
+
+    def _warm(self):
+        self.biz.warm_cache()
+
+    def _assert_consistent(self):
+        """Cached figures are the same as computed ones."""
+        names = ['revenue', 'total_prestation_cost', 'total_month_cost',
+                 'gross_margin', 'net_margin', 'commission_base']
+        cached = dict((name, getattr(self.month, name)) for name in names)
+        self.dbsession.cache = make_region().configure('dogpile.cache.memory')
+        computed = self.biz.month.compute(month=self.month)
+        for name in names:
+            self.assertEqual(cached[name], computed[name], name)
+
+    def test_bill_deltas(self):
+        self._warm()
+        self.biz.prestation.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(13))
+
+        self.assertEqual(
+            self._cached('prestation:{}:margin'.format(self.prestation.id)),
+            float(13))
+        self.assertEqual(
+            self._cached('month:{}:revenue'.format(self.month.id)), float(13))
+        self.assertEqual(self._cached('year:2012:net_margin'), float(13))
+        self.assertTrue(isinstance(
+            self._cached('month:{}:salesman:{}:commission_total'.format(
+                self.month.id, self.salesman.id)),
+            NoValue))
+        self.assertEqual(self.month.month_salesmen[0].commission_total, 1.3)
+
+        summary = self.dbsession.query(MonthSummary)\
+            .filter(MonthSummary.month_id == self.month.id).one()
+        self.assertTrue(summary.fresh)
+        self.assertEqual(summary.revenue, float(13))
+
+        self._assert_consistent()
+
+    def test_cost_deltas(self):
+        self._warm()
+        bill = self.biz.prestation.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(13))
+        self.biz.prestation.cost.create(
+            prestation=self.prestation,
+            reason=u'Reason',
+            amount=float(3))
+        cost = self.biz.month.cost.create(
+            month=self.month,
+            reason=u'Reason',
+            amount=float(2))
+        self.biz.month.cost.update(cost=cost, amount=float(4))
+        self.biz.prestation.bill.update(bill=bill, amount=float(20))
+
+        self.assertEqual(
+            self._cached('month:{}:net_margin'.format(self.month.id)),
+            float(13))
+        self.assertEqual(
+            self._cached('month:{}:commission_base'.format(self.month.id)),
+            float(13))
+        self.assertEqual(self._cached('year:2012:gross_margin'), float(17))
+        self._assert_consistent()
+
+        self.biz.prestation.bill.remove(bill=bill)
+        self.biz.month.cost.remove(cost=cost)
+        self.assertEqual(
+            self._cached('month:{}:net_margin'.format(self.month.id)),
+            float(-3))
+        self._assert_consistent()
+
+    def test_rollback(self):
+        self._warm()
+        self.biz.prestation.bill.create(
+            commit=False,
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(13))
+        self.assertEqual(
+            self._cached('month:{}:revenue'.format(self.month.id)), float(13))
+        self.dbsession.rollback()
+
+        for key in ['prestation:{}:margin'.format(self.prestation.id),
+                    'month:{}:revenue'.format(self.month.id),
+                    'year:2012:net_margin']:
+            self.assertTrue(isinstance(self._cached(key), NoValue), key)
+        self.assertEqual(self.month.revenue, float(0))
+        self.assertEqual(self.year.net_margin, float(0))
+
+    def test_commit_keeps_deltas(self):
+        self._warm()
+        self.biz.prestation.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(13))
+        self.dbsession.rollback()
+
+        self.assertEqual(
+            self._cached('month:{}:revenue'.format(self.month.id)), float(13))
+
+    def test_missing_keys_stay_missing(self):
+        self.biz.prestation.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(13))
+        self.assertTrue(isinstance(
+            self._cached('month:{}:revenue'.format(self.month.id)), NoValue))
+        self.assertEqual(self.month.revenue, float(13))
+
+
+class TestDependencies(TestData):
+
+    def setUp(self):
+        TestData.setUp(self)
+        self.month = self.biz.month.get(date=datetime.date(year=2012, month=5, day=1))
+        self.salesmen = []
+        for name, formula in [(u'Margin', '{p_m}*0.1'),
+                              (u'Costs', '{p_m}*0.1 - {m_tcm}*0.01')]:
+            salesman = self.biz.salesman.create(
+                firstname=name,
+                lastname=u'Doe')
+            self.biz.salesman.set_commissions_formulae(
+                salesman=salesman,
+                commissions_formulae={0: {0: formula}})
+            self.biz.prestation.salesman.add(
+                prestation=self.prestation,
+                salesman=salesman)
+            self.salesmen.append(salesman)
+        self.biz.prestation.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(100))
+
+    def tearDown(self):
+        TestData.tearDown(self)
+        del self.month
+        del self.salesmen
+
+    def _commission_key(self, salesman):
+        return 'month:{}:salesman:{}:commission_total'.format(
+            self.month.id, salesman.id)
+
+    def _cached(self, key):
+        return not isinstance(self.dbsession.cache.get(key), NoValue)
+
+    def test_dependents(self):
+        affected = dependents(['month.costs'])
+        self.assertIn('month.net_margin', affected)
+        self.assertIn('year.net_margin', affected)
+        self.assertIn('prestation_salesman.commission', affected)
+        self.assertNotIn('month.revenue', affected)
+        self.assertNotIn('month.commission_base', affected)
+        self.assertIn('month.commission_base', dependents(['month.base_costs']))
+
+    def test_formula_nodes(self):
+        self.assertIn('prestation.margin', formula_nodes('{p_m}'))
+        self.assertNotIn('month.total_month_cost', formula_nodes('{p_m}'))
+        self.assertIn('month.total_month_cost', formula_nodes('bla'))
+
+    def test_month_cost_out_of_base(self):
+        self.biz.warm_cache()
+        self.assertTrue(self._cached('month:{}:revenue'.format(self.month.id)))
+
+        self.biz.month.cost.create(
+            month=self.month, amount=float(20), reason=u'Reason',
+            no_commission_base=True)
+
+        self.assertTrue(self._cached('month:{}:revenue'.format(self.month.id)))
+        self.assertFalse(self._cached('month:{}:net_margin'.format(self.month.id)))
+        self.assertTrue(self._cached('month:{}:commission_base'.format(self.month.id)))
+        self.assertTrue(self._cached(self._commission_key(self.salesmen[0])))
+        self.assertFalse(self._cached(self._commission_key(self.salesmen[1])))
+
+        commissions = [month_sm.commission_total
+                       for month_sm in self.month.month_salesmen]
+        self.assertEqual(sorted(commissions), [4.9, 5.0])
+
+    def test_bill_expires_month(self):
+        self.biz.warm_cache()
+        self.biz.prestation.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(100))
+
+        self.assertFalse(self._cached('month:{}:revenue'.format(self.month.id)))
+        self.assertFalse(self._cached('year:2012:revenue'))
+        self.assertFalse(self._cached(self._commission_key(self.salesmen[0])))
+        self.assertEqual(self.month.revenue, float(200))
+
+    def test_ratio_expires_one_commission(self):
+        self.biz.warm_cache()
+        self.biz.prestation.salesman.set_ratio(
+            prestation=self.prestation,
+            salesman=self.salesmen[0],
+            ratio=float(1))
+
+        self.assertTrue(self._cached('month:{}:revenue'.format(self.month.id)))
+        self.assertFalse(self._cached(self._commission_key(self.salesmen[0])))
+        self.assertTrue(self._cached(self._commission_key(self.salesmen[1])))
+        self.assertEqual(
+            self.month.month_salesmen[0].commission_total, float(10))
+
+    def test_removed_salesman(self):
+        self.biz.warm_cache()
+        self.biz.prestation.salesman.remove(
+            prestation=self.prestation,
+            salesman=self.salesmen[1])
+
+        key = 'prestation:{}:salesman:{}:commission'.format(
+            self.prestation.id, self.salesmen[1].id)
+        self.assertFalse(self._cached(key))
+        self.assertFalse(self._cached(self._commission_key(self.salesmen[0])))
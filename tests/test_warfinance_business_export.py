@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import csv
+import datetime
+from StringIO import StringIO
+
+from mozfinance.data import export
+from . import LedgerMixin, TestData
+
+
+class TestBusinessExportLedger(LedgerMixin, TestData):
+
+    def setUp(self):
+        TestData.setUp(self)
+        self._populate()
+
+    def tearDown(self):
+        TestData.tearDown(self)
+        del self.salesmen
+        del self.salesman
+
+    def test_rows(self):
+        rows = list(self.biz.export_ledger(chunk_size=5, batch_size=2))
+
+        # The prestation of TestData has no bill, no cost and no salesman.
+        self.assertEqual(len(rows), 13)
+        self.assertEqual(
+            [row['date'] for row in rows],
+            sorted(row['date'] for row in rows))
+
+        may = [row for row in rows if row['date'].month == 5 and row['salesmen']][0]
+        self.assertEqual(may['selling_price'], float(500))
+        self.assertEqual(may['total_cost'], float(10))
+        self.assertEqual(may['margin'], float(490))
+        self.assertEqual(may['salesmen'], [self.salesman.id])
+        self.assertEqual(may['commissions'], [float(49)])
+        self.assertEqual(may['total_commission'], float(49))
+
+    def test_range(self):
+        rows = list(self.biz.export_ledger(
+            start=datetime.date(year=2012, month=3, day=1),
+            end=datetime.date(year=2012, month=4, day=30)))
+
+        self.assertEqual([row['date'].month for row in rows], [3, 4])
+
+    def test_csv(self):
+        output = StringIO()
+        count = self.biz.export_ledger(output, end=datetime.date(year=2012, month=2, day=1))
+        self.assertEqual(count, 2)
+
+        rows = list(csv.reader(StringIO(output.getvalue())))
+        self.assertEqual(rows[0], export.COLUMNS)
+        self.assertEqual(rows[2][1], '2012-02-03')
+        self.assertEqual(rows[2][2].decode('utf-8'), u'Clïent')
+        self.assertEqual(float(rows[2][7]), float(190))
+        self.assertEqual(rows[2][8], str(self.salesman.id))
+
+    def test_csv_floats(self):
+        self.assertEqual(
+            export._csv_value([1, 10.0 / 3]), '1 ' + repr(10.0 / 3))
+
+    def test_does_not_cache(self):
+        list(self.biz.export_ledger())
+        self.assertEqual(self.dbsession.cache.backend._cache, {})
+
+    def test_unknown_format(self):
+        self.assertRaises(
+            AttributeError, self.biz.export_ledger, StringIO(), format='bla')
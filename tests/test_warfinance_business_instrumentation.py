@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from mozfinance.util.instrumentation import (
+    InstrumentedRegion, UNATTRIBUTED, is_key_store, key_family)
+
+from . import TestData
+
+
+class TestBusinessInstrumentation(TestData):
+
+    def setUp(self):
+        TestData.setUp(self)
+        self.month_date = datetime.date(year=2012, month=5, day=1)
+
+    def tearDown(self):
+        TestData.tearDown(self)
+
+    def test_disabled(self):
+        self.assertEqual(self.biz.stats(), None)
+        self.assertFalse(isinstance(self.dbsession.cache, InstrumentedRegion))
+
+    def test_operations(self):
+        instrumentation = self.biz.enable_instrumentation()
+        self.assertTrue(isinstance(self.dbsession.cache, InstrumentedRegion))
+
+        self.biz.prestation.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(13))
+        self.biz.month.get(date=self.month_date)
+
+        stats = self.biz.stats()
+        self.assertEqual(stats['prestation.bill.create']['calls'], 1)
+        self.assertTrue(stats['prestation.bill.create']['queries'] > 0)
+        self.assertEqual(stats['month.get']['calls'], 1)
+        self.assertEqual(stats['month.get']['queries'], 1)
+        self.assertEqual(
+            sum(count for _, count in stats['month.get']['histogram']), 1)
+
+        final_stats = self.biz.disable_instrumentation()
+        self.assertEqual(final_stats, instrumentation.snapshot())
+        self.assertEqual(self.biz.stats(), None)
+        self.assertFalse(isinstance(self.dbsession.cache, InstrumentedRegion))
+        self.assertFalse('get' in vars(self.biz.month))
+
+    def test_context_manager(self):
+        with self.biz.instrumented('revenue') as instrumentation:
+            month = self.biz.month.get(date=self.month_date)
+            month.revenue
+            month.revenue
+
+        stats = instrumentation.snapshot()
+        self.assertEqual(stats.keys(), ['revenue'])
+        self.assertEqual(stats['revenue']['calls'], 1)
+        self.assertTrue(stats['revenue']['cache_hits'] >= 1)
+        self.assertTrue(stats['revenue']['cache_misses'] >= 1)
+        self.assertTrue(stats['revenue']['queries'] >= 2)
+        self.assertEqual(self.biz.stats(), None)
+
+    def test_failed_query(self):
+        with self.biz.instrumented('failure') as instrumentation:
+            connection = self.dbsession.connection()
+            with self.assertRaises(OperationalError):
+                connection.execute('SELECT * FROM nowhere')
+            self.assertEqual(connection.info['mozfinance_query_start'], [])
+
+        self.assertEqual(instrumentation.snapshot()['failure']['queries'], 1)
+
+    def test_unattributed(self):
+        month = self.biz.month.get(date=self.month_date)
+        with self.biz.instrumented() as instrumentation:
+            month.revenue
+
+        stats = instrumentation.snapshot()
+        self.assertTrue(stats[UNATTRIBUTED]['cache_misses'] >= 1)
+        self.assertEqual(stats[UNATTRIBUTED]['calls'], 0)
+
+
+class TestCacheTelemetry(TestData):
+
+    def setUp(self):
+        TestData.setUp(self)
+        self.month_date = datetime.date(year=2012, month=5, day=1)
+
+    def tearDown(self):
+        TestData.tearDown(self)
+
+    def test_key_family(self):
+        self.assertEqual(
+            key_family('month:12:salesman:3:commission_total'),
+            'month:{id}:salesman:{id}:commission_total')
+
+    def test_key_families(self):
+        self.assertEqual(self.biz.cache_report(), None)
+
+        month = self.biz.month.get(date=self.month_date)
+        self.biz.enable_instrumentation()
+        month.revenue
+        month.revenue
+
+        families = self.biz._instrumentation.key_families()
+        revenue = families['month:{id}:revenue']
+        self.assertEqual(revenue['misses'], 1)
+        self.assertEqual(revenue['hits'], 1)
+        self.assertEqual(revenue['hit_ratio'], 0.5)
+        self.assertEqual(revenue['recomputes'], 1)
+        self.assertTrue(revenue['recompute_ms'] >= 0)
+
+        report = self.biz.cache_report(n=2, by='misses')
+        self.assertEqual(len(report), 2)
+        self.assertTrue(report[0][1]['misses'] >= report[1][1]['misses'])
+
+        self.biz.disable_instrumentation()
+
+    def test_key_stores(self):
+        self.assertTrue(is_key_store('month:12'))
+        self.assertTrue(is_key_store('prestation:3:salesman:4'))
+        self.assertTrue(is_key_store('month:12:commission_ks'))
+        self.assertFalse(is_key_store('month:12:revenue'))
+
+        month = self.biz.month.get(date=self.month_date)
+        with self.biz.instrumented() as instrumentation:
+            month.revenue
+
+            self.assertEqual(instrumentation._missed, dict())
+
+        families = instrumentation.key_families()
+        self.assertEqual(families['month:{id}']['recomputes'], 0)
+        self.assertEqual(families['month:{id}:revenue']['recomputes'], 1)
+
+    def test_missed_cleared(self):
+        with self.biz.instrumented() as instrumentation:
+            with instrumentation.operation('deltas'):
+                self.dbsession.cache.get('prestation:1:margin')
+                self.assertEqual(
+                    instrumentation._missed.keys(), ['prestation:1:margin'])
+            self.assertEqual(instrumentation._missed, dict())
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from sqlalchemy.orm.exc import NoResultFound
+
+from . import LedgerMixin, TestFileData
+
+
+class TestBusinessReadPool(LedgerMixin, TestFileData):
+
+    def setUp(self):
+        TestFileData.setUp(self)
+        self._populate()
+
+    def test_months(self):
+        dates = [datetime.date(year=2012, month=i, day=1) for i in range(1, 13)]
+        with self.biz.read_pool(workers=4) as pool:
+            months = pool.gather(pool.month.figures_many(dates))
+
+        self.assertEqual([month['date'] for month in months], dates)
+        for month in months:
+            self.assertEqual(month['revenue'], float(100 * month['date'].month))
+            self.assertEqual(
+                month['commissions'][self.salesman.id]['commission_total'],
+                (100 * month['date'].month - 10) * 0.1)
+
+        # The figures were cached in the shared cache.
+        self._assert_warm(dates)
+
+    def test_year_and_statement(self):
+        with self.biz.read_pool(workers=2) as pool:
+            year, statement = pool.gather([
+                pool.year.figures(date=datetime.date(year=2012, month=1, day=1)),
+                pool.salesman.commission_statement(
+                    salesman_id=self.salesman.id,
+                    end=datetime.date(year=2012, month=2, day=1))])
+
+        self.assertEqual(year['revenue'], float(7800))
+        self.assertEqual(statement['salesman'], self.salesman.id)
+        self.assertEqual(len(statement['months']), 2)
+        self.assertAlmostEqual(statement['commission_total'], 9 + 19)
+
+    def test_error(self):
+        with self.biz.read_pool(workers=1) as pool:
+            result = pool.month.figures(date=datetime.date(year=2013, month=1, day=1))
+            self.assertRaises(NoResultFound, result.get)
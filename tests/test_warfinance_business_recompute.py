@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+
+from mozfinance.data.model import *
+from mozfinance.data.recompute import make_cache_region
+from . import LedgerMixin, TestFileData
+
+
+class TestBusinessRecompute(LedgerMixin, TestFileData):
+
+    def setUp(self):
+        TestFileData.setUp(self)
+        self._populate()
+
+    def _cache_region(self):
+        # A dbm cache, shared by the processes.
+        self.cache = {
+            'backend': 'dogpile.cache.dbm',
+            'arguments': {'filename': os.path.join(self.tmp_dir, 'cache.dbm')}}
+        return make_cache_region(self.cache)
+
+    def test_recompute(self):
+        self.biz.warm_cache()
+
+        # A formula change which does not expire anything.
+        self.dbsession.query(AssPrestationSalesman.PrestationSalesman)\
+            .update({'formula': '{p_m}*0.2'})
+        self.dbsession.commit()
+
+        progress = []
+        recomputed = self.biz.recompute(
+            cache=self.cache,
+            processes=2,
+            chunk_size=5,
+            progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(recomputed, {'months': 12, 'years': 1})
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(progress[-1], (12, 12))
+
+        for month_date in [datetime.date(year=2012, month=i, day=1)
+                           for i in range(1, 13)]:
+            month = self.biz.month.get(date=month_date)
+            self.assertAlmostEqual(
+                self._cached('month:{}:salesman:{}:commission_total'.format(
+                    month.id, self.salesman.id)),
+                (100 * month_date.month - 10) * 0.2)
+        self.assertEqual(self._cached('year:2012:revenue'), float(7800))
+
+    def test_recompute_range(self):
+        recomputed = self.biz.recompute(
+            start=datetime.date(year=2012, month=3, day=1),
+            end=datetime.date(year=2012, month=4, day=1),
+            cache=self.cache,
+            processes=2,
+            chunk_size=1)
+        self.assertEqual(recomputed, {'months': 2, 'years': 1})
+        self._assert_warm([datetime.date(year=2012, month=i, day=1)
+                           for i in [3, 4]])
+
+    def test_cache_required(self):
+        self.assertRaises(TypeError, self.biz.recompute)
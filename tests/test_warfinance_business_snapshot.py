@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from . import LedgerMixin, TestData
+
+
+class TestBusinessSnapshot(LedgerMixin, TestData):
+
+    def setUp(self):
+        TestData.setUp(self)
+        self._populate(names=[u'Johny', u'Jane'], sectors=True)
+
+        self.snapshot = self.biz.snapshot()
+
+    def tearDown(self):
+        TestData.tearDown(self)
+        del self.salesmen
+        del self.salesman
+        del self.snapshot
+
+    def test_columns(self):
+        # The prestation of TestData has no bill and no cost.
+        self.assertEqual(len(self.snapshot), 13)
+        self.assertEqual(sum(self.snapshot.selling_price), float(7800))
+        self.assertEqual(len(self.snapshot.commission), 18)
+
+    def test_sum_by_sector(self):
+        revenue = self.snapshot.sum('selling_price', by='sector')
+        self.assertEqual(revenue, {0: float(4200), 1: float(3600)})
+        self.assertEqual(
+            self.snapshot.sum('count', by='sector'), {0: 7, 1: 6})
+
+    def test_sum_by_month(self):
+        margins = self.snapshot.sum('margin', by='month')
+        self.assertEqual(len(margins), 12)
+        self.assertEqual(
+            margins[datetime.date(year=2012, month=5, day=1)], float(490))
+
+    def test_commissions_by_salesman_and_quarter(self):
+        commissions = self.snapshot.sum(
+            'commission', by=('salesman', 'quarter'),
+            where={'quarter': [(2012, 1), (2012, 2)]})
+
+        johny, jane = [salesman.id for salesman in self.salesmen]
+        # Q1: Johny alone on February (19), both share January and
+        # March ((9 + 29) / 2 each).
+        self.assertAlmostEqual(commissions[(johny, (2012, 1))], 19 + 19)
+        self.assertAlmostEqual(commissions[(jane, (2012, 1))], 19)
+        self.assertEqual(len(commissions), 4)
+
+    def test_revenue_by_salesman(self):
+        revenue = self.snapshot.sum(
+            'selling_price', by='salesman', where={'year': 2012})
+        johny, jane = [salesman.id for salesman in self.salesmen]
+        self.assertEqual(revenue[johny], float(7800))
+        self.assertEqual(revenue[jane], float(3600))
+
+    def test_range(self):
+        snapshot = self.biz.snapshot(
+            start=datetime.date(year=2012, month=6, day=1),
+            end=datetime.date(year=2012, month=6, day=1))
+        self.assertEqual(
+            snapshot.sum('selling_price', by='year'), {2012: float(600)})
+
+    def test_unknown_key(self):
+        self.assertRaises(AttributeError, self.snapshot.sum, 'margin', 'bla')
+        self.assertRaises(AttributeError, self.snapshot.sum, 'bla', 'sector')
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from dogpile.cache.api import NoValue
+
+import mozfinance
+from . import LedgerMixin, TestData, TestFileData
+
+
+class TestBusinessWarmCache(LedgerMixin, TestData):
+
+    def setUp(self):
+        TestData.setUp(self)
+        self._populate()
+
+    def test_warm_range(self):
+        warmed = self.biz.warm_cache(
+            start=datetime.date(year=2012, month=3, day=15),
+            end=datetime.date(year=2012, month=5, day=2),
+            chunk_size=2)
+        self.assertEqual(warmed, {'months': 3, 'years': 1})
+
+        self._assert_warm([datetime.date(year=2012, month=i, day=1)
+                           for i in [3, 4, 5]])
+        feb = self.biz.month.get(date=datetime.date(year=2012, month=2, day=1))
+        self.assertTrue(isinstance(
+            self.dbsession.cache.get('month:{}:salesman:{}:commission_total'.format(
+                feb.id, self.salesman.id)),
+            NoValue))
+        self.assertEqual(self._cached('year:2012:revenue'), float(7800))
+
+    def test_warm_everything(self):
+        warmed = self.biz.warm_cache()
+        self.assertEqual(warmed, {'months': 12, 'years': 1})
+        self._assert_warm([datetime.date(year=2012, month=i, day=1)
+                           for i in range(1, 13)])
+
+    def test_warm_bonuses(self):
+        mozfinance.COMMISSIONS_BONUSES = ['0.02*{m_bc} if {m_bc} >= 1000 else 0']
+        try:
+            other = self.biz.salesman.create(
+                firstname=u'Jane',
+                lastname=u'Doe')
+            self.biz.warm_cache(
+                start=datetime.date(year=2012, month=12, day=1))
+        finally:
+            mozfinance.COMMISSIONS_BONUSES = []
+
+        month = self.biz.month.get(date=datetime.date(year=2012, month=12, day=1))
+        self.assertAlmostEqual(
+            self._cached('month:{}:salesman:{}:commission_bonuses'.format(
+                month.id, other.id)),
+            0.02 * 1190)
+        self.assertAlmostEqual(
+            self._cached('month:{}:salesman:{}:commission_total'.format(
+                month.id, other.id)),
+            0.02 * 1190)
+
+
+class TestBusinessWarmCacheParallel(LedgerMixin, TestFileData):
+
+    def setUp(self):
+        TestFileData.setUp(self)
+        self._populate()
+
+    def test_warm_parallel(self):
+        warmed = self.biz.warm_cache(workers=3, chunk_size=2)
+        self.assertEqual(warmed, {'months': 12, 'years': 1})
+        self._assert_warm([datetime.date(year=2012, month=i, day=1)
+                           for i in range(1, 13)])
+        self.assertEqual(self._cached('year:2012:revenue'), float(7800))
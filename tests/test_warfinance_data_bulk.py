@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+
+from sqlalchemy import event
+from voluptuous import MultipleInvalid
+
+from mozfinance.data.model import *
+from . import TestData
+
+
+class TestBulkData(TestData):
+
+    def setUp(self):
+        TestData.setUp(self)
+        self.bulk_data = self.biz.bulk
+        self.salesman = self.biz.salesman.create(
+            firstname=u'Johny',
+            lastname=u'Doe')
+        self.biz.salesman.set_commissions_formulae(
+            salesman=self.salesman,
+            commissions_formulae={0: {0: '{p_m}*0.1'}})
+
+    def tearDown(self):
+        TestData.tearDown(self)
+        del self.bulk_data
+
+
+class TestImportPrestations(TestBulkData):
+
+    def _records(self, count):
+        for i in range(count):
+            yield {
+                'date': datetime.date(year=2012, month=3, day=i % 28 + 1),
+                'client': u'Client',
+                'bills': [
+                    {'ref': u'F-001', 'amount': float(100)},
+                    {'ref': u'F-002', 'amount': float(50)}],
+                'costs': [{'reason': u'Transport', 'amount': float(30)}],
+                'salesmen': [self.salesman.id]}
+
+    def test_import(self):
+        month = self.biz.month.get(date=datetime.date(year=2012, month=3, day=1))
+        self.assertEqual(month.revenue, float(0))
+
+        imported = self.bulk_data.import_prestations(
+            records=self._records(7),
+            chunk_size=3)
+
+        self.assertEqual(imported, 7)
+        self.assertEqual(month.prestations.count(), 7)
+        self.assertEqual(month.revenue, float(1050))
+        self.assertEqual(month.total_prestation_cost, float(210))
+
+        presta = month.prestations.first()
+        self.assertEqual(len(presta.bills), 2)
+        self.assertEqual(presta.costs[0].reason, u'Transport')
+        self.assertEqual(presta.salesmen_count, 1)
+        self.assertEqual(presta.prestation_salesmen[0].formula, '{p_m}*0.1')
+        self.assertEqual(presta.prestation_salesmen[0].commission, float(12))
+
+    def test_import_custom_salesman(self):
+        self.bulk_data.import_prestations(records=[{
+            'date': datetime.date(year=2012, month=4, day=2),
+            'client': u'Client',
+            'salesmen': [{
+                'salesman_id': self.salesman.id,
+                'ratio': 0.5,
+                'formula': u'{p_m}*0.2'}]}])
+
+        presta_sm = self.dbsession\
+            .query(AssPrestationSalesman.PrestationSalesman)\
+            .one()
+        self.assertEqual(presta_sm.ratio, 0.5)
+        self.assertEqual(presta_sm.formula, '{p_m}*0.2')
+
+    def test_import_wrong_record(self):
+        with self.assertRaises(MultipleInvalid):
+            self.bulk_data.import_prestations(records=[{
+                'date': datetime.date(year=2012, month=4, day=2),
+                'client': u'Client',
+                'bills': [{'ref': u'F-001', 'amount': 12}]}])
+
+    def test_inserts_by_chunk(self):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT'):
+                statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            self.bulk_data.import_prestations(
+                records=self._records(20),
+                chunk_size=10)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        # One per prestation and per cost, then bills, costs_prestation
+        # and prestations_salesmen for each chunk.
+        self.assertEqual(len(statements), 20 + 20 + 3 * 2)
+
+        month = self.biz.month.get(date=datetime.date(year=2012, month=3, day=1))
+        for presta in month.prestations:
+            self.assertEqual(len(presta.bills), 2)
+            self.assertEqual(len(presta.costs), 1)
+            self.assertEqual(presta.costs[0].prestation, presta)
+            self.assertEqual(presta.salesmen, [self.salesman])
+
+    def test_import_missing_formula(self):
+        records = list(self._records(4))
+        records[2]['sector'] = 1
+
+        with self.assertRaises(MultipleInvalid) as cm:
+            self.bulk_data.import_prestations(records=records, chunk_size=2)
+        self.assertTrue('record 2' in str(cm.exception))
+
+    def test_import_duplicate_salesman(self):
+        records = list(self._records(2))
+        records[1]['salesmen'] = [self.salesman.id, {'salesman_id': self.salesman.id}]
+
+        with self.assertRaises(MultipleInvalid) as cm:
+            self.bulk_data.import_prestations(records=records)
+        self.assertTrue('record 1' in str(cm.exception))
+
+    def test_import_unknown_salesman(self):
+        records = list(self._records(2))
+        records[1]['salesmen'] = [{'salesman_id': 999, 'formula': '{p_m}*0.2'}]
+
+        with self.assertRaises(MultipleInvalid) as cm:
+            self.bulk_data.import_prestations(records=records)
+        self.assertTrue('record 1' in str(cm.exception))
+        self.assertEqual(
+            self.dbsession.query(AssPrestationSalesman.PrestationSalesman).count(), 0)
+
+    def test_import_invalid_formula(self):
+        records = list(self._records(2))
+        records[1]['salesmen'] = [{
+            'salesman_id': self.salesman.id,
+            'formula': '__import__("os")'}]
+
+        with self.assertRaises(MultipleInvalid) as cm:
+            self.bulk_data.import_prestations(records=records)
+        self.assertTrue('record 1' in str(cm.exception))
+
+    def test_no_records(self):
+        with self.assertRaises(TypeError):
+            self.bulk_data.import_prestations()
+
+
+if __name__ == '__main__':
+    unittest.main()
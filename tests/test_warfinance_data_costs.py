@@ -112,5 +112,61 @@ class TestRemoveCost(TestCostsData):
             self.dbsession.query(CostPrestation.CostPrestation).one()
 
 
+class TestCostsMonthBatch(TestCostsData):
+
+    def setUp(self):
+        TestCostsData.setUp(self)
+        self.mcost_data = self.biz.month.cost
+        self.month = self.dbsession.query(Month.Month).first()
+        self.other_month = self.dbsession.query(Month.Month)\
+            .filter(Month.Month.id != self.month.id).first()
+
+    def tearDown(self):
+        TestCostsData.tearDown(self)
+        del self.mcost_data
+        del self.month
+        del self.other_month
+
+    def test_create_expires(self):
+        self.assertEqual(self.month.total_month_cost, float(0))
+        self.mcost_data.create(
+            month=self.month, amount=float(3), reason=u'Reason')
+        self.assertEqual(self.month.total_month_cost, float(3))
+
+    def test_create_no_expire(self):
+        self.assertEqual(self.month.total_month_cost, float(0))
+        self.mcost_data.create(
+            month=self.month, amount=float(3), reason=u'Reason',
+            expire=False)
+        self.assertEqual(self.month.total_month_cost, float(0))
+
+    def test_actions_batch(self):
+        cost = self.mcost_data.create(
+            month=self.month, amount=float(3), reason=u'Reason')
+        to_remove = self.mcost_data.create(
+            month=self.month, amount=float(4), reason=u'Reason')
+        foreign = self.mcost_data.create(
+            month=self.other_month, amount=float(5), reason=u'Reason')
+        self.assertEqual(self.month.total_month_cost, float(7))
+        self.assertEqual(self.other_month.total_month_cost, float(5))
+
+        self.mcost_data.actions_batch(
+            month=self.month,
+            create=[{'amount': float(10), 'reason': u'Created'}],
+            update=[{'cost_id': cost.id, 'amount': float(1)},
+                    {'cost_id': foreign.id, 'amount': float(2)}],
+            remove=[{'cost_id': to_remove.id}])
+
+        self.assertEqual(self.month.total_month_cost, float(11))
+        self.assertEqual(self.other_month.total_month_cost, float(2))
+        self.assertEqual(self.month.costs.count(), 2)
+
+    def test_actions_batch_unknown_cost(self):
+        with self.assertRaises(NoResultFound):
+            self.mcost_data.actions_batch(
+                month=self.month,
+                remove=[{'cost_id': 1234}])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,13 @@
  # -*- coding: utf-8 -*-
 from datetime import date
 
+from dogpile.cache import make_region
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
 from voluptuous import MultipleInvalid
 
+from mozbase.util.database import transaction
+
 from mozfinance.data.month import MonthData
 from mozfinance.data.model import *
 from . import TestData
@@ -39,6 +44,19 @@ class TestCreateMonth(TestMonthsData):
             self.month_data.create(
                 date=date(year=2008, month=10, day=14))
 
+    def test_plain_session(self):
+        # The models work with any session providing a cache.
+        dbsession = sessionmaker(bind=self.engine)()
+        dbsession.cache = make_region().configure('dogpile.cache.memory')
+        try:
+            month = dbsession.query(Month.Month)\
+                .filter(Month.Month.date == date(year=2012, month=12, day=1))\
+                .one()
+            self.assertEqual(month.revenue, float(0))
+            self.assertEqual(month.month_salesmen, [])
+        finally:
+            dbsession.close()
+
 
 class TestUpdateMonth(TestMonthsData):
 
@@ -53,6 +71,205 @@ class TestUpdateMonth(TestMonthsData):
                 cost=float(27000))
 
 
+class TestMonthPrestations(TestMonthsData):
+
+    def test_prestations_range(self):
+        month = self.month_data.get(date=date(year=2012, month=11, day=1))
+        last_presta = Prestation.Prestation(date=date(year=2012, month=11, day=30))
+        next_presta = Prestation.Prestation(date=date(year=2012, month=12, day=1))
+        self.dbsession.add(last_presta)
+        self.dbsession.add(next_presta)
+        self.dbsession.flush()
+
+        self.assertEqual(month.prestations.all(), [last_presta])
+        self.assertEqual(last_presta.month, month)
+        self.assertEqual(next_presta.month.date, date(year=2012, month=12, day=1))
+
+    def test_prestation_month_memoized(self):
+        presta = Prestation.Prestation(date=date(year=2012, month=11, day=30))
+        self.dbsession.add(presta)
+        self.dbsession.flush()
+        month = presta.month
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            for i in range(3):
+                self.assertEqual(presta.month, month)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+        self.assertEqual(statements, [])
+
+        presta.date = date(year=2012, month=12, day=1)
+        self.assertEqual(presta.month.date, date(year=2012, month=12, day=1))
+
+    def test_prestation_without_month(self):
+        presta = Prestation.Prestation(date=date(year=2011, month=3, day=4))
+        self.dbsession.add(presta)
+        self.dbsession.flush()
+
+        self.assertTrue(presta.month is None)
+
+
+class TestMonthSalesmen(TestMonthsData):
+
+    def setUp(self):
+        TestMonthsData.setUp(self)
+        self.month = self.month_data.get(date=date(year=2012, month=5, day=1))
+        self.salesmen = [self.biz.salesman.create(firstname=name, lastname=u'Doe')
+                         for name in [u'John', u'Jane', u'Jack']]
+        for salesman in self.salesmen:
+            self.biz.salesman.set_commissions_formulae(
+                salesman=salesman,
+                commissions_formulae={0: {0: '{p_m}*0.1'}})
+
+    def tearDown(self):
+        TestMonthsData.tearDown(self)
+        del self.month
+        del self.salesmen
+
+    def test_only_month_salesmen(self):
+        self.assertEqual(self.month.month_salesmen, [])
+
+        self.biz.prestation.salesman.add(
+            prestation=self.prestation,
+            salesman=self.salesmen[2])
+        self.biz.prestation.salesman.add(
+            prestation=self.prestation,
+            salesman=self.salesmen[0])
+
+        self.assertEqual(
+            [month_sm.salesman for month_sm in self.month.month_salesmen],
+            [self.salesmen[0], self.salesmen[2]])
+
+        other_month = self.month_data.get(date=date(year=2012, month=6, day=1))
+        self.assertEqual(other_month.month_salesmen, [])
+
+    def test_expire_month_salesmen(self):
+        self.biz.prestation.salesman.add(
+            prestation=self.prestation,
+            salesman=self.salesmen[0])
+        for month_sm in self.month.month_salesmen:
+            month_sm.commission_total
+
+        self.assertEqual(
+            self.month_data.salesman._expire(month=self.month), 3)
+
+    def test_removed_salesman_deferred(self):
+        self.biz.prestation.salesman.add(
+            prestation=self.prestation,
+            salesman=self.salesmen[0])
+        self.month.month_salesmen[0].commission_total
+        key = 'month:{}:salesman:{}:commission_total'.format(
+            self.month.id, self.salesmen[0].id)
+        self.assertTrue(key in self.dbsession.cache.backend._cache)
+
+        with self.biz.deferred_expire():
+            self.biz.prestation.salesman.remove(
+                prestation=self.prestation,
+                salesman=self.salesmen[0])
+
+        self.assertFalse(key in self.dbsession.cache.backend._cache)
+
+
+class TestMonthSummaries(TestMonthsData):
+
+    def setUp(self):
+        TestMonthsData.setUp(self)
+        self.month = self.month_data.get(date=date(year=2012, month=5, day=1))
+
+    def tearDown(self):
+        TestMonthsData.tearDown(self)
+        del self.month
+
+    def _summary(self):
+        return self.dbsession.query(MonthSummary.MonthSummary)\
+            .filter(MonthSummary.MonthSummary.month_id == self.month.id)\
+            .first()
+
+    def _cold_cache(self):
+        self.dbsession.cache = make_region().configure('dogpile.cache.memory')
+
+    def test_refreshed_on_read(self):
+        self.month_data.cost.create(
+            month=self.month, amount=float(3), reason=u'Reason')
+        self.assertEqual(self._summary(), None)
+
+        self.assertEqual(self.month.net_margin, float(-3))
+        summary = self._summary()
+        self.assertTrue(summary.fresh)
+        self.assertEqual(summary.total_month_cost, float(3))
+        self.assertEqual(summary.net_margin, float(-3))
+
+    def test_stale_on_month_expire(self):
+        self.month_data.refresh_summaries()
+        self.month_data.cost.create(
+            month=self.month, amount=float(3), reason=u'Reason')
+
+        summary = self._summary()
+        self.assertFalse(summary.fresh)
+        self.assertEqual(summary.total_month_cost, float(0))
+
+        self.assertEqual(self.month.total_month_cost, float(3))
+        self.assertTrue(self._summary().fresh)
+        self.assertEqual(self._summary().total_month_cost, float(3))
+
+    def test_stale_deferred(self):
+        self.month_data.refresh_summaries()
+        self.dbsession.commit()
+
+        with self.biz.deferred_expire():
+            with transaction(self.dbsession):
+                self.month_data.cost.create(
+                    month=self.month, amount=float(3), reason=u'Reason',
+                    commit=False)
+
+        self.assertFalse(self.dbsession.new or self.dbsession.dirty)
+        self.dbsession.rollback()
+        self.assertFalse(self._summary().fresh)
+
+    def test_read_when_fresh(self):
+        self.month_data.cost.create(
+            month=self.month, amount=float(3), reason=u'Reason')
+        self.month.revenue
+        self._summary().revenue = float(42)
+        self.dbsession.commit()
+
+        self._cold_cache()
+        self.assertEqual(self.month.revenue, float(42))
+
+    def test_stale_on_prestation_expire(self):
+        self.month_data.refresh_summaries()
+        self.biz.prestation.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(13))
+        self.assertFalse(self._summary().fresh)
+
+        self._cold_cache()
+        self.assertEqual(self.month.revenue, float(13))
+        year = self.biz.year.get(date=self.month.date)
+        self.assertEqual(year.revenue, float(13))
+        self.assertTrue(self._summary().fresh)
+        self.assertEqual(self._summary().revenue, float(13))
+
+        self.month_data._expire(month=self.month)
+        self.assertFalse(self._summary().fresh)
+
+    def test_refresh_summaries(self):
+        refreshed = self.month_data.refresh_summaries(
+            start=date(year=2012, month=3, day=12),
+            end=date(year=2012, month=5, day=1))
+        self.assertEqual(refreshed, 3)
+        self.assertEqual(
+            self.dbsession.query(MonthSummary.MonthSummary).count(), 3)
+        self.assertTrue(self._summary().fresh)
+
+
 class TestRemoveMonth(TestMonthsData):
     def test_basique(self):
         month = self.month_data.get(date=date(year=2012, month=12, day=1))
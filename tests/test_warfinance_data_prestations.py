@@ -1,7 +1,12 @@
  # -*- coding: utf-8 -*-
+import datetime
+
+from dogpile.cache import make_region
+from sqlalchemy import event
 from sqlalchemy.orm.exc import NoResultFound
 
 from mozfinance.data.model import *
+from mozfinance.util.commissions import InvalidFormula
 
 from . import TestData
 
@@ -27,7 +32,7 @@ class TestPrestationsSalesmen(TestPrestationsData):
             lastname=u'Doe')
         com_form = {}
         com_form[0] = {}
-        com_form[0][0] = 'bla'
+        com_form[0][0] = '{p_m}*0.1'
         self.salesmen_data.set_commissions_formulae(
             salesman=self.salesman,
             commissions_formulae=com_form)
@@ -39,7 +44,7 @@ class TestPrestationsSalesmen(TestPrestationsData):
         presta_sm = self.presta_data.salesman._get(
             salesman=self.salesman,
             prestation=self.prestation)
-        self.assertEqual(presta_sm.formula, 'bla')
+        self.assertEqual(presta_sm.formula, '{p_m}*0.1')
 
     def test_readd_salesman(self):
         self.presta_data.salesman.add(
@@ -73,6 +78,141 @@ class TestPrestationsSalesmen(TestPrestationsData):
         with self.assertRaises(NoResultFound):
             self.dbsession.query(AssPrestationSalesman.PrestationSalesman).one()
 
+    def test_salesmen_count(self):
+        other = self.salesmen_data.create(
+            firstname=u'Jane',
+            lastname=u'Doe')
+        self.salesmen_data.set_commissions_formulae(
+            salesman=other,
+            commissions_formulae={0: {0: '{p_m}*0.2'}})
+
+        for salesman in [self.salesman, other, self.salesman]:
+            self.presta_data.salesman.add(
+                prestation=self.prestation,
+                salesman=salesman)
+        self.assertEqual(self.prestation.salesmen_count, 2)
+
+        self.presta_data.salesman.remove(
+            prestation=self.prestation,
+            salesman=other)
+        self.assertEqual(self.prestation.salesmen_count, 1)
+
+        self.salesmen_data.remove(salesman=self.salesman)
+        self.assertEqual(self.prestation.salesmen_count, 0)
+
+    def test_default_ratio_without_count_query(self):
+        self.salesmen_data.set_commissions_formulae(
+            salesman=self.salesman,
+            commissions_formulae={0: {0: '{p_m}*0.1'}})
+        self.presta_data.salesman.add(
+            prestation=self.prestation,
+            salesman=self.salesman)
+        self.presta_data.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(100))
+        presta_sm = self.prestation.prestation_salesmen[0]
+        self.prestation.margin
+        self.prestation.month.commission_base
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            self.assertEqual(presta_sm.commission, float(10))
+            self.assertFalse(self.presta_data.salesman.add(
+                prestation=self.prestation,
+                salesman=self.salesman))
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        self.assertEqual(
+            [statement for statement in statements if 'count(' in statement], [])
+
+    def _orm_salesman(self, firstname):
+        """Create a salesman associated with the prestation through the
+        ORM, leaving its salesmen_count untouched.
+
+        """
+        salesman = self.salesmen_data.create(
+            firstname=firstname,
+            lastname=u'Doe')
+        self.salesmen_data.set_commissions_formulae(
+            salesman=salesman,
+            commissions_formulae={0: {0: '{p_m}*0.1'}})
+        presta_sm = AssPrestationSalesman.PrestationSalesman(
+            prestation=self.prestation,
+            salesman=salesman,
+            formula='{p_m}*0.1')
+        self.dbsession.add(presta_sm)
+        self.dbsession.flush()
+        return salesman
+
+    def test_remove_unset_count(self):
+        salesman = self._orm_salesman(u'Jane')
+        self.assertEqual(self.prestation.salesmen_count, 0)
+
+        self.presta_data.salesman.remove(
+            prestation=self.prestation,
+            salesman=salesman)
+        self.dbsession.flush()
+        self.assertEqual(self.prestation.prestation_salesmen_query.count(), 0)
+        self.assertEqual(self.prestation.salesmen_count, 0)
+
+    def test_readd_unset_count(self):
+        salesman = self._orm_salesman(u'Jane')
+
+        self.assertFalse(self.presta_data.salesman.add(
+            prestation=self.prestation,
+            salesman=salesman))
+        self.assertEqual(self.prestation.prestation_salesmen_query.count(), 1)
+
+    def test_add_null_count(self):
+        self._orm_salesman(u'Jane')
+        self._orm_salesman(u'Jack')
+        self.prestation.salesmen_count = None
+        self.presta_data.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(100))
+
+        self.presta_data.salesman.add(
+            prestation=self.prestation,
+            salesman=self.salesman)
+        self.assertEqual(self.prestation.salesmen_count, 3)
+
+        presta_sm = self.presta_data.salesman._get(
+            prestation=self.prestation,
+            salesman=self.salesman)
+        month = self.biz.month.get(date=self.prestation.date)
+        self.assertAlmostEqual(presta_sm.commission, float(10) / 3)
+        self.assertAlmostEqual(
+            self.biz.month.salesman.commissions(month=month)[self.salesman.id]
+                ['commission_prestations'],
+            float(10) / 3)
+
+    def test_delete_salesman_expires_commissions(self):
+        other = self._orm_salesman(u'Jane')
+        self.presta_data.salesman.add(
+            prestation=self.prestation,
+            salesman=self.salesman)
+        self.presta_data.bill.create(
+            prestation=self.prestation,
+            ref=u'Bla',
+            amount=float(100))
+        presta_sm = self.presta_data.salesman._get(
+            prestation=self.prestation,
+            salesman=other)
+        self.assertEqual(presta_sm.commission, float(5))
+
+        self.salesmen_data.remove(salesman=self.salesman)
+        self.dbsession.flush()
+        self.assertEqual(self.prestation.salesmen_count, 1)
+        self.assertEqual(presta_sm.commission, float(10))
+
     def test_correct_delete_prestation(self):
         self.presta_data.salesman.add(
             prestation=self.prestation,
@@ -96,7 +236,7 @@ class TestFormulae(TestPrestationsData):
             lastname=u'Louis')
         com_form = {}
         com_form[0] = {}
-        com_form[0][0] = 'bla'
+        com_form[0][0] = '{p_m}*0.1'
         self.salesmen_data.set_commissions_formulae(
             salesman=self.salesman,
             commissions_formulae=com_form)
@@ -108,11 +248,11 @@ class TestFormulae(TestPrestationsData):
         self.presta_data.salesman.set_formula(
             salesman=self.salesman,
             prestation=self.prestation,
-            formula='lol')
+            formula='{p_m}*0.2')
         presta_sm = self.presta_data.salesman._get(
             salesman=self.salesman,
             prestation=self.prestation)
-        self.assertEqual(presta_sm.formula, 'lol')
+        self.assertEqual(presta_sm.formula, '{p_m}*0.2')
 
     def test_wrong_custom_formula(self):
         with self.assertRaises(AttributeError):
@@ -121,15 +261,26 @@ class TestFormulae(TestPrestationsData):
                 prestation=self.prestation,
                 formula=u'lol')
 
+    def test_invalid_custom_formula(self):
+        with self.assertRaises(InvalidFormula):
+            self.presta_data.salesman.set_formula(
+                salesman=self.salesman,
+                prestation=self.prestation,
+                formula='__import__("os")')
+        presta_sm = self.presta_data.salesman._get(
+            salesman=self.salesman,
+            prestation=self.prestation)
+        self.assertEqual(presta_sm.formula, '{p_m}*0.1')
+
     def test_no_update_set_custom_formula(self):
         self.presta_data.salesman.set_formula(
             salesman=self.salesman,
             prestation=self.prestation,
-            formula='lol')
+            formula='{p_m}*0.2')
         a_bool = self.presta_data.salesman.set_formula(
             salesman=self.salesman,
             prestation=self.prestation,
-            formula='lol')
+            formula='{p_m}*0.2')
         self.assertTrue(not a_bool)
 
     def test_backup_default_formula(self):
@@ -137,16 +288,16 @@ class TestFormulae(TestPrestationsData):
         presta_sm = self.presta_data.salesman._get(
             salesman=self.salesman,
             prestation=self.prestation)
-        self.assertEqual(presta_sm.formula, 'bla')
+        self.assertEqual(presta_sm.formula, '{p_m}*0.1')
         # We change the formula
         self.presta_data.salesman.set_formula(
             salesman=self.salesman,
             prestation=self.prestation,
-            formula='lol')
+            formula='{p_m}*0.2')
         presta_sm = self.presta_data.salesman._get(
             salesman=self.salesman,
             prestation=self.prestation)
-        self.assertEqual(presta_sm.formula, 'lol')
+        self.assertEqual(presta_sm.formula, '{p_m}*0.2')
         # And we go back to default
         self.presta_data.salesman.set_formula(
             salesman=self.salesman,
@@ -155,7 +306,7 @@ class TestFormulae(TestPrestationsData):
         presta_sm = self.presta_data.salesman._get(
             salesman=self.salesman,
             prestation=self.prestation)
-        self.assertEqual(presta_sm.formula, 'bla')
+        self.assertEqual(presta_sm.formula, '{p_m}*0.1')
 
 
 class TestRatios(TestPrestationsData):
@@ -168,7 +319,7 @@ class TestRatios(TestPrestationsData):
             lastname=u'Louis')
         com_form = {}
         com_form[0] = {}
-        com_form[0][0] = 'bla'
+        com_form[0][0] = '{p_m}*0.1'
         self.salesmen_data.set_commissions_formulae(
             salesman=self.salesman,
             commissions_formulae=com_form)
@@ -233,5 +384,80 @@ class TestRatios(TestPrestationsData):
         self.assertTrue(not a_bool)
 
 
+class TestLoadingProfiles(TestPrestationsData):
+
+    def setUp(self):
+        TestPrestationsData.setUp(self)
+        salesman = self.biz.salesman.create(
+            firstname=u'Johny',
+            lastname=u'Doe')
+        self.biz.salesman.set_commissions_formulae(
+            salesman=salesman,
+            commissions_formulae={0: {0: '{p_m}*0.1'}})
+
+        self.prestations = [self.prestation]
+        for day in range(1, 21):
+            presta = Prestation.Prestation(
+                date=datetime.date(year=2012, month=6, day=day))
+            self.dbsession.add(presta)
+            self.prestations.append(presta)
+        self.dbsession.flush()
+        for presta in self.prestations:
+            self.presta_data.bill.create(
+                prestation=presta, ref=u'Bla', amount=float(10))
+            self.presta_data.cost.create(
+                prestation=presta, amount=float(3), reason=u'Reason')
+            self.presta_data.salesman.add(
+                prestation=presta, salesman=salesman)
+
+        self.ids = [presta.id for presta in self.prestations]
+        self.dbsession.expunge_all()
+        self.dbsession.cache = make_region().configure('dogpile.cache.memory')
+
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+        TestPrestationsData.tearDown(self)
+        del self.prestations
+        del self.ids
+        del self.statements
+
+    def _count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def test_commissions(self):
+        prestations = self.presta_data.load('commissions')
+        for presta in prestations:
+            self.assertEqual(presta.margin, float(7))
+            self.assertEqual([s.firstname for s in presta.salesmen], [u'Johny'])
+
+        self.assertEqual(len(prestations), 21)
+        self.assertEqual(len(self.statements), 4)
+
+    def test_financials_range(self):
+        prestations = self.presta_data.load(
+            'financials', start=datetime.date(year=2012, month=6, day=1))
+        for presta in prestations:
+            self.assertEqual(presta.selling_price, float(10))
+            self.assertEqual(presta.total_cost, float(3))
+
+        self.assertEqual(len(prestations), 20)
+        self.assertEqual(len(self.statements), 3)
+
+    def test_list_ids(self):
+        ids = self.ids[:3]
+        prestations = self.presta_data.load(prestations_ids=ids)
+        for presta in prestations:
+            presta.salesmen[0].lastname
+
+        self.assertEqual([presta.id for presta in prestations], ids)
+        self.assertEqual(len(self.statements), 2)
+
+    def test_unknown_profile(self):
+        self.assertRaises(AttributeError, self.presta_data.load, 'bla')
+
+
 if __name__ == '__main__':
     unittest.main()
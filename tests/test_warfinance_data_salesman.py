@@ -1,10 +1,15 @@
  # -*- coding: utf-8 -*-
+import datetime
+
+from sqlalchemy import Column, Integer, MetaData, PickleType, Table, event
 from sqlalchemy.orm.exc import NoResultFound
 from voluptuous import MultipleInvalid
 
 from mozfinance.data.salesman import SalesmanData
 from mozfinance.data.model import *
-from . import TestData
+from mozfinance.data.model.FakeAssMonthSalesman import MonthSalesman
+from mozfinance.util.commissions import InvalidFormula
+from . import LedgerMixin, TestData
 
 
 class TestSalesmenData(TestData):
@@ -90,5 +95,188 @@ class TestSalesmenBase(TestSalesmenData):
         self.salesmen_data.remove(
             salesman=salesman)
 
+
+class TestCommissionsFormulae(TestSalesmenData):
+
+    def setUp(self):
+        TestSalesmenData.setUp(self)
+        self.salesman = self.salesmen_data.create(
+            firstname=u'Johny',
+            lastname=u'Doe')
+
+    def tearDown(self):
+        TestSalesmenData.tearDown(self)
+        del self.salesman
+
+    def test_normalized(self):
+        self.salesmen_data.set_commissions_formulae(
+            salesman=self.salesman,
+            commissions_formulae={0: {0: '{p_m}*0.1', 1: '{p_m}*0.2'}})
+
+        rows = self.dbsession.query(
+                SalesmanFormula.SalesmanFormula.category,
+                SalesmanFormula.SalesmanFormula.sector,
+                SalesmanFormula.SalesmanFormula.formula)\
+            .order_by(SalesmanFormula.SalesmanFormula.sector)\
+            .all()
+        self.assertEqual(rows, [(0, 0, '{p_m}*0.1'), (0, 1, '{p_m}*0.2')])
+        self.assertEqual(
+            self.salesman.commissions_formulae,
+            {0: {0: '{p_m}*0.1', 1: '{p_m}*0.2'}})
+        self.assertEqual(self.salesman.formula(0, 1), '{p_m}*0.2')
+        self.assertRaises(KeyError, self.salesman.formula, 1, 0)
+
+    def test_update(self):
+        self.salesmen_data.set_commissions_formulae(
+            salesman=self.salesman,
+            commissions_formulae={0: {0: '{p_m}*0.1', 1: '{p_m}*0.2'}})
+        self.salesmen_data.set_commissions_formulae(
+            salesman=self.salesman,
+            commissions_formulae={0: {0: '{p_m}*0.3'}, 2: {0: '{p_pv}*0.1'}})
+
+        self.assertEqual(
+            self.salesman.commissions_formulae,
+            {0: {0: '{p_m}*0.3'}, 2: {0: '{p_pv}*0.1'}})
+        self.assertEqual(
+            self.dbsession.query(SalesmanFormula.SalesmanFormula).count(), 2)
+
+        self.assertFalse(self.salesmen_data.set_commissions_formulae(
+            salesman=self.salesman,
+            commissions_formulae={0: {0: '{p_m}*0.3'}, 2: {0: '{p_pv}*0.1'}}))
+
+    def test_invalid_formula(self):
+        with self.assertRaises(InvalidFormula):
+            self.salesmen_data.set_commissions_formulae(
+                salesman=self.salesman,
+                commissions_formulae={0: {0: '{p_m}*0.1', 1: 'bla'}})
+        self.assertEqual(self.salesman.commissions_formulae, None)
+
+    def test_wrong_structure(self):
+        for commissions_formulae in [[], {0: '{p_m}'}, {0: {0: 12}}, {'0': {0: '{p_m}'}}]:
+            with self.assertRaises(AttributeError):
+                self.salesmen_data.set_commissions_formulae(
+                    salesman=self.salesman,
+                    commissions_formulae=commissions_formulae)
+
+    def test_remove_salesman(self):
+        self.salesmen_data.set_commissions_formulae(
+            salesman=self.salesman,
+            commissions_formulae={0: {0: '{p_m}*0.1'}})
+        self.salesmen_data.remove(salesman=self.salesman)
+        self.assertEqual(
+            self.dbsession.query(SalesmanFormula.SalesmanFormula).count(), 0)
+
+    def test_assign(self):
+        self.salesman.commissions_formulae = {0: {0: '{p_m}*0.1'}}
+        self.assertEqual(self.salesman.formula(0, 0), '{p_m}*0.1')
+
+        self.salesman.commissions_formulae = None
+        self.dbsession.flush()
+        self.assertEqual(self.salesman.commissions_formulae, None)
+        self.assertEqual(
+            self.dbsession.query(SalesmanFormula.SalesmanFormula).count(), 0)
+
+        with self.assertRaises(InvalidFormula):
+            self.salesman.commissions_formulae = {0: {0: 'bla'}}
+
+    def test_create_with_formulae(self):
+        salesman = Salesman.Salesman(
+            firstname=u'Jane',
+            lastname=u'Doe',
+            commissions_formulae={1: {2: '{p_m}*0.2'}})
+        self.dbsession.add(salesman)
+        self.dbsession.flush()
+
+        self.assertEqual(salesman.formula(1, 2), '{p_m}*0.2')
+
+    def test_migrate(self):
+        self.assertEqual(self.salesmen_data.migrate_commissions_formulae(), 0)
+
+        other = self.salesmen_data.create(
+            firstname=u'Jane',
+            lastname=u'Doe')
+        self.salesmen_data.set_commissions_formulae(
+            salesman=other,
+            commissions_formulae={0: {0: '{p_m}*0.3'}})
+
+        self.dbsession.execute(
+            'ALTER TABLE salesmen ADD COLUMN commissions_formulae BLOB')
+        legacy_salesmen = Table(
+            'salesmen', MetaData(),
+            Column('id', Integer),
+            Column('commissions_formulae', PickleType))
+        for salesman in [self.salesman, other]:
+            self.dbsession.execute(
+                legacy_salesmen.update()
+                .where(legacy_salesmen.c.id == salesman.id)
+                .values(commissions_formulae={0: {0: '{p_m}*0.1', 1: '{p_m}*0.2'}}))
+
+        self.assertEqual(self.salesmen_data.migrate_commissions_formulae(), 1)
+        self.assertEqual(
+            self.salesman.commissions_formulae,
+            {0: {0: '{p_m}*0.1', 1: '{p_m}*0.2'}})
+        self.assertEqual(other.commissions_formulae, {0: {0: '{p_m}*0.3'}})
+
+        self.assertEqual(self.salesmen_data.migrate_commissions_formulae(), 0)
+
+
+class TestCommissionStatement(LedgerMixin, TestSalesmenData):
+
+    def setUp(self):
+        TestSalesmenData.setUp(self)
+        self._populate(names=[u'Johny', u'Jane'])
+
+    def tearDown(self):
+        TestSalesmenData.tearDown(self)
+        del self.salesmen
+        del self.salesman
+
+    def test_statement(self):
+        statement = self.salesmen_data.commission_statement(
+            salesman=self.salesmen[1],
+            start=datetime.date(year=2012, month=1, day=1),
+            end=datetime.date(year=2012, month=3, day=31))
+
+        self.assertEqual(statement['salesman'], self.salesmen[1])
+        self.assertEqual(len(statement['months']), 3)
+        self.assertEqual(statement['months'][1]['prestations'], [])
+
+        january = statement['months'][0]
+        self.assertEqual(len(january['prestations']), 1)
+        self.assertEqual(january['prestations'][0]['margin'], float(90))
+        self.assertEqual(january['prestations'][0]['ratio'], 0.5)
+        self.assertEqual(january['commission_total'], 4.5)
+        self.assertEqual(statement['commission_total'], 4.5 + 14.5)
+
+    def test_matches_month_salesmen(self):
+        statements = self.salesmen_data.commission_statements()
+        self.assertEqual(sorted(statements), [s.id for s in self.salesmen])
+
+        for salesman in self.salesmen:
+            for month_statement in statements[salesman.id]['months']:
+                month_sm = MonthSalesman(month_statement['month'], salesman)
+                self.assertEqual(
+                    month_statement['commission_total'],
+                    month_sm.commission_total)
+
+    def test_queries(self):
+        statements = []
+        engine = self.dbsession.get_bind()
+        for salesman in self.salesmen:
+            self.dbsession.refresh(salesman)
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            self.salesmen_data.commission_statements(self.salesmen)
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+
+        # Months, figures (3 grouped queries) and associations.
+        self.assertEqual(len(statements), 5)
+
+
 if __name__ == '__main__':
     unittest.main()